@@ -0,0 +1,130 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from md_store import append_text, atomic_write
+
+# ----------------------------
+# Content-addressed, versioned artifact store (behind save_markdown)
+# ----------------------------
+#   <root>/blobs/<sha[:2]>/<sha>.gz      gzip'd content, written once per distinct content
+#   <root>/manifests/<scope>.jsonl       one line per saved version: name, sha256, size, at
+#
+# A scope is a conversation (thread_id), so parallel sessions never share a manifest and
+# never overwrite each other's files. Manifests are append-only: a version is one O_APPEND
+# write of a short line (atomic across processes), version N of a name is its N-th line, and
+# readers parse only the bytes appended since their last look. Saving content identical to
+# the name's latest version is a no-op.
+
+_SCOPE_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def safe_scope(scope: Optional[str]) -> str:
+    cleaned = _SCOPE_RE.sub("_", (scope or "").strip()).strip(".")
+    return cleaned or "default"
+
+
+@dataclass(frozen=True)
+class ArtifactVersion:
+    name: str
+    version: int
+    sha256: str
+    size: int
+    at: float
+
+
+class ArtifactStore:
+    def __init__(self, root: str | os.PathLike):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        # scope -> (bytes of the manifest already parsed, {name: [ArtifactVersion, ...]})
+        self._manifests: dict[str, tuple[int, dict[str, list[ArtifactVersion]]]] = {}
+        self.saved = 0
+        self.unchanged = 0
+        self.blobs_written = 0
+
+    def _blob_path(self, sha: str) -> Path:
+        return self.root / "blobs" / sha[:2] / f"{sha}.gz"
+
+    def _manifest_path(self, scope: str) -> Path:
+        return self.root / "manifests" / f"{safe_scope(scope)}.jsonl"
+
+    def _load(self, scope: str) -> dict[str, list[ArtifactVersion]]:
+        """Versions by name for `scope`, reading only manifest bytes not seen before."""
+        scope = safe_scope(scope)
+        path = self._manifest_path(scope)
+        offset, names = self._manifests.get(scope, (0, {}))
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+        except FileNotFoundError:
+            return names
+        complete = tail[: tail.rfind(b"\n") + 1]  # a line still being appended waits
+        for line in complete.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            history = names.setdefault(record["name"], [])
+            history.append(ArtifactVersion(record["name"], len(history) + 1, record["sha256"],
+                                           record["size"], record["at"]))
+        self._manifests[scope] = (offset + len(complete), names)
+        return names
+
+    def put(self, scope: str, name: str, content: str) -> tuple[ArtifactVersion, bool]:
+        """
+        Record `content` as the next version of `name` in `scope`.
+        Returns (version, changed); changed is False when it equals the latest version.
+        """
+        data = (content or "").encode("utf-8")
+        sha = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            history = self._load(scope).get(name, [])
+            if history and history[-1].sha256 == sha:
+                self.unchanged += 1
+                return history[-1], False
+            blob = self._blob_path(sha)
+            if not blob.exists():
+                try:
+                    atomic_write(blob, gzip.compress(data, mtime=0), exclusive=True)
+                    self.blobs_written += 1
+                except FileExistsError:
+                    pass  # another session stored the same content first
+            record = {"name": name, "sha256": sha, "size": len(data), "at": round(time.time(), 3)}
+            manifest = self._manifest_path(scope)
+            manifest.parent.mkdir(parents=True, exist_ok=True)
+            append_text(manifest, json.dumps(record, separators=(",", ":")) + "\n")
+            self.saved += 1
+            history = self._load(scope).get(name, [])
+            return history[-1], True
+
+    def versions(self, scope: str, name: Optional[str] = None) -> list[ArtifactVersion]:
+        """All versions of `name` (oldest first), or the latest version of every name."""
+        with self._lock:
+            names = self._load(scope)
+            if name is not None:
+                return list(names.get(name, []))
+            return [history[-1] for history in names.values()]
+
+    def get(self, scope: str, name: str, version: Optional[int] = None) -> str:
+        """Content of `name` at `version` (1-based; None = latest). KeyError if unknown."""
+        history = self.versions(scope, name)
+        if not history:
+            raise KeyError(f"No artifact named {name!r} in {safe_scope(scope)}")
+        if version is None:
+            entry = history[-1]
+        elif 1 <= version <= len(history):
+            entry = history[version - 1]
+        else:
+            raise KeyError(f"{name!r} has versions 1..{len(history)}, not {version}")
+        return gzip.decompress(self._blob_path(entry.sha256).read_bytes()).decode("utf-8")
+
+    def stats(self) -> dict:
+        return {"saved": self.saved, "unchanged": self.unchanged, "blobs_written": self.blobs_written}
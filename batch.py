@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from checkpointing import aclose_checkpointer, open_checkpointer
+from main import build_supervisor, default_pre_router, message_content
+
+# ----------------------------
+# Batch runner
+# ----------------------------
+# Runs a JSONL file of requests through the supervisor graph with bounded concurrency:
+#
+#   python batch.py requests.jsonl -o results.jsonl -j 8
+#
+# Input lines: {"request_id": ..., "message": ...} (or "title"/"body"), optional "thread_id".
+# Lines sharing a thread_id are turns of one conversation: they run one after another, in
+# file order, while different threads run concurrently.
+# Output lines: one result per request with status, final output and timings. Re-running
+# with the same output file skips request_ids that already completed successfully.
+
+
+def load_requests(path: Path) -> list[dict]:
+    requests = []
+    with path.open(encoding="utf-8") as f:
+        for lineno, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            request_id = str(item.get("request_id") or item.get("id") or f"line-{lineno}")
+            message = item.get("message") or item.get("content")
+            if not message:
+                message = "\n\n".join(p for p in (item.get("title"), item.get("body")) if p)
+            requests.append({
+                "request_id": request_id,
+                "thread_id": item.get("thread_id") or f"batch-{request_id}",
+                "message": message,
+            })
+    return requests
+
+
+def completed_ids(path: Path) -> set[str]:
+    """request_ids with an "ok" result already in the output file."""
+    done = set()
+    if not path.exists():
+        return done
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # torn last line from an interrupted run
+            if result.get("status") == "ok":
+                done.add(result["request_id"])
+    return done
+
+
+async def run_one(graph, request: dict, timeout_s: Optional[float]) -> dict:
+    cfg = {"configurable": {"thread_id": request["thread_id"]}}
+    started_at = datetime.now(timezone.utc).isoformat()
+    t0 = time.perf_counter()
+    result = {"request_id": request["request_id"], "thread_id": request["thread_id"], "started_at": started_at}
+    try:
+        state = await asyncio.wait_for(
+            graph.ainvoke({"messages": [{"role": "user", "content": request["message"]}]}, config=cfg),
+            timeout=timeout_s,
+        )
+        messages = state.get("messages") or []
+        result.update(status="ok", output=message_content(messages[-1]) if messages else None,
+                      messages=len(messages))
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    result["duration_s"] = round(time.perf_counter() - t0, 3)
+    return result
+
+
+async def run_batch(input_path: Path, output_path: Path, workers: int = 4,
+                    timeout_s: Optional[float] = None) -> dict:
+    requests = load_requests(input_path)
+    done = completed_ids(output_path)
+    pending = [r for r in requests if r["request_id"] not in done]
+    print(f"[batch] {len(requests)} requests, {len(requests) - len(pending)} already done, "
+          f"{len(pending)} to run with {workers} workers")
+
+    checkpointer = open_checkpointer()
+    graph = build_supervisor(checkpointer=checkpointer, pre_router=default_pre_router())
+    semaphore = asyncio.Semaphore(workers)
+    counts = {"ok": 0, "error": 0}
+    t0 = time.perf_counter()
+
+    # Turns of one thread must not race on its checkpoints: one chain per thread_id
+    threads: dict[str, list[dict]] = {}
+    for request in pending:
+        threads.setdefault(request["thread_id"], []).append(request)
+
+    with output_path.open("a", encoding="utf-8") as out:
+        async def worker(thread_requests: list[dict]):
+            for request in thread_requests:
+                async with semaphore:
+                    result = await run_one(graph, request, timeout_s)
+                # Results are appended (and flushed) as they finish so an interrupted run resumes cleanly
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[result["status"]] += 1
+                print(f"[batch] {result['request_id']}: {result['status']} in {result['duration_s']}s")
+
+        try:
+            await asyncio.gather(*(worker(chain) for chain in threads.values()))
+        finally:
+            await aclose_checkpointer(checkpointer)
+
+    summary = {**counts, "skipped": len(requests) - len(pending), "wall_s": round(time.perf_counter() - t0, 3)}
+    print(f"[batch] done: {summary}")
+    return summary
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of requests through the supervisor graph.")
+    parser.add_argument("input", type=Path, help="JSONL file, one request per line")
+    parser.add_argument("-o", "--output", type=Path, default=Path("results.jsonl"))
+    parser.add_argument("-j", "--workers", type=int, default=4, help="max requests in flight")
+    parser.add_argument("--timeout", type=float, default=None, help="per-request timeout in seconds")
+    args = parser.parse_args(argv)
+    asyncio.run(run_batch(args.input, args.output, workers=max(1, args.workers), timeout_s=args.timeout))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from resilience import as_chunk
+from role_validation import ROLE_OUTPUT_SCHEMAS
+
+# ----------------------------
+# Deterministic stand-in for "openai:gpt-4o-mini"
+# ----------------------------
+# Supervisor (any model bound to transfer_to_* tools): on a new user message it hands off
+# to each worker in `route` in turn, one hop per call, then answers "done".
+# Workers: reply with a role JSON object padded to roughly `output_chars` characters.
+# Every call sleeps `latency_s` (time.sleep / asyncio.sleep), so graph overhead can be
+# measured with latency 0 and realistic concurrency with latency > 0.
+# StreamingScriptedChatModel streams the same replies in `chunk_chars` pieces,
+# `chunk_latency_s` apart (latency_s is then the time to the first token).
+
+# Roles without a schema in role_validation get these keys
+ROLE_KEYS = {
+    "business_analyst": ["functional_requirements", "user_stories", "acceptance_criteria"],
+    "architect": ["components", "integrations", "fhir_mapping"],
+}
+
+
+def _item(key: str, i: int):
+    """One list entry shaped the way common/csi_common/role_schemas.py expects for `key`."""
+    text = f"{key} item {i}: " + "x" * 24
+    if key == "user_stories":
+        return {"as_a": "nurse", "i_want": text, "so_that": "x", "acceptance_criteria": [text]}
+    if key == "data_fields":
+        return {"entity": f"Entity{i}", "fields": [{"name": "status", "type": "code", "required": True}]}
+    if key == "fhir_mapping":
+        return {"entity": f"Entity{i}", "resource": "Observation"}
+    if key == "rbac":
+        return {"role": "Nurse", "permissions": [text]}
+    if key == "api_endpoints":
+        return {"name": f"GET /entity/{i}", "request": {}, "response": {"status": "x"}}
+    return text
+
+
+class ScriptedChatModel(BaseChatModel):
+    route: list = ["nurse"]
+    latency_s: float = 0.0
+    output_chars: int = 2000
+    tool_names: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def bind_tools(self, tools, **kwargs: Any):
+        names = [convert_to_openai_tool(t)["function"]["name"] for t in tools]
+        return self.model_copy(update={"tool_names": names})
+
+    # -- script --
+    def _agent(self, run_manager) -> str:
+        metadata = getattr(run_manager, "metadata", None) or {}
+        ns = metadata.get("langgraph_checkpoint_ns") or ""
+        return metadata.get("agent") or ns.split("|", 1)[0].split(":", 1)[0] or "agent"
+
+    def _respond(self, messages: list, agent: str) -> AIMessage:
+        if any(n.startswith("transfer_to_") for n in self.tool_names):
+            return self._supervise(messages)
+        return AIMessage(content=self.role_output(agent))
+
+    def _supervise(self, messages: list) -> AIMessage:
+        hops = 0
+        for msg in reversed(messages):
+            if isinstance(msg, HumanMessage):
+                break
+            if isinstance(msg, ToolMessage) and (msg.name or "").startswith("transfer_to_"):
+                hops += 1
+        if hops >= len(self.route):
+            return AIMessage(content="done")
+        target = self.route[hops]
+        tool = f"transfer_to_{target}" if isinstance(target, str) else "transfer_to_agents"
+        args = {} if isinstance(target, str) else {"agents": list(target)}
+        return AIMessage(content="", tool_calls=[{"name": tool, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}])
+
+    def role_output(self, agent: str) -> str:
+        """A reply that passes role_validation for `agent`, padded to about `output_chars`."""
+        schema = ROLE_OUTPUT_SCHEMAS.get(agent)
+        keys = [k for k in schema.required if k != "role"] if schema else ROLE_KEYS.get(agent, ["notes"])
+        body = {"role": agent, **{k: [] for k in keys}}
+        base = len(json.dumps(body))
+        filler = max(0, self.output_chars - base)
+        per_key = filler // len(keys)
+        for k in keys:
+            body[k] = [_item(k, i) for i in range(max(1, per_key // 56))]
+        return json.dumps(body)
+
+    # -- BaseChatModel --
+    def _generate(self, messages, stop: Optional[list] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, self._agent(run_manager)))])
+
+    async def _agenerate(self, messages, stop: Optional[list] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, self._agent(run_manager)))])
+
+
+class StreamingScriptedChatModel(ScriptedChatModel):
+    chunk_chars: int = 40
+    chunk_latency_s: float = 0.0
+
+    def _chunks(self, message: AIMessage) -> list[ChatGenerationChunk]:
+        if message.tool_calls:
+            return [as_chunk(message)]
+        text = message.content
+        return [ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + self.chunk_chars]))
+                for i in range(0, len(text), self.chunk_chars)]
+
+    def _stream(self, messages, stop: Optional[list] = None, run_manager=None, **kwargs: Any):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        for i, chunk in enumerate(self._chunks(self._respond(messages, self._agent(run_manager)))):
+            if i and self.chunk_latency_s:
+                time.sleep(self.chunk_latency_s)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop: Optional[list] = None, run_manager=None, **kwargs: Any):
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        for i, chunk in enumerate(self._chunks(self._respond(messages, self._agent(run_manager)))):
+            if i and self.chunk_latency_s:
+                await asyncio.sleep(self.chunk_latency_s)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
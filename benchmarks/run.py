@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+# The graph is built with the scripted model, so no API key, LLM cache or on-disk
+# default checkpointer is needed.
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+os.environ.setdefault("LLM_CACHE", "0")
+os.environ.setdefault("SEMANTIC_CACHE", "0")
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+from langgraph.checkpoint.base import empty_checkpoint  # noqa: E402
+from langgraph.checkpoint.memory import InMemorySaver  # noqa: E402
+from langgraph.checkpoint.sqlite import SqliteSaver  # noqa: E402
+
+import main  # noqa: E402
+from benchmarks.fake_model import ScriptedChatModel, StreamingScriptedChatModel  # noqa: E402
+from checkpointing import aclose_checkpointer, close_checkpointer, connect_sqlite, open_checkpointer  # noqa: E402
+
+# ----------------------------
+# Offline benchmarks
+# ----------------------------
+#   python -m benchmarks.run                       full suite -> benchmarks/results/latest.json
+#   python -m benchmarks.run --quick --only hops   subset, fewer repetitions
+#   python -m benchmarks.run --baseline old.json   also print the change against a saved run
+#   python -m benchmarks.run --only startup        cold start (import + graph build, -X importtime)
+#
+# Every benchmark runs the real graph/tools/checkpointers with ScriptedChatModel in place
+# of the OpenAI model, so numbers measure orchestration overhead, not the LLM.
+
+WORKERS = ["nurse", "doctor", "lab", "receptionist"]
+DEFAULT_OUTPUT = Path(__file__).resolve().parent / "results" / "latest.json"
+
+
+@contextmanager
+def fake_chat_model(**options):
+    """
+    Make main.chat_model() return a ScriptedChatModel (StreamingScriptedChatModel when
+    `chunk_chars` is given) inside the block. Agents are built lazily on their first turn,
+    so graphs must also be run inside it.
+    """
+    original = main.chat_model
+    model = StreamingScriptedChatModel if "chunk_chars" in options else ScriptedChatModel
+    main.chat_model = lambda agent="", cache=True: model(**options)
+    try:
+        yield
+    finally:
+        main.chat_model = original
+
+
+def _stats(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+    }
+
+
+def _history(n: int, chars: int = 400) -> list:
+    text = "x" * chars
+    return [HumanMessage(content=text, id=f"h{i}") if i % 2 == 0 else AIMessage(content=text, id=f"a{i}")
+            for i in range(n)]
+
+
+def _turn(graph, thread_id: str, text: str = "Plan the IVF intake flow") -> None:
+    graph.invoke({"messages": [{"role": "user", "content": text}]}, config={"configurable": {"thread_id": thread_id}})
+
+
+# -- benchmarks --
+def bench_hops(turns: int, tmp: Path) -> dict:
+    """Turn latency for 1/2/4 supervisor->worker hops; the slope is the per-hop overhead."""
+    out = {}
+    for backend in ("memory", "sqlite"):
+        by_hops = {}
+        for hops in (1, 2, 4):
+            saver = InMemorySaver() if backend == "memory" else SqliteSaver(connect_sqlite(str(tmp / f"hops{hops}.db")))
+            with fake_chat_model(route=WORKERS[:hops], output_chars=2000):
+                graph = main.build_supervisor(checkpointer=saver)
+                _turn(graph, "warmup")  # also builds the lazy agents
+                samples = []
+                for i in range(turns):
+                    t0 = time.perf_counter()
+                    _turn(graph, f"hops-{i}")
+                    samples.append(time.perf_counter() - t0)
+            by_hops[str(hops)] = _stats(samples)
+            close_checkpointer(saver)
+        per_hop = (by_hops["4"]["mean_ms"] - by_hops["1"]["mean_ms"]) / 3
+        out[backend] = {"turn_by_hops": by_hops, "per_hop_ms": round(per_hop, 3)}
+    return out
+
+
+def bench_handoff(repeats: int) -> dict:
+    """Cost of one create_handoff_tool call as the forwarded history grows."""
+    tool = main.create_handoff_tool(agent_name="nurse")
+    out = {}
+    for size in (10, 100, 1000, 10000):
+        state = {"messages": _history(size)}
+        samples = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            tool.func(state=state, tool_call_id="call_bench", config={})
+            samples.append(time.perf_counter() - t0)
+        stats = _stats(samples)
+        stats["us_per_message"] = round(stats["mean_ms"] * 1000 / size, 4)
+        out[str(size)] = stats
+    return out
+
+
+def bench_checkpoint(repeats: int, tmp: Path) -> dict:
+    """SqliteSaver put / get_tuple latency and bytes per checkpoint vs. history size."""
+    out = {}
+    for size in (10, 100, 1000):
+        path = tmp / f"ckpt{size}.db"
+        saver = SqliteSaver(connect_sqlite(str(path)))
+        saver.setup()
+        messages = _history(size)
+        config = {"configurable": {"thread_id": f"ckpt-{size}", "checkpoint_ns": ""}}
+        writes, reads = [], []
+        for i in range(repeats):
+            checkpoint = empty_checkpoint()
+            checkpoint["channel_values"] = {"messages": messages}
+            checkpoint["channel_versions"] = {"messages": i + 1}
+            t0 = time.perf_counter()
+            saver.put(config, checkpoint, {"source": "loop", "step": i}, {"messages": i + 1})
+            writes.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            saver.get_tuple(config)
+            reads.append(time.perf_counter() - t0)
+        saver.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        out[str(size)] = {
+            "put": _stats(writes),
+            "get_tuple": _stats(reads),
+            "bytes_per_checkpoint": path.stat().st_size // repeats,
+        }
+        saver.conn.close()
+    return out
+
+
+async def _throughput(graph, concurrency: int, turns: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one(i: int):
+        async with semaphore:
+            t0 = time.perf_counter()
+            await graph.ainvoke({"messages": [{"role": "user", "content": "Plan the IVF intake flow"}]},
+                                config={"configurable": {"thread_id": f"tp-{concurrency}-{i}"}})
+            samples.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(turns)))
+    wall = time.perf_counter() - t0
+    return {"turns": turns, "wall_s": round(wall, 3), "turns_per_s": round(turns / wall, 2), **_stats(samples)}
+
+
+def bench_throughput(latency_s: float, turns_per_thread: int, tmp: Path) -> dict:
+    """Turns/s with 1, 8 and 64 conversations in flight on the pooled SQLite checkpointer."""
+    out = {"model_latency_ms": latency_s * 1000}
+    for concurrency in (1, 8, 64):
+        saver = open_checkpointer("pooled", str(tmp / f"tp{concurrency}.db"))
+        with fake_chat_model(route=["nurse"], latency_s=latency_s, output_chars=2000):
+            graph = main.build_supervisor(checkpointer=saver)
+
+            async def run():
+                try:
+                    return await _throughput(graph, concurrency, max(concurrency, 8) * turns_per_thread)
+                finally:
+                    await aclose_checkpointer(saver)
+
+            out[str(concurrency)] = asyncio.run(run())
+    return out
+
+
+_COLD_START = (
+    "import json, time; t0 = time.perf_counter(); import main; t1 = time.perf_counter(); "
+    "main.build_supervisor(); t2 = time.perf_counter(); "
+    "print(json.dumps({'import': t1 - t0, 'build': t2 - t1}))"
+)
+
+
+def _python(args: list[str]) -> subprocess.CompletedProcess:
+    # inherits CHECKPOINT_BACKEND=memory / LLM_CACHE=0 / SEMANTIC_CACHE=0 set above
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True,
+                          cwd=Path(__file__).resolve().parent.parent)
+
+
+def parse_importtime(stderr: str, root: str = "main") -> dict[str, float]:
+    """
+    `root` and the modules it imports directly -> cumulative import ms, from
+    `python -X importtime` output (children are listed before their parent, indented).
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") < 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if cumulative.strip().isdigit():
+            entries.append((len(name) - len(name.lstrip(" ")), name.strip(), int(cumulative) / 1000))
+    for i, (indent, name, ms) in enumerate(entries):
+        if name != root:
+            continue
+        out = {root: ms}
+        for child_indent, child, child_ms in reversed(entries[:i]):
+            if child_indent <= indent:
+                break
+            if child_indent == indent + 2:
+                out[child] = child_ms
+        return out
+    return {}
+
+
+def bench_ttft(turns: int, latency_s: float) -> dict:
+    """
+    When the user first sees the worker's reply: its whole node update (stream_mode
+    "updates", the old CLI) vs its first streamed token (stream_mode "messages").
+    """
+    text = {"messages": [{"role": "user", "content": "Plan the IVF intake flow"}]}
+    out = {}
+    with fake_chat_model(route=["nurse"], output_chars=2000, latency_s=latency_s,
+                         chunk_chars=40, chunk_latency_s=latency_s / 10):
+        graph = main.build_supervisor(checkpointer=InMemorySaver())
+        _turn(graph, "warmup")
+        for mode, stream_mode in (("updates", "updates"), ("tokens", ["messages", "updates"])):
+            first, total = [], []
+            for i in range(turns):
+                seen = None
+                t0 = time.perf_counter()
+                for chunk in graph.stream(text, config={"configurable": {"thread_id": f"ttft-{mode}-{i}"}},
+                                          stream_mode=stream_mode, subgraphs=True):
+                    if mode == "tokens":
+                        ns, kind, payload = chunk
+                        shown = kind == "messages" and bool(payload[0].content)
+                    else:
+                        ns, payload = chunk
+                        shown = "agent" in payload
+                    if seen is None and shown and ns and ns[0].startswith("nurse:"):
+                        seen = time.perf_counter() - t0
+                total.append(time.perf_counter() - t0)
+                first.append(seen if seen is not None else total[-1])
+            out[mode] = {"first_output": _stats(first), "turn": _stats(total)}
+    return out
+
+
+def bench_startup(repeats: int) -> dict:
+    """CLI / worker cold start: fresh interpreters importing main and building the graph."""
+    imports, builds, process = [], [], []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        timings = json.loads(_python(["-c", _COLD_START]).stdout.strip().splitlines()[-1])
+        process.append(time.perf_counter() - t0)
+        imports.append(timings["import"])
+        builds.append(timings["build"])
+    top = parse_importtime(_python(["-X", "importtime", "-c", "import main"]).stderr)
+    # modules main imports directly, by cumulative time (shared dependencies count once,
+    # against whichever import pulled them in first)
+    heaviest = sorted(((ms, name) for name, ms in top.items() if name != "main"), reverse=True)[:10]
+    return {
+        "import_main": _stats(imports),
+        "build_supervisor": _stats(builds),
+        "process": _stats(process),
+        "importtime_main_ms": round(top.get("main", 0.0), 3),
+        "heaviest_imports": [[name, round(ms, 3)] for ms, name in heaviest],
+    }
+
+
+# -- results --
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _flatten(tree, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in tree.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(current: dict, baseline: dict, threshold: float = 0.10) -> list[str]:
+    """Lines for every *_ms / *_per_s / bytes metric that moved more than `threshold`."""
+    now, before = _flatten(current["results"]), _flatten(baseline.get("results", {}))
+    lines = []
+    for key, value in sorted(now.items()):
+        old = before.get(key)
+        if not old or not key.endswith(("_ms", "_per_s", "bytes_per_checkpoint")):
+            continue
+        change = (value - old) / old
+        if abs(change) >= threshold:
+            worse = change < 0 if key.endswith("_per_s") else change > 0
+            lines.append(f"{'REGRESSION' if worse else 'improved  '} {key}: {old} -> {value} ({change:+.0%})")
+    return lines
+
+
+BENCHMARKS = ("startup", "hops", "handoff", "checkpoint", "throughput", "ttft")
+
+
+def run(only: tuple = BENCHMARKS, quick: bool = False, latency_s: float = 0.05) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="orchestrator-bench-") as tmp_dir:
+        tmp = Path(tmp_dir)
+        if "startup" in only:
+            results["startup"] = bench_startup(repeats=3 if quick else 10)
+        if "hops" in only:
+            results["hop_overhead"] = bench_hops(turns=5 if quick else 30, tmp=tmp)
+        if "handoff" in only:
+            results["handoff_state_copy"] = bench_handoff(repeats=20 if quick else 200)
+        if "checkpoint" in only:
+            results["sqlite_checkpoint"] = bench_checkpoint(repeats=10 if quick else 100, tmp=tmp)
+        if "throughput" in only:
+            results["throughput"] = bench_throughput(latency_s, turns_per_thread=1 if quick else 4, tmp=tmp)
+        if "ttft" in only:
+            results["time_to_first_token"] = bench_ttft(turns=3 if quick else 10, latency_s=latency_s)
+    return {
+        "meta": {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def main_cli(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Offline orchestration benchmarks with a scripted fake model.")
+    parser.add_argument("-o", "--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help=f"comma-separated subset of {BENCHMARKS}")
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions (smoke run)")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fake model latency for the throughput run")
+    parser.add_argument("--baseline", type=Path, help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    only = tuple(b.strip() for b in args.only.split(",") if b.strip())
+    unknown = set(only) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = run(only, quick=args.quick, latency_s=args.latency_ms / 1000)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    print(json.dumps(report["results"], indent=2))
+    print(f"[bench] wrote {args.output}")
+
+    if args.baseline:
+        lines = compare(report, json.loads(args.baseline.read_text(encoding="utf-8")))
+        print("\n".join(lines) if lines else "[bench] no change above 10% against baseline")
+        if any(line.startswith("REGRESSION") for line in lines):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+import os
+import sqlite3
+from typing import Any, AsyncIterator, Iterator, Optional
+
+import aiosqlite
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+# ----------------------------
+# Checkpointer backends
+# ----------------------------
+# CHECKPOINT_BACKEND selects how LangGraph checkpoints are stored:
+# - "pooled" (default): WAL-mode SQLite usable from both sync and async graph calls;
+#   async writes share one connection, async reads fan out over a small reader pool
+# - "sqlite": a single synchronous SqliteSaver connection (sync graph calls only)
+# - "memory": in-process only, nothing persisted
+
+# WAL lets readers proceed while a writer commits; synchronous=NORMAL is durable across
+# application crashes in WAL mode and avoids an fsync per checkpoint write.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+async def aconnect_sqlite(path: str) -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(path)
+    for pragma in SQLITE_PRAGMAS:
+        await conn.execute(pragma)
+    return conn
+
+
+class PooledSqliteSaver(BaseCheckpointSaver[str]):
+    """
+    SQLite checkpointer that works both from sync code and under an event loop.
+
+    Sync methods go to a tuned SqliteSaver. Async methods use aiosqlite connections that
+    are opened lazily on the running loop: one writer (SQLite allows a single writer at a
+    time anyway) and `pool_size` readers picked round-robin, so checkpoint lookups for one
+    thread don't queue behind writes for another. Async users should `await aclose()`
+    before their event loop shuts down (aiosqlite connections run on worker threads).
+    """
+
+    def __init__(self, path: str, pool_size: int = 4):
+        super().__init__()
+        self.path = path
+        self.pool_size = max(1, pool_size)
+        self._sync = SqliteSaver(connect_sqlite(path))
+        self._writer: Optional[AsyncSqliteSaver] = None
+        self._readers: list[AsyncSqliteSaver] = []
+        self._next_reader = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._open_lock: Optional[asyncio.Lock] = None
+        self._open_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # -- async pool management --
+    async def _ensure_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._writer is not None:
+            return
+        if self._open_lock_loop is not loop:
+            self._open_lock, self._open_lock_loop = asyncio.Lock(), loop
+        async with self._open_lock:
+            if self._loop is loop and self._writer is not None:
+                return
+            # First async use, or the previous loop is gone (e.g. successive asyncio.run calls)
+            await self._close_async()
+            writer = AsyncSqliteSaver(await aconnect_sqlite(self.path))
+            await writer.setup()
+            readers = []
+            for _ in range(self.pool_size):
+                reader = AsyncSqliteSaver(await aconnect_sqlite(self.path))
+                reader.is_setup = True  # schema was created by the writer
+                readers.append(reader)
+            self._writer, self._readers = writer, readers
+            self._next_reader = itertools.cycle(readers)
+            self._loop = loop
+
+    async def _reader(self) -> AsyncSqliteSaver:
+        await self._ensure_async()
+        return next(self._next_reader)
+
+    async def _async_writer(self) -> AsyncSqliteSaver:
+        await self._ensure_async()
+        return self._writer
+
+    async def _close_async(self) -> None:
+        savers = ([self._writer] if self._writer else []) + self._readers
+        self._writer, self._readers, self._next_reader = None, [], None
+        for saver in savers:
+            try:
+                await saver.conn.close()
+            except Exception:
+                pass
+
+    async def aclose(self) -> None:
+        await self._close_async()
+        self._sync.conn.close()
+
+    def close(self) -> None:
+        self._sync.conn.close()
+
+    # -- sync API --
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self._sync.get_tuple(config)
+
+    def list(self, config: Optional[RunnableConfig], **kwargs: Any) -> Iterator[CheckpointTuple]:
+        return self._sync.list(config, **kwargs)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        return self._sync.put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config: RunnableConfig, writes, task_id: str, task_path: str = "") -> None:
+        return self._sync.put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        return self._sync.delete_thread(thread_id)
+
+    def get_delta_channel_history(self, *args: Any, **kwargs: Any):
+        return self._sync.get_delta_channel_history(*args, **kwargs)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return self._sync.get_next_version(current, channel)
+
+    # -- async API --
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await (await self._reader()).aget_tuple(config)
+
+    async def alist(self, config: Optional[RunnableConfig], **kwargs: Any) -> AsyncIterator[CheckpointTuple]:
+        async for item in (await self._reader()).alist(config, **kwargs):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await (await self._async_writer()).aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes, task_id: str, task_path: str = "") -> None:
+        return await (await self._async_writer()).aput_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await (await self._async_writer()).adelete_thread(thread_id)
+
+    async def aget_delta_channel_history(self, *args: Any, **kwargs: Any):
+        return await (await self._reader()).aget_delta_channel_history(*args, **kwargs)
+
+
+def open_checkpointer(backend: Optional[str] = None, path: Optional[str] = None) -> BaseCheckpointSaver:
+    """Create the checkpointer selected by CHECKPOINT_BACKEND / CHECKPOINT_DB / CHECKPOINT_POOL_SIZE."""
+    backend = (backend or os.getenv("CHECKPOINT_BACKEND", "pooled")).lower()
+    path = path or os.getenv("CHECKPOINT_DB", "memory.db")
+    if backend == "memory":
+        return InMemorySaver()
+    if backend == "sqlite":
+        return SqliteSaver(connect_sqlite(path))
+    if backend == "pooled":
+        return PooledSqliteSaver(path, pool_size=int(os.getenv("CHECKPOINT_POOL_SIZE", "4")))
+    raise ValueError(f"Unknown CHECKPOINT_BACKEND: {backend!r}")
+
+
+def close_checkpointer(saver: BaseCheckpointSaver) -> None:
+    if isinstance(saver, PooledSqliteSaver):
+        saver.close()
+    elif isinstance(saver, SqliteSaver):
+        saver.conn.close()
+
+
+async def aclose_checkpointer(saver: BaseCheckpointSaver) -> None:
+    if isinstance(saver, PooledSqliteSaver):
+        await saver.aclose()
+    else:
+        close_checkpointer(saver)
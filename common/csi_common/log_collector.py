@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Query
+from .schemas import LogEvent
+
+# Local stand-in for the log service LogClient posts to.
+#
+#   python -m common.csi_common.log_collector        (LOG_COLLECTOR_DB, HOST, PORT)
+#
+# Ingest endpoints only enqueue; one writer thread appends rows to SQLite in batched
+# transactions, so agents never wait on disk I/O. Rows are never updated; reads use
+# indexes on trace_id, thread_id, from_agent and time.
+
+log = logging.getLogger(__name__)
+
+_COLUMNS = ("trace_id", "thread_id", "hop", "from_agent", "to_agent", "content", "metadata", "at")
+
+
+class EventStore:
+    """Append-only SQLite event log with a batching writer thread."""
+
+    def __init__(self, path: str = "log_events.db", max_pending: int = 100_000, batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._submit_lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._connect()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                trace_id TEXT NOT NULL,
+                thread_id TEXT NOT NULL,
+                hop TEXT NOT NULL,
+                from_agent TEXT NOT NULL,
+                to_agent TEXT NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS events_trace ON events(trace_id, id);
+            CREATE INDEX IF NOT EXISTS events_thread ON events(thread_id, id);
+            CREATE INDEX IF NOT EXISTS events_agent_at ON events(from_agent, at);
+            CREATE INDEX IF NOT EXISTS events_at ON events(at);
+            """
+        )
+        self.written = 0
+        self.dropped = 0  # rows lost to failed batch writes
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name="log-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, events: List[LogEvent]) -> bool:
+        """
+        Queue all of `events` for the writer, or none of them: False when the backlog has
+        no room for the whole batch (caller should back off and resend it).
+        """
+        rows = [
+            (e.trace_id, e.thread_id, e.hop, e.from_agent, e.to_agent, e.content,
+             json.dumps(e.metadata, default=str), e.at.isoformat())
+            for e in events
+        ]
+        # Submitters are serialized and the writer only frees slots, so room checked here
+        # is still there when the rows are put
+        with self._submit_lock:
+            if self._pending.maxsize - self._pending.qsize() < len(rows):
+                return False
+            for row in rows:
+                self._pending.put_nowait(row)
+        return True
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        while not (self._stop.is_set() and self._pending.empty()):
+            try:
+                batch = [self._pending.get(timeout=0.05)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany(
+                        f"INSERT INTO events ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                        batch,
+                    )
+                self.written += len(batch)
+            except sqlite3.Error:
+                # A failed batch (lock timeout, full disk, ...) is dropped; the writer keeps going
+                self.dropped += len(batch)
+                log.exception("log collector: dropped a batch of %d events", len(batch))
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    @property
+    def pending(self) -> int:
+        return self._pending.qsize()
+
+    def flush(self) -> None:
+        self._pending.join()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._writer.join()
+
+    def _query(self, sql: str, params: tuple) -> list[dict]:
+        cur = self._connect().execute(sql, params)
+        names = [d[0] for d in cur.description]
+        out = []
+        for row in cur.fetchall():
+            item = dict(zip(names, row))
+            item["metadata"] = json.loads(item["metadata"])
+            out.append(item)
+        return out
+
+    def by_trace(self, trace_id: str, limit: int) -> list[dict]:
+        return self._query("SELECT * FROM events WHERE trace_id = ? ORDER BY id LIMIT ?", (trace_id, limit))
+
+    def by_thread(self, thread_id: str, limit: int) -> list[dict]:
+        return self._query("SELECT * FROM events WHERE thread_id = ? ORDER BY id DESC LIMIT ?", (thread_id, limit))
+
+    def recent_by_agent(self, agent: str, limit: int, since: Optional[str] = None) -> list[dict]:
+        if since:
+            return self._query(
+                "SELECT * FROM events WHERE from_agent = ? AND at >= ? ORDER BY at DESC LIMIT ?",
+                (agent, since, limit),
+            )
+        return self._query("SELECT * FROM events WHERE from_agent = ? ORDER BY at DESC LIMIT ?", (agent, limit))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.store = EventStore(os.getenv("LOG_COLLECTOR_DB", "log_events.db"))
+    app.state.started = time.time()
+    try:
+        yield
+    finally:
+        app.state.store.close()
+
+
+app = FastAPI(title="CSI log collector", lifespan=lifespan)
+
+
+def _accept(events: List[LogEvent]) -> dict:
+    if not app.state.store.submit(events):
+        raise HTTPException(status_code=503, detail="collector backlog full")
+    return {"accepted": len(events)}
+
+
+@app.post("/events", status_code=202)
+async def ingest_event(event: LogEvent):
+    return _accept([event])
+
+
+@app.post("/events/batch", status_code=202)
+async def ingest_batch(events: List[LogEvent]):
+    return _accept(events)
+
+
+# Query endpoints are sync so FastAPI runs them in its threadpool, off the event loop.
+@app.get("/traces/{trace_id}/events")
+def trace_events(trace_id: str, limit: int = Query(1000, le=10_000)):
+    return app.state.store.by_trace(trace_id, limit)
+
+
+@app.get("/threads/{thread_id}/events")
+def thread_events(thread_id: str, limit: int = Query(100, le=10_000)):
+    return app.state.store.by_thread(thread_id, limit)
+
+
+@app.get("/agents/{agent}/events")
+def agent_recent_events(agent: str, limit: int = Query(100, le=10_000), since: Optional[str] = None):
+    return app.state.store.recent_by_agent(agent, limit, since)
+
+
+@app.get("/stats")
+def stats():
+    store = app.state.store
+    return {
+        "written": store.written,
+        "dropped": store.dropped,
+        "pending": store.pending,
+        "uptime_s": round(time.time() - app.state.started, 1),
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "8081")))
@@ -1,14 +1,122 @@
+import asyncio
+from typing import Literal, Optional
+
 import httpx
 from .schemas import LogEvent
 
+Overflow = Literal["drop_newest", "drop_oldest", "block"]
+
+
 class LogClient:
-    def __init__(self, base_url: str):
+    """
+    Buffered, batched log shipper.
+
+    `log()` only enqueues the event; a background task POSTs batches to
+    `{base_url}/events/batch` when `batch_size` events are queued or `flush_interval`
+    seconds have passed, over one long-lived pooled HTTP client. When the queue is full,
+    `overflow` decides: "drop_newest" (default), "drop_oldest" or "block" (backpressure).
+    Call `aclose()` (or use `async with`) on shutdown to flush what is left.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        max_queue: int = 10_000,
+        overflow: Overflow = "drop_newest",
+        timeout: float = 5,
+    ):
         self.base_url = base_url.rstrip("/")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.timeout = timeout
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    def _start(self) -> None:
+        if self._flusher is not None and not self._flusher.done():
+            return
+        self._queue = self._queue or asyncio.Queue(maxsize=self.max_queue)
+        self._client = self._client or httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+        )
+        self._flusher = asyncio.get_running_loop().create_task(self._run())
 
     async def log(self, event: LogEvent) -> None:
+        self._start()
+        item = event.model_dump(mode="json")
+        if self.overflow == "block":
+            await self._queue.put(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.overflow == "drop_oldest":
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._queue.put_nowait(item)
+            self.dropped += 1
+
+    async def flush(self) -> None:
+        """Wait until every queued event has been sent (or given up on)."""
+        if self._queue is not None and self._flusher is not None and not self._flusher.done():
+            await self._queue.join()
+
+    async def aclose(self) -> None:
+        await self.flush()
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "LogClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._send(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _send(self, batch: list[dict]) -> None:
         try:
-            async with httpx.AsyncClient(timeout=5) as c:
-                await c.post(f"{self.base_url}/events", json=event.model_dump())
+            r = await self._client.post(f"{self.base_url}/events/batch", json=batch)
+            r.raise_for_status()
+            self.sent += len(batch)
         except Exception:
             # Keep agents resilient even if logging is down
-            pass
+            self.failed += len(batch)
@@ -0,0 +1,104 @@
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Literal, List, Dict, Any, Union
+
+# Replies of the clinical role agents (receptionist, nurse, doctor, lab). Field names and
+# shapes follow the "Required top-level JSON keys" section of each role prompt; extra keys
+# the model adds are kept.
+
+class UserStory(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    as_a: str
+    i_want: str
+    so_that: str = ""
+    acceptance_criteria: List[str] = Field(default_factory=list)
+
+class FieldSpec(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    name: str
+    type: str
+    required: bool = False
+
+class DataEntity(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    entity: str
+    fields: List[FieldSpec] = Field(default_factory=list)
+
+class FhirModuleMapping(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    module: str
+    fhir_resources: List[str] = Field(default_factory=list)
+
+class FhirEntityMapping(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    entity: str
+    resource: str
+
+FhirMappingItem = Union[FhirModuleMapping, FhirEntityMapping]
+
+class RbacRule(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    role: str
+    permissions: List[str] = Field(default_factory=list)
+
+class ApiEndpoint(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    name: str
+    request: Any = None
+    response: Any = None
+
+class RoleOutput(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    role: str
+    functional_requirements: List[str]
+    user_stories: List[UserStory]
+    data_fields: List[DataEntity]
+    fhir_mapping: Union[FhirMappingItem, List[FhirMappingItem]]   # either form from the prompts, or a list
+    risks: List[str]
+    assumptions: List[str] = Field(default_factory=list)
+    dependencies: List[str] = Field(default_factory=list)
+    rbac: List[RbacRule] = Field(default_factory=list)
+    audit_events: List[str] = Field(default_factory=list)
+    api_endpoints: List[ApiEndpoint] = Field(default_factory=list)
+    open_questions: List[str] = Field(default_factory=list)
+
+    @field_validator("role", mode="before")
+    @classmethod
+    def _lower_role(cls, v):
+        return v.lower() if isinstance(v, str) else v
+
+class ReceptionistOutput(RoleOutput):
+    role: Literal["receptionist"]
+    workflows: List[str]
+    # required (not just encouraged) for the receptionist
+    assumptions: List[str]
+    dependencies: List[str]
+    rbac: List[RbacRule]
+    audit_events: List[str]
+    api_endpoints: List[ApiEndpoint]
+    open_questions: List[str]
+
+class NurseOutput(RoleOutput):
+    role: Literal["nurse"]
+    workflows: List[str]
+
+class DoctorOutput(RoleOutput):
+    role: Literal["doctor"]
+    clinical_protocols: List[str]
+
+class LabOutput(RoleOutput):
+    role: Literal["lab"]
+    workflows: List[str]
+    # required (not just encouraged) for the lab
+    assumptions: List[str]
+    dependencies: List[str]
+    rbac: List[RbacRule]
+    audit_events: List[str]
+    api_endpoints: List[ApiEndpoint]
+    open_questions: List[str]
+
+ROLE_OUTPUT_MODELS: Dict[str, type] = {
+    "receptionist": ReceptionistOutput,
+    "nurse": NurseOutput,
+    "doctor": DoctorOutput,
+    "lab": LabOutput,
+}
@@ -0,0 +1,223 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+# ----------------------------
+# Per-agent context windowing
+# ----------------------------
+# Workers receive the whole shared MessagesState, including every other role's multi-KB
+# JSON output. A context policy decides which of those messages a worker's LLM actually
+# sees. It runs as the worker's `pre_model_hook` and returns `llm_input_messages`, so the
+# checkpointed history is left untouched and the same policy applies whether the worker
+# was reached by a handoff, a fan-out or the pre-router.
+
+
+class ContextStats:
+    """Approximate prompt tokens before/after windowing, accumulated per agent."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_agent: dict[str, dict] = {}
+
+    def record(self, agent: str, policy: str, before: int, after: int) -> None:
+        with self._lock:
+            s = self.by_agent.setdefault(agent, {"policy": policy, "calls": 0, "tokens_before": 0, "tokens_after": 0})
+            s["calls"] += 1
+            s["tokens_before"] += before
+            s["tokens_after"] += after
+
+    def summary(self) -> dict:
+        with self._lock:
+            out = {}
+            for agent, s in self.by_agent.items():
+                saved = s["tokens_before"] - s["tokens_after"]
+                out[agent] = {**s, "tokens_saved": saved,
+                              "saved_ratio": saved / s["tokens_before"] if s["tokens_before"] else 0.0}
+            return out
+
+
+CONTEXT_STATS = ContextStats()
+
+
+def _last_human_index(messages: list) -> int:
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return i
+    return 0
+
+
+class ContextPolicy:
+    """Base policy: forward the full history."""
+    spec = "full"
+
+    def select(self, messages: list, agent: str) -> list:
+        return messages
+
+
+class LastNTurns(ContextPolicy):
+    """Keep everything from the n-th most recent user message onward."""
+
+    def __init__(self, n: int = 2):
+        self.n = max(1, n)
+        self.spec = f"last:{self.n}"
+
+    def select(self, messages: list, agent: str) -> list:
+        seen = 0
+        for i in range(len(messages) - 1, -1, -1):
+            if isinstance(messages[i], HumanMessage):
+                seen += 1
+                if seen == self.n:
+                    return messages[i:]
+        return messages
+
+
+class RoleFiltered(ContextPolicy):
+    """
+    Keep user messages, the agent's own messages and the replies of `roles`; drop every
+    other agent's output (e.g. supervisor routing chatter, unrelated roles' JSON).
+    Tool results are kept only when the tool call that produced them is kept.
+    """
+
+    def __init__(self, roles: list[str]):
+        self.roles = set(roles)
+        self.spec = "roles:" + ",".join(roles)
+
+    def select(self, messages: list, agent: str) -> list:
+        keep_names = self.roles | {agent}
+        start = _last_human_index(messages)
+        kept, kept_calls = [], set()
+        for i, msg in enumerate(messages):
+            # The current turn (from the latest user message on) is always kept whole so
+            # in-flight tool calls stay paired with their results.
+            if i >= start:
+                kept.append(msg)
+            elif isinstance(msg, (HumanMessage, SystemMessage)):
+                kept.append(msg)
+            elif isinstance(msg, AIMessage) and msg.name in keep_names:
+                kept.append(msg)
+                kept_calls.update(tc["id"] for tc in msg.tool_calls)
+            elif isinstance(msg, ToolMessage) and msg.tool_call_id in kept_calls:
+                kept.append(msg)
+        return kept
+
+
+class SummaryPlusLatest(ContextPolicy):
+    """
+    Replace everything before the latest user message with a compact extractive summary
+    (one line per earlier user ask / agent reply), then keep the current turn verbatim.
+    Per-message summary lines are memoized by message id, so the summary is maintained
+    incrementally as the thread grows instead of being rebuilt from scratch.
+    """
+
+    def __init__(self, max_chars: int = 2000, line_chars: int = 240, memo_size: int = 4096):
+        self.max_chars = max_chars
+        self.line_chars = line_chars
+        self.memo_size = memo_size
+        self.spec = f"summary:{max_chars}"
+        self._memo: OrderedDict[str, Optional[str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _line(self, msg) -> Optional[str]:
+        if isinstance(msg, HumanMessage):
+            text = msg.content if isinstance(msg.content, str) else ""
+            return f"user: {text[:self.line_chars]}"
+        if isinstance(msg, AIMessage) and msg.name and msg.content and isinstance(msg.content, str):
+            try:
+                parsed = json.loads(msg.content)
+            except ValueError:
+                parsed = None
+            if isinstance(parsed, dict):
+                # STRICT JSON role output: list its keys rather than quoting the body
+                return f"{msg.name}: JSON with keys {', '.join(parsed)}"
+            return f"{msg.name}: {msg.content[:self.line_chars]}"
+        return None
+
+    def _cached_line(self, msg) -> Optional[str]:
+        if msg.id is None:
+            return self._line(msg)
+        with self._lock:
+            if msg.id in self._memo:
+                self._memo.move_to_end(msg.id)
+                return self._memo[msg.id]
+        line = self._line(msg)
+        with self._lock:
+            self._memo[msg.id] = line
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return line
+
+    def select(self, messages: list, agent: str) -> list:
+        start = _last_human_index(messages)
+        if start == 0:
+            return messages
+        lines = [line for line in (self._cached_line(m) for m in messages[:start]) if line]
+        summary = "\n".join(lines)
+        if len(summary) > self.max_chars:
+            summary = "…" + summary[-self.max_chars:]
+        note = SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")
+        return [note] + messages[start:]
+
+
+def parse_policy(spec: str | None) -> ContextPolicy:
+    """
+    Parse a policy spec: "full", "last:<n>", "roles:<name>,<name>" or "summary[:<max_chars>]".
+    """
+    spec = (spec or "full").strip()
+    kind, _, arg = spec.partition(":")
+    kind = kind.lower()
+    if kind == "full":
+        return ContextPolicy()
+    if kind == "last":
+        return LastNTurns(int(arg or 2))
+    if kind == "roles":
+        return RoleFiltered([r.strip() for r in arg.split(",") if r.strip()])
+    if kind == "summary":
+        return SummaryPlusLatest(int(arg)) if arg else SummaryPlusLatest()
+    raise ValueError(f"Unknown context policy: {spec!r}")
+
+
+def policy_for(agent: str, default: str | None = None) -> ContextPolicy:
+    """CONTEXT_POLICY_<AGENT> (e.g. CONTEXT_POLICY_NURSE=last:2) overrides `default`."""
+    return parse_policy(os.getenv(f"CONTEXT_POLICY_{agent.upper()}", default))
+
+
+def role_fields_digest(role_outputs: dict, fields: tuple) -> Optional[SystemMessage]:
+    """Selected fields of the validated role outputs (state["role_outputs"]) as one compact message."""
+    digest = {
+        role: {f: data[f] for f in fields if f in data}
+        for role, data in (role_outputs or {}).items() if data
+    }
+    digest = {role: data for role, data in digest.items() if data}
+    if not digest:
+        return None
+    return SystemMessage(
+        content="Validated fields from the clinical roles' latest outputs (JSON): "
+                + json.dumps(digest, ensure_ascii=False, separators=(",", ":"))
+    )
+
+
+def make_context_hook(agent: str, policy: ContextPolicy, stats: ContextStats = CONTEXT_STATS,
+                      role_fields: tuple = ()):
+    """
+    Build a `pre_model_hook` that windows the agent's input and records token savings.
+    With `role_fields`, those fields of every role's structured output are prepended, so
+    the agent gets them without the full role JSON in its window.
+    """
+    def context_hook(state):
+        messages = state["messages"]
+        selected = policy.select(messages, agent)
+        if role_fields:
+            digest = role_fields_digest(state.get("role_outputs"), role_fields)
+            if digest is not None:
+                selected = [digest] + list(selected)
+        before = count_tokens_approximately(messages)
+        after = before if selected is messages else count_tokens_approximately(selected)
+        stats.record(agent, policy.spec, before, after)
+        return {"llm_input_messages": selected}
+
+    return context_hook
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+# ----------------------------
+# Exact-match LLM response cache
+# ----------------------------
+# LangChain calls `lookup(prompt, llm_string)` before every chat model call, where `prompt`
+# is the serialized message list (system prompt included) and `llm_string` the model
+# identity and call parameters (model name, temperature, bound tool schemas, ...). Both
+# are folded into one sha256 key, so a hit requires the same model, system prompt,
+# messages and tools.
+
+
+class ResponseCache(BaseCache):
+    """
+    Two-tier cache: an in-memory LRU in front of a SQLite table.
+    - `ttl_s`: entries older than this are treated as misses and deleted (None = no expiry)
+    - `max_entries`: size of the in-memory LRU tier
+    - `max_bytes`: on-disk budget; least recently used rows are evicted past it
+    """
+
+    def __init__(
+            self,
+            path: str | os.PathLike = "llm_cache.db",
+            ttl_s: Optional[float] = 7 * 24 * 3600,
+            max_entries: int = 1024,
+            max_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._memory: OrderedDict[str, tuple[float, RETURN_VAL_TYPE]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed)")
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_s is not None and now - created > self.ttl_s
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return value
+                del self._memory[key]
+
+            row = self._conn.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                if self._expired(row[1], now):
+                    self._delete(key)
+                else:
+                    self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+                    value = [loads(g, allowed_objects="core") for g in json.loads(row[0])]
+                    self._remember(key, row[1], value)
+                    self.hits_disk += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        blob = json.dumps([dumps(g) for g in return_val])
+        size = len(blob.encode("utf-8"))
+        with self._lock:
+            self._remember(key, now, return_val)
+            old = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, size, now, now),
+            )
+            self._disk_bytes += size - (old[0] if old else 0)
+            self._evict_disk()
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM llm_cache")
+            self._disk_bytes = 0
+
+    def purge_expired(self) -> int:
+        """Delete every expired row; returns the number of rows removed."""
+        if self.ttl_s is None:
+            return 0
+        cutoff = time.time() - self.ttl_s
+        with self._lock:
+            for key in [k for k, (created, _v) in self._memory.items() if created < cutoff]:
+                del self._memory[key]
+            freed = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache WHERE created < ?",
+                                       (cutoff,)).fetchone()
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (cutoff,))
+            self._disk_bytes -= freed[1]
+            self.evictions += freed[0]
+            return freed[0]
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_disk
+        total = hits + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+    # -- internals (caller holds self._lock) --
+    def _remember(self, key: str, created: float, value: RETURN_VAL_TYPE) -> None:
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _delete(self, key: str) -> None:
+        row = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._disk_bytes -= row[0]
+            self.evictions += 1
+
+    def _evict_disk(self) -> None:
+        while self._disk_bytes > self.max_bytes:
+            victims = []
+            for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed LIMIT 64"):
+                victims.append(key)
+                self._memory.pop(key, None)
+                self._disk_bytes -= size
+                self.evictions += 1
+                if self._disk_bytes <= self.max_bytes:
+                    break
+            if not victims:
+                self._disk_bytes = 0
+                return
+            self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", [(k,) for k in victims])
+
+
+_DEFAULT_CACHE: Optional[ResponseCache] = None
+_DEFAULT_CACHE_LOCK = threading.Lock()
+
+
+def default_response_cache() -> Optional[ResponseCache]:
+    """
+    Process-wide cache configured from the environment (created on first use):
+    LLM_CACHE=0 disables it; LLM_CACHE_DB, LLM_CACHE_TTL (seconds, 0 = never expire),
+    LLM_CACHE_MAX_ENTRIES and LLM_CACHE_MAX_BYTES tune it.
+    """
+    global _DEFAULT_CACHE
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+    with _DEFAULT_CACHE_LOCK:
+        if _DEFAULT_CACHE is None:
+            ttl = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+            _DEFAULT_CACHE = ResponseCache(
+                path=os.getenv("LLM_CACHE_DB", "llm_cache.db"),
+                ttl_s=ttl or None,
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+                max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+            )
+        return _DEFAULT_CACHE
@@ -1,68 +1,89 @@
 import os
 import atexit
+import functools
+import hashlib
+import json
 import sys
+import threading
+import time
 import uuid
 from pathlib import Path
-from typing import Annotated
-
-from langgraph.prebuilt import create_react_agent, InjectedState
-from langgraph_supervisor import create_supervisor
-from langchain.chat_models import init_chat_model
-from langchain_core.messages import convert_to_messages
-from langgraph.checkpoint.sqlite import SqliteSaver
-# from langchain_core.tools import tool, InjectedToolCallId
+from typing import Annotated, Callable, Optional
+
+from langchain_core.messages import AIMessage
 from langchain_core.tools import StructuredTool, tool, InjectedToolCallId
-from langgraph.graph import MessagesState
-from langgraph.types import Command
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from artifacts import ArtifactStore, safe_scope
+from checkpointing import close_checkpointer, open_checkpointer
+from context_policy import CONTEXT_STATS, make_context_hook, policy_for
+from llm_cache import default_response_cache
+from md_search import default_search_index
+from md_store import (
+    OUTLINE_INDEX,
+    append_text,
+    atomic_write,
+    patch_section,
+    read_bytes,
+    read_lines,
+    read_section,
+)
+from metrics import METRICS, instrument_checkpointer, start_metrics_server
+from output_sinks import make_sink, message_content, report_stream
+from prompt_registry import PROMPTS
+from retention import start_background_retention
+from routing import PreRouter, build_pre_router
+
+# langgraph (graph, prebuilt agents, Command), the chat model wrappers (model_tiers,
+# resilience, role_validation) and numpy (semantic_cache) are imported where a graph or
+# agent is built: between them they pull in langsmith and cost over a second, which
+# `import main` (server, batch, tools-only callers) should not pay.
 
 # ----------------------------
 # Paths & Checkpointer
 # ----------------------------
+# Nothing here touches the disk at import time: md_files/ and exports/ are created by
+# the first write into them, and the default checkpointer is opened on first use.
 BASE_DIR = Path("./md_files").resolve()
-BASE_DIR.mkdir(parents=True, exist_ok=True)
+# save_markdown output (exports/<thread_id>/<name>.md, versions in exports/.store);
+# also readable through the outline / section / range / search tools
+EXPORTS_DIR = Path(__file__).resolve().parent / "exports"
+ARTIFACT_STORE = ArtifactStore(EXPORTS_DIR / ".store")
+
+_CHECKPOINTER = None
+_CHECKPOINTER_LOCK = threading.Lock()
+
 
-# Hold onto the context manager to prevent premature finalization (which would close the DB)
-_CHECKPOINTER_CM = SqliteSaver.from_conn_string("memory.db")
-CHECKPOINTER = _CHECKPOINTER_CM.__enter__()
-# Ensure DB is closed cleanly on process exit
-atexit.register(lambda: _CHECKPOINTER_CM.__exit__(None, None, None))
+def default_checkpointer():
+    """
+    Process-wide checkpointer, opened on first use. Backend selected by CHECKPOINT_BACKEND
+    (pooled WAL SQLite by default, see checkpointing.py).
+    """
+    global _CHECKPOINTER
+    with _CHECKPOINTER_LOCK:
+        if _CHECKPOINTER is None:
+            _CHECKPOINTER = open_checkpointer()
+            # Ensure DB is closed cleanly on process exit
+            atexit.register(close_checkpointer, _CHECKPOINTER)
+        return _CHECKPOINTER
 
 
 # ----------------------------
-# Pretty printing helpers
+# Turn output (see output_sinks.py)
 # ----------------------------
-def pretty_print_message(message, indent=False):
-    pretty_message = message.pretty_repr(html=True)
-    if not indent:
-        print(pretty_message)
-        return
-    indented = "\n".join("\t" + c for c in pretty_message.split("\n"))
-    print(indented)
-
-
-def pretty_print_messages(update, last_message=False):
-    is_subgraph = False
-    if isinstance(update, tuple):
-        ns, update = update
-        # skip parent graph updates in the printouts
-        if len(ns) == 0:
-            return
-        graph_id = ns[-1].split(":")[0]
-        print(f"Update from subgraph {graph_id}:\n")
-        is_subgraph = True
-
-    for node_name, node_update in update.items():
-        update_label = f"Update from node {node_name}:"
-        if is_subgraph:
-            update_label = "\t" + update_label
-        print(update_label, "\n")
-
-        messages = convert_to_messages(node_update["messages"])
-        if last_message:
-            messages = messages[-1:]
-        for m in messages:
-            pretty_print_message(m, indent=is_subgraph)
-        print("\n")
+def stream_turn(graph, user_text: str, config: dict, sink=None) -> None:
+    """Run one turn, rendering it through an output sink (OUTPUT_SINK, tokens by default)."""
+    sink = sink or make_sink(thread_id=config.get("configurable", {}).get("thread_id"))
+    try:
+        for chunk in graph.stream(
+                {"messages": [{"role": "user", "content": user_text}]},
+                config=config,
+                stream_mode=sink.stream_mode,
+                subgraphs=sink.subgraphs,
+        ):
+            sink.feed(chunk)
+    finally:
+        sink.close()
 
 
 def extract_messages_from_result(result):
@@ -79,15 +100,6 @@ def extract_messages_from_result(result):
     return None
 
 
-def message_content(msg):
-    """Get content from a message or dict safely."""
-    if hasattr(msg, "content"):
-        return msg.content
-    if isinstance(msg, dict):
-        return msg.get("content")
-    return str(msg)
-
-
 # ----------------------------
 # Safe file helpers & tools
 # ----------------------------
@@ -103,6 +115,24 @@ def _safe_path(path: str) -> Path:
     return rp
 
 
+def _doc_path(path: str) -> Path:
+    """
+    Like _safe_path, but "exports/<name>" resolves into EXPORTS_DIR (the suffix is kept
+    as saved; ".md" is added only if the bare name does not exist).
+    """
+    head, _, rest = path.replace("\\", "/").partition("/")
+    if head != "exports" or not rest:
+        return _safe_path(path)
+    p = (EXPORTS_DIR / rest).resolve()
+    if EXPORTS_DIR not in p.parents:
+        raise ValueError("Invalid path: outside allowed directory.")
+    return p if p.exists() else p.with_suffix(".md")
+
+
+def _search_index():
+    return default_search_index({"": BASE_DIR, "exports": EXPORTS_DIR})
+
+
 @tool("create_md")
 def create_md(path: str, content: str, overwrite: bool = False) -> str:
     """
@@ -113,8 +143,8 @@ def create_md(path: str, content: str, overwrite: bool = False) -> str:
     fp = _safe_path(path)
     if fp.exists() and not overwrite:
         raise FileExistsError(f"File already exists: {fp}")
-    fp.parent.mkdir(parents=True, exist_ok=True)
-    fp.write_text(content or "", encoding="utf-8")
+    atomic_write(fp, content or "", exclusive=not overwrite)
+    _search_index().reindex(fp)
     return str(fp)
 
 
@@ -122,6 +152,7 @@ def create_md(path: str, content: str, overwrite: bool = False) -> str:
 def read_md(path: str) -> str:
     """
     Read and return the contents of the .md file at `path`.
+    For long documents prefer outline_md + read_md_section / read_md_range.
     """
     fp = _safe_path(path)
     if not fp.exists():
@@ -129,12 +160,83 @@ def read_md(path: str) -> str:
     return fp.read_text(encoding="utf-8")
 
 
+@tool("outline_md")
+def outline_md(path: str) -> str:
+    """
+    List the Markdown headings of `path` (a file under md_files, or "exports/<name>"),
+    one per line as "L<line> ## Title [<section bytes>]".
+    Use it before reading a large document, then fetch only what you need with
+    read_md_section or read_md_range.
+    """
+    fp = _doc_path(path)
+    if not fp.exists():
+        raise FileNotFoundError(f"Not found: {fp}")
+    return OUTLINE_INDEX.get(fp).render()
+
+
+@tool("read_md_section")
+def read_md_section(path: str, heading: str) -> str:
+    """
+    Return one section of `path`: the heading line (e.g. "## Security" or just "Security")
+    and its body, including nested sub-headings, up to the next heading of the same or
+    higher level.
+    """
+    fp = _doc_path(path)
+    if not fp.exists():
+        raise FileNotFoundError(f"Not found: {fp}")
+    try:
+        return read_section(fp, heading)
+    except KeyError:
+        raise ValueError(f"Heading not found in {fp.name}: {heading}. Use outline_md to list headings.") from None
+
+
+@tool("read_md_range")
+def read_md_range(path: str, start: int, end: int, unit: str = "lines") -> str:
+    """
+    Return part of `path`.
+    - unit="lines": lines `start`..`end` (1-based, inclusive), e.g. the L<n> numbers from outline_md
+    - unit="bytes": bytes [`start`, `end`)
+    """
+    fp = _doc_path(path)
+    if not fp.exists():
+        raise FileNotFoundError(f"Not found: {fp}")
+    if end < start:
+        raise ValueError("end must be >= start")
+    if unit == "lines":
+        return read_lines(fp, start, end)
+    elif unit == "bytes":
+        return read_bytes(fp, start, end)
+    else:
+        raise ValueError('unit must be "lines" or "bytes"')
+
+
+@tool("search_md")
+def search_md(query: str, limit: int = 5) -> str:
+    """
+    Full-text search over all documents in md_files and exports (PRDs, role analyses,
+    architecture docs). Returns up to `limit` ranked sections as
+    "<path>#<anchor> (L<line>) <heading>" plus a short snippet.
+    Fetch a hit with read_md_section(path, heading) instead of reading the whole file.
+    """
+    hits = _search_index().search(query, limit=min(max(1, limit), 20))
+    if not hits:
+        return f"No matches for: {query}"
+    lines = []
+    for i, hit in enumerate(hits, 1):
+        anchor = f"#{hit['anchor']}" if hit["anchor"] else ""
+        lines.append(f"{i}. {hit['path']}{anchor} (L{hit['line']}) {hit['heading'] or '(preamble)'}")
+        lines.append(f"   {hit['snippet']}")
+    return "\n".join(lines)
+
+
 @tool("update_md")
-def update_md(path: str, content: str, mode: str = "overwrite") -> str:
+def update_md(path: str, content: str, mode: str = "overwrite", heading: str = "") -> str:
     """
     Update the .md file at `path`.
     - mode="overwrite": replace entire file with `content`
     - mode="append":    append `content` to end (preceded by a newline if needed)
+    - mode="section":   replace only the body under the Markdown heading `heading`
+                        (e.g. "## Risks"), up to the next heading of the same or higher level
     Returns a short status message.
     """
     fp = _safe_path(path)
@@ -142,15 +244,23 @@ def update_md(path: str, content: str, mode: str = "overwrite") -> str:
         raise FileNotFoundError(f"Not found: {fp}")
 
     if mode == "overwrite":
-        fp.write_text(content or "", encoding="utf-8")
-        return "overwritten"
+        atomic_write(fp, content or "")
+        status = "overwritten"
     elif mode == "append":
-        existing = fp.read_text(encoding="utf-8")
-        sep = "" if existing.endswith(("\n", "\r")) or not existing else "\n"
-        fp.write_text(existing + sep + (content or ""), encoding="utf-8")
-        return "appended"
+        append_text(fp, content)
+        status = "appended"
+    elif mode == "section":
+        if not heading.strip():
+            raise ValueError('mode="section" needs the `heading` to replace')
+        try:
+            patch_section(fp, heading, content)
+        except KeyError:
+            raise ValueError(f"Heading not found in {fp.name}: {heading}") from None
+        status = f"section replaced: {heading.strip()}"
     else:
-        raise ValueError('mode must be "overwrite" or "append"')
+        raise ValueError('mode must be "overwrite", "append" or "section"')
+    _search_index().reindex(fp)
+    return status
 
 
 @tool("delete_md")
@@ -163,11 +273,26 @@ def delete_md(path: str) -> str:
     if not fp.exists():
         raise FileNotFoundError(f"Not found: {fp}")
     fp.unlink()
+    OUTLINE_INDEX.invalidate(fp)
+    _search_index().reindex(fp)
     return "deleted"
 
 
+def _export_name(filename: str) -> str:
+    safe = "".join(c for c in (filename or "document.md") if c.isalnum() or c in ("-", "_", ".", " ")).strip()
+    if not safe.strip("."):
+        safe = "document.md"
+    if not safe.lower().endswith(".md"):
+        safe += ".md"
+    return safe
+
+
+def _thread_scope(config: RunnableConfig) -> str:
+    return safe_scope((config or {}).get("configurable", {}).get("thread_id"))
+
+
 @tool("save_markdown")
-def save_markdown(filename: str, content: str) -> str:
+def save_markdown(filename: str, content: str, config: RunnableConfig) -> str:
     """Save provided Markdown content to a .md file for download by the Business Analyst.
 
     Args:
@@ -175,48 +300,78 @@ def save_markdown(filename: str, content: str) -> str:
         content: Markdown content to write.
 
     Behavior:
-        - Writes into the 'exports' folder under this project.
+        - Writes into the 'exports/<conversation>' folder under this project; every save is
+          kept as a numbered version (see list_markdown_versions / get_markdown_version).
         - Sanitizes filename to avoid path traversal.
-        - Returns the absolute path to the saved file and size info.
+        - Saving content identical to the latest version is a no-op.
+        - Returns the absolute path to the saved file, its version and size info.
     """
-    base_dir = os.path.join(os.path.dirname(__file__), "exports")
-    os.makedirs(base_dir, exist_ok=True)
+    scope = _thread_scope(config)
+    name = _export_name(filename)
+    entry, changed = ARTIFACT_STORE.put(scope, name, content or "")
 
-    safe = "".join(c for c in (filename or "document.md") if c.isalnum() or c in ("-", "_", ".", " ")).strip()
-    if not safe:
-        safe = "document.md"
-    if not safe.lower().endswith(".md"):
-        safe += ".md"
+    out_path = EXPORTS_DIR / scope / name
+    if changed or not out_path.exists():
+        atomic_write(out_path, content or "")
+        _search_index().reindex(out_path)
 
-    out_path = os.path.join(base_dir, safe)
-    data = content or ""
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(data)
+    status = "Saved markdown to" if changed else "Unchanged, already saved as"
+    return f"{status} {out_path} (version {entry.version}, {entry.size} bytes)."
 
-    abs_path = os.path.abspath(out_path)
-    size_bytes = len(data.encode("utf-8"))
-    return f"Saved markdown to {abs_path} ({size_bytes} bytes)."
+
+@tool("list_markdown_versions")
+def list_markdown_versions(config: RunnableConfig, filename: str = "") -> str:
+    """
+    List documents saved with save_markdown in this conversation (latest version of each),
+    or every version of `filename` when given.
+    """
+    scope = _thread_scope(config)
+    entries = ARTIFACT_STORE.versions(scope, _export_name(filename) if filename else None)
+    if not entries:
+        return f"No saved versions{f' of {filename}' if filename else ''} in this conversation."
+    return "\n".join(
+        f"{e.name} v{e.version} {e.size} bytes sha256:{e.sha256[:12]} "
+        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e.at))}"
+        for e in entries
+    )
+
+
+@tool("get_markdown_version")
+def get_markdown_version(filename: str, config: RunnableConfig, version: int = 0) -> str:
+    """Return the content of a document saved with save_markdown; `version` 0 = latest."""
+    try:
+        return ARTIFACT_STORE.get(_thread_scope(config), _export_name(filename), version or None)
+    except KeyError as e:
+        raise ValueError(str(e.args[0])) from None
 
 
 # ----------------------------
 # Handoff tool factory
 # ----------------------------
-def create_handoff_tool(*, agent_name: str, description: str | None = None):
+def create_handoff_tool(*, agent_name: str, description: str | None = None, router: PreRouter | None = None):
     """
     Create a supervisor-owned tool that, when invoked, transfers control to `agent_name`
     and forwards the full MessagesState to that agent.
+    If `router` is given, each handoff is reported to it so it can learn from the decision.
     """
+    from langgraph.graph import MessagesState
+    from langgraph.prebuilt import InjectedState
+    from langgraph.types import Command
+
     name = f"transfer_to_{agent_name}"
     description = description or f"Hand off to {agent_name}."
 
     def handoff_tool(
             state: Annotated[MessagesState, InjectedState],
             tool_call_id: Annotated[str, InjectedToolCallId],
+            config: RunnableConfig,
     ) -> Command:
         """Transfer control to the target agent and forward the full MessagesState.
 
         This tool is dynamically named per agent as transfer_to_<agent_name>.
         """
+        if router is not None:
+            router.observe(state["messages"], agent_name, config.get("configurable", {}).get("thread_id"))
         tool_message = {
             "role": "tool",
             "content": f"Successfully transferred to {agent_name}",
@@ -233,6 +388,69 @@ def create_handoff_tool(*, agent_name: str, description: str | None = None):
     return StructuredTool.from_function(handoff_tool, name=name, description=description)
 
 
+@functools.cache
+def orchestrator_state() -> type:
+    """
+    The supervisor graph's state schema: MessagesState plus the worker names dispatched
+    by the pending fan-out (if any) and the validated outputs of the clinical roles
+    (role -> fields; see role_validation). Built on first use, like the graph.
+    """
+    from langgraph.graph import MessagesState
+    from role_validation import merge_role_outputs
+
+    class OrchestratorState(MessagesState):
+        fanout: list[str]
+        role_outputs: Annotated[dict, merge_role_outputs]
+
+    return OrchestratorState
+
+
+FANOUT_TOOL_NAME = "transfer_to_agents"
+
+
+def create_fanout_tool(*, agent_names: list[str], description: str | None = None):
+    """
+    Create a supervisor-owned tool that sends the same request to several workers at once.
+    The targets run in parallel and their outputs are joined by the `merge` node before
+    control returns to the supervisor.
+    """
+    from langgraph.graph import MessagesState
+    from langgraph.prebuilt import InjectedState
+    from langgraph.types import Command
+
+    allowed = list(agent_names)
+    description = description or (
+        "Hand off to several agents in parallel and merge their outputs. "
+        f"Valid agent names: {', '.join(allowed)}."
+    )
+
+    def fanout_tool(
+            agents: list[str],
+            state: Annotated[MessagesState, InjectedState],
+            tool_call_id: Annotated[str, InjectedToolCallId],
+    ) -> Command:
+        """Transfer control to every agent in `agents` concurrently."""
+        targets = list(dict.fromkeys(agents))  # de-duplicate, keep order
+        unknown = [a for a in targets if a not in allowed]
+        if unknown or not targets:
+            raise ValueError(f"agents must be a non-empty subset of: {', '.join(allowed)}")
+
+        tool_message = {
+            "role": "tool",
+            "content": f"Successfully transferred to {', '.join(targets)}",
+            "name": FANOUT_TOOL_NAME,
+            "tool_call_id": tool_call_id,
+        }
+        # Jumping to several nodes at once runs them in the same (parallel) superstep
+        return Command(
+            goto=targets,
+            update={**state, "messages": state["messages"] + [tool_message], "fanout": targets},
+            graph=Command.PARENT,
+        )
+
+    return StructuredTool.from_function(fanout_tool, name=FANOUT_TOOL_NAME, description=description)
+
+
 # ----------------------------
 # Simple math helpers (kept from your original)
 # ----------------------------
@@ -254,56 +472,236 @@ def divide(a: float, b: float):
 # ----------------------------
 # Agent factory
 # ----------------------------
-def create_agent(name: str, prompt: str, tools: list):
+# Model tiers and each agent's fallback chain (see model_tiers.py); override with
+# MODEL_TIER_<TIER> and AGENT_MODEL_<AGENT>, e.g. AGENT_MODEL_NURSE=strong>standard.
+DEFAULT_MODEL_TIERS = {
+    "fast": "openai:gpt-4.1-nano,temperature=0,timeout=30",
+    "standard": "openai:gpt-4o-mini,timeout=90",
+    "strong": "openai:gpt-4o,timeout=120",
+}
+DEFAULT_AGENT_MODELS = {
+    "supervisor": "fast>standard,max_tokens=512,temperature=0",
+    "receptionist": "fast>standard",
+    "business_analyst": "standard>fast",
+    "nurse": "standard>fast",
+    "doctor": "standard>fast",
+    "lab": "standard>fast",
+    "architect": "strong>standard",
+}
+
+
+def chat_model(agent: str = "", cache: bool = True):
+    """
+    Chat model for `agent`: its tier chain from DEFAULT_AGENT_MODELS. Responses go
+    through the shared exact-match response cache unless `cache=False` (or LLM_CACHE=0).
+    """
+    from model_tiers import chain_for, tiered_chat_model
+
+    llm_cache = default_response_cache() if cache else None
+    chain = chain_for(agent, DEFAULT_MODEL_TIERS, DEFAULT_AGENT_MODELS)
+    return tiered_chat_model(agent, chain, cache=llm_cache or False)
+
+
+# What each worker's LLM sees of the shared history (see context_policy.parse_policy);
+# override per agent with CONTEXT_POLICY_<NAME>, e.g. CONTEXT_POLICY_NURSE=summary.
+DEFAULT_CONTEXT_POLICIES = {
+    "business_analyst": "roles:receptionist,nurse,doctor,lab,architect,merge",
+    "receptionist": "last:2",
+    "nurse": "last:2",
+    "doctor": "last:2",
+    "lab": "last:2",
+    "architect": "roles:business_analyst,merge",
+}
+
+
+# Minimum cosine similarity between a conversation's opening request and one the role
+# already answered for the semantic cache to serve that reply instead of running the agent
+# (the content terms must match as well; see semantic_cache.py). Override per role with
+# SEMANTIC_CACHE_THRESHOLD_<NAME> (0 = off). On the clinic request pairs listed in
+# semantic_cache.py, rewordings of the same request score 0.57-1.0, so the threshold only
+# shortlists candidates and the term rule rejects topic swaps. These roles also have
+# document tools: runs that used them are never stored, so a hit never stands in for a
+# write.
+DEFAULT_SEMANTIC_THRESHOLDS = {
+    "nurse": 0.55,
+    "doctor": 0.55,
+    "lab": 0.55,
+}
+
+
+# Fields of the clinical roles' structured outputs (state["role_outputs"]) handed to an
+# agent directly, ahead of its message window
+DEFAULT_ROLE_FIELDS = {
+    "architect": ("fhir_mapping", "data_fields", "api_endpoints", "rbac", "audit_events", "dependencies"),
+}
+
+
+def create_agent(name: str, tools: list, prompt: Optional[str] = None, cache: bool = True):
+    from langgraph.prebuilt import create_react_agent
+    from role_validation import ROLE_OUTPUT_MODELS, RoleAgentState, make_role_output_hook, with_role_validation
+
+    # The system prompt defaults to prompts/agents/<name>.md (see prompt_registry.py)
+    # Roles with a pydantic output model (common/csi_common/role_schemas.py) get their
+    # replies validated while streaming, and stored validated in `role_outputs`
+    structured = name in ROLE_OUTPUT_MODELS
     agent = create_react_agent(
-        model="openai:gpt-4o-mini",
+        model=with_role_validation(chat_model(name, cache=cache), name),
         tools=tools,
-        prompt=prompt,
+        prompt=PROMPTS.text(name) if prompt is None else prompt,
         name=name,
+        state_schema=RoleAgentState,
+        pre_model_hook=make_context_hook(
+            name, policy_for(name, DEFAULT_CONTEXT_POLICIES.get(name)), role_fields=DEFAULT_ROLE_FIELDS.get(name, ()),
+        ),
+        post_model_hook=make_role_output_hook(name) if structured else None,
     )
-    return agent
+    # Timings/tokens are recorded whether the agent runs standalone or inside the graph
+    return agent.with_config(metadata={"agent": name}, callbacks=[METRICS.handler])
+
+
+class LazyAgent:
+    """
+    An agent whose react graph (chat model, tool schemas, compiled subgraph) is only built
+    by `factory` the first time a turn is routed to it, then cached. `as_node()` is the
+    graph node: it runs the agent as a subgraph of the calling graph, like adding it directly.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Runnable]):
+        self.name = name
+        self._factory = factory
+        self._agent = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._agent is not None
+
+    def get(self):
+        if self._agent is None:
+            with self._lock:
+                if self._agent is None:
+                    self._agent = self._factory()
+        return self._agent
+
+    def _invoke(self, state: dict, config: RunnableConfig):
+        return self.get().invoke(state, config)
+
+    async def _ainvoke(self, state: dict, config: RunnableConfig):
+        return await self.get().ainvoke(state, config)
+
+    def as_node(self) -> RunnableLambda:
+        return RunnableLambda(self._invoke, afunc=self._ainvoke, name=self.name)
+
+
+def lazy_agent(name: str, tools: list, prompt: Optional[str] = None, cache: bool = True) -> RunnableLambda:
+    """
+    create_agent(...), deferred until the agent first runs (see LazyAgent). Roles in
+    DEFAULT_SEMANTIC_THRESHOLDS are fronted by the semantic cache unless `cache=False`.
+    """
+    node = LazyAgent(name, functools.partial(create_agent, name, tools, prompt, cache)).as_node()
+    if not cache or name not in DEFAULT_SEMANTIC_THRESHOLDS:
+        return node
+    from semantic_cache import default_semantic_cache, with_semantic_cache
+
+    semantic_cache = default_semantic_cache(DEFAULT_SEMANTIC_THRESHOLDS)
+    if semantic_cache is None or not semantic_cache.enabled_for(name):
+        return node
+    # Entries are scoped by system prompt: editing it invalidates the role's cached replies
+    text = PROMPTS.text(name) if prompt is None else prompt
+    scope = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    return with_semantic_cache(node, name, scope, semantic_cache)
 
 
 # ----------------------------
-# Supervisor factory (accepts transfer tools)
+# Supervisor graph
 # ----------------------------
-# def generate_supervisor(agents: dict, tools: list):
-#     # Build a helpful prompt that tells the supervisor to *use* the transfer tools
-#     prompt = "You are a supervisor that routes work to exactly one agent at a time.\n"
-#     prompt += "Use the appropriate transfer tool to hand off the full conversation to that agent.\n"
-#     prompt += "Do not do any domain work yourself.\n"
-#     prompt += "Agents available:\n"
-#     for agent_name, agent in agents.items():
-#         prompt += f"- {agent.name if hasattr(agent, 'name') else agent_name}\n"
-#     prompt += (
-#         "\nRules:\n"
-#         "- Always decide which single agent should act next.\n"
-#         "- Call the matching tool `transfer_to_<agent_name>` to hand off control.\n"
-#         "- Wait for the agent to respond before making another decision.\n"
-#     )
-#
-#     supervisor = create_supervisor(
-#         model=init_chat_model("openai:gpt-4o-mini"),
-#         agents=[agent for agent in agents.values()],
-#         prompt=prompt,
-#         tools=tools,  # supervisor gets the handoff tools
-#         add_handoff_back_messages=True,
-#         output_mode="full_history",
-#     ).compile(checkpointer=CHECKPOINTER)
-#
-#     return supervisor
-
-# ADD these imports if not already present
-from langgraph.graph import StateGraph, START, MessagesState
-
-def build_graph_with_supervisor_agent(agents: dict, handoff_tools: list):
+def _parse_role_output(content):
+    """Parse a worker's STRICT JSON reply; fall back to the raw text if it is not JSON."""
+    if not isinstance(content, str):
+        return content
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content
+
+
+def merge_fanout_outputs(state: dict):
+    """
+    Join the latest reply of every worker in the pending fan-out into one JSON object
+    keyed by worker name, then clear the fan-out so later hops route normally.
+    """
+    pending = state.get("fanout") or []
+    structured = state.get("role_outputs") or {}
+    # Validated outputs are used as-is; only the other workers' replies are parsed
+    merged = {name: structured[name] for name in pending if structured.get(name)}
+    for msg in reversed(state["messages"]):
+        if len(merged) == len(pending):
+            break
+        name = getattr(msg, "name", None)
+        if isinstance(msg, AIMessage) and name in pending and name not in merged:
+            merged[name] = _parse_role_output(msg.content)
+    ordered = {name: merged.get(name) for name in pending}
+    return {
+        "messages": [AIMessage(content=json.dumps(ordered, ensure_ascii=False), name="merge")],
+        "fanout": [],
+    }
+
+
+def _route_after_worker(state: dict) -> str:
+    """Workers dispatched by a fan-out join in `merge`; single handoffs go straight back."""
+    return "merge" if state.get("fanout") else "supervisor"
+
+
+def make_pre_router_node(router: PreRouter):
+    """
+    Graph node that routes the new user request straight to a worker when the pre-router
+    is confident, and to the LLM supervisor otherwise.
+    """
+    from langgraph.types import Command
+
+    def pre_router(state: dict, config: RunnableConfig) -> Command:
+        last = state["messages"][-1]
+        if getattr(last, "type", None) != "human":
+            return Command(goto="supervisor")
+        thread_id = config.get("configurable", {}).get("thread_id")
+        decision = router.route(message_content(last), thread_id)
+        return Command(goto=decision.agent or "supervisor")
+
+    return pre_router
+
+
+def build_graph_with_supervisor_agent(
+        agents: dict,
+        handoff_tools: list,
+        fanout: bool = True,
+        checkpointer=None,
+        pre_router: PreRouter | None = None,
+):
     """
     Build a LangGraph that starts at a react-style supervisor node which only routes
     by calling handoff tools (transfer_to_<agent>) to jump to worker nodes.
     After any worker replies once, it returns to the supervisor.
+
+    With `fanout=True` the supervisor also gets `transfer_to_agents`, which runs several
+    workers in parallel and joins their outputs in a `merge` node before returning.
+    `checkpointer` defaults to default_checkpointer().
+
+    The compiled graph reports node/LLM/tool timings, token usage and checkpoint I/O to
+    `metrics.METRICS`.
+
+    With a `pre_router`, each turn first goes through a deterministic routing stage that
+    jumps straight to a worker when it is confident, skipping the supervisor LLM call.
     """
+    from langgraph.graph import START, StateGraph
+    from langgraph.prebuilt import create_react_agent
+
+    worker_names = [a.name for a in agents.values()]
+    tools = list(handoff_tools)
+    if fanout:
+        tools.append(create_fanout_tool(agent_names=worker_names))
+
     # 1) Create a react-style supervisor agent that ONLY routes via tools
-    agent_names_for_prompt = ", ".join([a.name for a in agents.values()])
+    agent_names_for_prompt = ", ".join(worker_names)
     supervisor_prompt = (
         "You are a supervisor that routes tasks to exactly one agent at a time.\n"
         f"Agents available: {agent_names_for_prompt}\n"
@@ -311,16 +709,22 @@ def build_graph_with_supervisor_agent(agents: dict, handoff_tools: list):
         "- ALWAYS call the correct tool named `transfer_to_<agent_name>` to hand off.\n"
         "- After a worker responds, you may decide the next handoff.\n"
     )
+    if fanout:
+        supervisor_prompt += (
+            f"- When several agents should each contribute independently to the same request, "
+            f"call `{FANOUT_TOOL_NAME}` once with all of their names instead of handing off "
+            "one by one; their outputs come back merged into a single JSON object.\n"
+        )
 
-    supervisor_agent = create_react_agent(
-        model="openai:gpt-4o-mini",
-        tools=handoff_tools,
+    supervisor_agent = LazyAgent("supervisor", lambda: create_react_agent(
+        model=chat_model("supervisor"),
+        tools=tools,
         prompt=supervisor_prompt,
         name="supervisor",
-    )
+    )).as_node()
 
     # 2) Build the parent graph with supervisor + worker nodes
-    graph = StateGraph(MessagesState)
+    graph = StateGraph(orchestrator_state())
 
     # Add supervisor node
     graph.add_node("supervisor", supervisor_agent)
@@ -330,24 +734,43 @@ def build_graph_with_supervisor_agent(agents: dict, handoff_tools: list):
         # each value is already a runnable agent from create_react_agent
         graph.add_node(worker.name, worker)
 
-    # Start at supervisor
-    graph.add_edge(START, "supervisor")
-
-    # After any worker runs, return to supervisor
-    for _key, worker in agents.items():
-        graph.add_edge(worker.name, "supervisor")
+    # Start at supervisor (through the pre-router when one is configured)
+    if pre_router is not None:
+        graph.add_node(
+            "pre_router", make_pre_router_node(pre_router), destinations=tuple(worker_names) + ("supervisor",)
+        )
+        graph.add_edge(START, "pre_router")
+    else:
+        graph.add_edge(START, "supervisor")
+
+    # After any worker runs, return to supervisor (via `merge` when it was fanned out)
+    if fanout:
+        graph.add_node("merge", merge_fanout_outputs)
+        graph.add_edge("merge", "supervisor")
+        for _key, worker in agents.items():
+            graph.add_conditional_edges(worker.name, _route_after_worker, ["merge", "supervisor"])
+    else:
+        for _key, worker in agents.items():
+            graph.add_edge(worker.name, "supervisor")
 
     # 3) Compile
-    return graph.compile(checkpointer=CHECKPOINTER)
+    compiled = graph.compile(checkpointer=instrument_checkpointer(checkpointer or default_checkpointer()))
+    return compiled.with_config(callbacks=[METRICS.handler])
 
 
 # ----------------------------
 # Interactive shell
 # ----------------------------
-def interactive_chat(supervisor, initial_thread_id: str | None = None):
+def interactive_chat(supervisor, initial_thread_id: str | None = None, router: PreRouter | None = None):
+    from model_tiers import TIER_HEALTH
+    from resilience import RESILIENCE_STATS
+    from role_validation import VALIDATION_STATS
+    from semantic_cache import default_semantic_cache
+
     thread_id = initial_thread_id or f"session-{uuid.uuid4().hex[:8]}"
     print("Interactive chat mode. Type your message and press Enter.")
-    print("Commands: /help, /exit, /quit, /new, /thread")
+    print("Commands: /help, /exit, /quit, /new, /thread, /cache, /context, /prompts, /models, /validation, "
+          "/semcache, /search <query>")
     print(f"Current thread_id: {thread_id}")
     while True:
         try:
@@ -372,6 +795,13 @@ def interactive_chat(supervisor, initial_thread_id: str | None = None):
                 print("  /quit   Exit the chat")
                 print("  /new    Start a new conversation thread (new thread_id)")
                 print("  /thread Show current thread_id")
+                print("  /cache  Show LLM response cache hit/miss counters")
+                print("  /context Show prompt tokens saved by per-agent context policies")
+                print("  /prompts Show system prompt hashes/sizes and provider prompt-cache hit ratios")
+                print("  /models Show model tier health, per-agent fallbacks, retries/hedges/deadlines")
+                print("  /validation Show role JSON validation outcomes and retries")
+                print("  /semcache Show semantic cache hit rates per role and the latest cache-served replies")
+                print("  /search <query> Search md_files and exports (FTS5)")
                 continue
             if cmd == "/new":
                 thread_id = f"session-{uuid.uuid4().hex[:8]}"
@@ -380,967 +810,173 @@ def interactive_chat(supervisor, initial_thread_id: str | None = None):
             if cmd == "/thread":
                 print(f"Current thread_id: {thread_id}")
                 continue
+            if cmd == "/cache":
+                llm_cache = default_response_cache()
+                print(llm_cache.stats() if llm_cache else "LLM response cache is disabled (LLM_CACHE=0).")
+                continue
+            if cmd == "/context":
+                for agent_name, agent_stats in CONTEXT_STATS.summary().items():
+                    print(f"  {agent_name}: {agent_stats}")
+                continue
+            if cmd == "/prompts":
+                for agent_name, agent_stats in prompt_stats().items():
+                    print(f"  {agent_name}: {agent_stats}")
+                continue
+            if cmd == "/models":
+                for section, entries in TIER_HEALTH.summary().items():
+                    for entry_name, entry_stats in entries.items():
+                        print(f"  {section[:-1]} {entry_name}: {entry_stats}")
+                resilience = RESILIENCE_STATS.summary()
+                for label, label_stats in resilience["models"].items():
+                    print(f"  calls {label}: {label_stats}")
+                print(f"  retry budget: {resilience['retry_budget']} tokens")
+                continue
+            if cmd.startswith("/search"):
+                query = user_in.strip()[len("/search"):].strip()
+                print(search_md.invoke({"query": query}) if query else _search_index().stats())
+                continue
+            if cmd == "/validation":
+                for agent_name, agent_stats in VALIDATION_STATS.summary().items():
+                    print(f"  {agent_name}: {agent_stats}")
+                continue
+            if cmd == "/semcache":
+                semantic_cache = default_semantic_cache(DEFAULT_SEMANTIC_THRESHOLDS)
+                if semantic_cache is None:
+                    print("Semantic cache is disabled (SEMANTIC_CACHE=0).")
+                    continue
+                print(semantic_cache.stats())
+                for hit in semantic_cache.audit(limit=5):
+                    print(f"  [{hit['role']}] {hit['similarity']:.2f} {hit['query'][:60]!r} <- {hit['cached_query'][:60]!r}")
+                continue
             print(f"Unknown command: {cmd}. Type /help")
             continue
         cfg = {"configurable": {"thread_id": thread_id}}
         try:
-            for chunk in supervisor.stream({"messages": [{"role": "user", "content": user_in}]}, config=cfg):
-                pretty_print_messages(chunk, last_message=True)
+            stream_turn(supervisor, user_in, cfg)
         except Exception as e:
             print(f"Error during streaming: {e}")
+        _print_turn_report(router, thread_id)
+
+
+def _print_turn_report(router: PreRouter | None, thread_id: str):
+    lines = [METRICS.turn_summary(thread_id), router.report(thread_id) if router else ""]
+    for line in lines:
+        if line:
+            print(line, file=report_stream())
 
 
 # ----------------------------
-# Main: define agents and supervisor with handoffs
+# Agents, supervisor graph and entry point
 # ----------------------------
-def main():
-    agents = {
-        "ba": create_agent(
+def build_agents() -> dict:
+    """
+    Create the worker agents keyed by short role name. Each is a lazy graph node: its
+    model and react agent are built on the first turn routed to it (see LazyAgent).
+    """
+    return {
+        "ba": lazy_agent(
             name="business_analyst",
-            prompt="""
-**Persona:**
-
-You are an expert **Senior Business Analyst** at a global software company. Your specialization is in Health Information Systems (HIS). You possess a deep understanding of clinical workflows, healthcare data management, and software development lifecycles.
-
-**Context:**
-
-Our company develops and maintains a cutting-edge, cloud-native Health Information System (HIS). This system is built on a **microservices architecture**, with dozens of independent services handling specific domains (e.g., Patient Management, Scheduling, Billing, Clinical Records, etc.). Our customer base is worldwide, including major hospital networks in North America, Europe, and Asia.
-
-**Core Mandates & Constraints (Non-Negotiable):**
-
-1.  **HL7 FHIR Standard:** All interoperability and data exchange specifications **must** strictly adhere to the latest version of the HL7 FHIR standard. You must identify the specific FHIR resources (e.g., `Patient`, `Observation`, `Encounter`, `MedicationRequest`) relevant to any new feature.
-
-2.  **Security & Compliance:** Every requirement must be analyzed through a security-first lens. You must explicitly consider and list potential impacts related to global compliance standards, primarily **HIPAA** (for the US), **GDPR** (for Europe), and other regional data protection laws. This includes data encryption, access controls (RBAC), audit trails, and data anonymization.
-
-3.  **Microservices Architecture:** Your analysis must identify which existing microservices are likely to be impacted by the new feature and whether any new microservices might be required.
-
-4.  **Scalability & Performance:** The solution must be designed to serve a large, global user base, so requirements should implicitly support scalability and high performance.
-
-**Your Task:**
-
-When I provide you with a high-level feature request or a business problem, you will perform a complete business analysis and generate a structured requirements document. Your response **must** include the following sections, formatted exactly as shown below:
-
----
-
-### 1. Feature Epic
-
-* **Epic Title:** A concise, descriptive title for the overall feature.
-
-* **Epic Description:** A detailed narrative explaining the feature, the problem it solves, its value proposition, and the primary business goals.
-
----
-
-### 2. User Stories
-
-* Create a list of user stories that break down the epic into manageable chunks.
-
-* Follow the standard format: **As a** `[user role]`, **I want** `[to perform an action]`, **so that** `[I can achieve a benefit]`.
-
-* Include stories for different user roles (e.g., Doctor, Nurse, Patient, Administrator, Billing Clerk).
-
----
-
-### 3. Acceptance Criteria
-
-* For each user story, provide detailed acceptance criteria in the **Gherkin format (Given/When/Then)**.
-
-* These criteria must be specific, measurable, and testable.
-
-*Example:*
-
-* **User Story 1:** As a Doctor, I want to view a patient's latest lab results directly from their chart summary, so that I can make faster clinical decisions.
-
-* **Acceptance Criteria:**
-
-    * **Scenario:** Doctor accesses lab results from chart summary.
-
-    * **Given** I am logged in as a Doctor and am viewing a patient's chart.
-
-    * **When** I click on the "Latest Lab Results" widget.
-
-    * **Then** a modal window should appear displaying the 5 most recent lab result panels.
-
-    * **And** each result should show the test name, value, reference range, and collection date.
-
----
-
-### 4. Impacted Microservices
-
-* List the potential microservices that will need to be created or modified to implement this feature.
-
-* Provide a brief justification for each.
-
-* *Example: `PatientRecord Service` (to fetch chart data), `Observation Service` (to query lab results), `API Gateway` (to expose a new endpoint).*
-
----
-
-### 5. Data & Interoperability (HL7 FHIR)
-
-* **Primary FHIR Resources:** Identify the core FHIR resources that will be used to represent the data for this feature.
-
-* **FHIR Interactions:** Specify the RESTful interactions needed (e.g., `GET Patient/[id]`, `POST Observation`, `SEARCH Encounter?patient=[id]`).
-
-* **Data Mapping:** Briefly describe how key data elements from the feature map to fields within the identified FHIR resources.
-
----
-
-### 6. Security & Compliance Considerations
-
-* **Access Control:** Define which user roles should have access to this new feature/data.
-
-* **Data Sensitivity:** Classify the type of data being handled (e.g., PHI, PII) and specify requirements like encryption at rest and in transit.
-
-* **Auditing:** State what actions must be logged for audit purposes (e.g., who viewed the data and when).
-
-* **Compliance Checklist:** Briefly mention key HIPAA/GDPR rules that apply and how the feature design addresses them.
-
----
-
-### 7. Assumptions & Clarifying Questions
-
-* List any assumptions you've made while creating this analysis.
-
-* Pose critical questions for the Product Owner or stakeholders to clarify ambiguities and resolve dependencies.
-
----
-
-**Initiation:**
-
-Your first response should always be: "I am ready to analyze your request. Please provide me with the high-level feature or business problem you would like me to work on."
-
-            """,
-            tools=[create_md, read_md, update_md, delete_md],
+            tools=[create_md, read_md, outline_md, read_md_section, read_md_range, search_md, update_md, delete_md],
         ),
-        "receptionist": create_agent(
+        "receptionist": lazy_agent(
             name="receptionist",  # FIXED: must match the handoff goto target
-            prompt="""
-            You are the IVF Clinic Receptionist agent in a multi-agent team (BA, Doctor, Nurse, Lab, Architect, UI/UX).
-Your job: turn the user's high-level ask into front-desk workflows and system requirements for an IVF EMR/portal.
-
-Return **STRICT JSON ONLY** (no markdown, no code fences, no extra prose).
-Audience: internal system agents and engineers (not patients). Do NOT include PHI or real patient data.
-
-=== Scope of responsibility (reception/front desk) ===
-- Patient onboarding & intake: demographics, contact methods, preferred language, consent capture (clinic, data sharing), ID document capture.
-- Scheduling & calendar: Appointment create/reschedule/cancel, waitlist, overbooking rules, reminders (SMS/Email/WhatsApp), time-zone handling.
-- Check-in/Check-out desk flow: arrival tracking, queue management, no-show/late logic, handoff to clinical encounter start.
-- Communications: reminder campaigns, pre-visit instructions, broadcast alerts (e.g., clinic closure), template management and opt-in/out.
-- Forms & attachments: pre-visit questionnaires, consent forms (e-sign), referral letters, eligibility/coverage docs (if applicable).
-- Routing & handoffs: route to Doctor/Nurse/Lab based on appointment type; surface missing prerequisites (consent/forms).
-- Safety & compliance: identity verification, consent status, communication preferences, audit trails.
-
-=== Output rules ===
-- Output MUST be valid JSON with a flat top-level object.
-- Keep items concise and operational; avoid patient-specific advice.
-- Prefer HL7 FHIR R4 names; use placeholders like "TBD-SNOMED" or "TBD-LOINC" if codes are unknown.
-- If something depends on policy, put it under "assumptions" or "open_questions".
-- No PHI, no real names/IDs/dates.
-
-=== Required top-level JSON keys (you may add more if helpful) ===
-- role: must be "receptionist"
-- workflows: string[]
-- functional_requirements: string[]
-- user_stories: { as_a, i_want, so_that, acceptance_criteria[] }[]
-- data_fields: { entity, fields: [{ name, type, required }] }[]
-- fhir_mapping:
-    # Either form is accepted:
-    # 1) { module, fhir_resources[] }
-    # 2) { entity, resource }
-- risks: string[]
-- assumptions: string[]
-- dependencies: string[]                 # e.g., SMS/Email gateway, e-signature, calendar service
-- rbac: { role: string, permissions: string[] }[]
-- audit_events: string[]                 # critical events to audit
-- api_endpoints: { name, request, response }[]
-- open_questions: string[]
-
-=== Suggested receptionist content to consider ===
-- Scheduling: Appointment types (consult, scan, OPU/ET slot placeholders), provider/salle links, capacity rules, waitlist promotion logic, blackout dates/holidays.
-- Reminders: multi-channel (SMS/Email/WhatsApp), send windows, retry logic, local language templates, opt-out handling.
-- Check-in: kiosk/manual, QR or code look-up, verify consent/questionnaire completion, assign queue token, start clinical Encounter.
-- Forms: Questionnaire/QuestionnaireResponse for intake/consents; store rendered PDF; versioning.
-- Consents: Consent resource for data sharing/communication; track status and expiry.
-- Communication preferences: FHIR Patient.communication + custom preferences; quiet hours.
-- FHIR candidates: Patient, Appointment, Schedule, Slot, Practitioner, Location, Encounter (start at check-in), Consent, CommunicationRequest, Questionnaire, QuestionnaireResponse, Organization.
-
-=== Example (minimal — guidance only; do NOT copy literally) ===
-{
-  "role": "receptionist",
-  "workflows": [
-    "New patient pre-registration with demographics, consent, and intake forms",
-    "Appointment create/reschedule/cancel with waitlist",
-    "Automated multi-channel reminders with opt-out",
-    "Check-in with ID verification and Encounter start",
-    "No-show handling and rebooking workflow"
-  ],
-  "functional_requirements": [
-    "Calendar with provider/location availability and slot rules",
-    "Reminder engine (SMS/Email/WhatsApp) with templates and quiet-hours",
-    "Kiosk/manual check-in with QR code and queue token",
-    "Consent capture with e-signature and versioning",
-    "Intake questionnaires with language support"
-  ],
-  "user_stories": [
-    {
-      "as_a": "Receptionist",
-      "i_want": "to reschedule an Appointment while preserving the waitlist position",
-      "so_that": "patient convenience is balanced with clinic capacity",
-      "acceptance_criteria": [
-        "System shows next 5 alternative slots per provider/location",
-        "Waitlisted patients auto-promote if a slot opens",
-        "All changes are audited with reason codes"
-      ]
-    }
-  ],
-  "data_fields": [
-    {
-      "entity": "AppointmentRequest",
-      "fields": [
-        { "name": "patientRef", "type": "reference(Patient)", "required": true },
-        { "name": "type", "type": "code", "required": true },
-        { "name": "providerRef", "type": "reference(Practitioner)", "required": false },
-        { "name": "locationRef", "type": "reference(Location)", "required": false },
-        { "name": "start", "type": "datetime", "required": true },
-        { "name": "end", "type": "datetime", "required": true },
-        { "name": "notes", "type": "string", "required": false }
-      ]
-    },
-    {
-      "entity": "PreVisitChecklist",
-      "fields": [
-        { "name": "consentStatus", "type": "enum(missing|signed|expired)", "required": true },
-        { "name": "questionnaireStatus", "type": "enum(missing|pending|completed)", "required": true },
-        { "name": "communicationPreference", "type": "enum(sms|email|whatsapp)", "required": false }
-      ]
-    }
-  ],
-  "fhir_mapping": [
-    { "module": "FrontDesk", "fhir_resources": ["Patient", "Appointment", "Schedule", "Slot", "Location", "Practitioner", "Encounter", "Consent", "Questionnaire", "QuestionnaireResponse", "CommunicationRequest"] },
-    { "entity": "CheckIn", "resource": "Encounter" },
-    { "entity": "Reminders", "resource": "CommunicationRequest" },
-    { "entity": "ConsentRecord", "resource": "Consent" }
-  ],
-  "risks": [
-    "Overbooking or double-booking leading to delays",
-    "Reminders sent outside allowed hours or to opted-out channels",
-    "Missing consent before clinical encounter",
-    "Timezone or DST errors for telemedicine slots"
-  ],
-  "assumptions": [
-    "Clinic maintains provider schedules and holidays centrally",
-    "Patients can receive SMS in their preferred language",
-    "E-signature service is available for consents"
-  ],
-  "dependencies": [
-    "SMS/Email/WhatsApp gateway",
-    "E-signature provider",
-    "Identity/Access Management (OIDC)",
-    "Calendar/scheduling component"
-  ],
-  "rbac": [
-    { "role": "Receptionist", "permissions": ["create_appointment", "reschedule_appointment", "record_checkin", "send_reminder"] },
-    { "role": "FrontDeskLead", "permissions": ["override_overbook_with_reason", "cancel_with_waiver"] }
-  ],
-  "audit_events": [
-    "Appointment created/rescheduled/cancelled",
-    "Reminder sent/failed",
-    "Consent signed/updated",
-    "Check-in recorded and Encounter started",
-    "No-show marked and rebooked"
-  ],
-  "api_endpoints": [
-    { "name": "POST /appointments", "request": "AppointmentRequestDTO", "response": "AppointmentId" },
-    { "name": "POST /checkin", "request": "CheckInDTO", "response": "EncounterId" },
-    { "name": "POST /reminders/send", "request": "ReminderBatchDTO", "response": "BatchId" }
-  ],
-  "open_questions": [
-    "Allowed reminder windows and quiet-hours policy?",
-    "Waitlist prioritization rules (FIFO, urgency, VIP)?",
-    "Languages supported for templates and forms?"
-  ]
-}
-
-Now, given the BA’s prompt, produce STRICT JSON only, adhering to the above.
-            """,
-            tools=[create_md, read_md, update_md, delete_md],
+            tools=[create_md, read_md, outline_md, read_md_section, read_md_range, search_md, update_md, delete_md],
         ),
-        "nurse": create_agent(
+        "nurse": lazy_agent(
             name="nurse",
-            prompt="""
-You are the IVF Clinic Nurse agent in a multi-agent team (BA, Doctor, Lab, Receptionist, Architect, UI/UX).
-Your job: transform the user's high-level ask into nursing workflows and system requirements for an IVF EMR/portal.
-
-Return **STRICT JSON ONLY** (no markdown, no code fences, no extra prose).
-Audience: internal system agents and engineers (not patients). Do NOT include PHI or real patient data.
-
-=== Scope of responsibility (nurse) ===
-- Medication Administration: clinic-administered meds (e.g., stimulation, antagonist, trigger, luteal support), dose recording, route, site, lot/expiry, dual-verification.
-- Monitoring & Documentation: vitals, pain scale, adverse effects (e.g., OHSS red flags), intake/output, recovery observations post-OPU/ET.
-- Task & Checklist Management: pre-op, post-op, daily med rounds, injection teaching, consent verification (clinical), escalation rules.
-- Patient Education & Adherence: teach-back for injections/storage, missed-dose handling (policy), discharge instructions, contact triggers.
-- Specimen & Orders Support: phlebotomy handoff, label verification, chain-of-custody steps (nursing side), order readiness checks.
-- Coordination & Handoffs: follow doctor orders, coordinate with lab for timing (e.g., trigger → OPU), reception for scheduling, notify doctor of alerts.
-- Safety & Compliance: 5 rights of med admin, allergy checks, contraindication flags, audit trails.
-
-=== Output rules ===
-- Output MUST be valid JSON with a flat top-level object.
-- Keep items concise, action-oriented strings; avoid patient-specific advice.
-- Use HL7 FHIR R4 names where applicable; if codes unknown, use placeholders like "TBD-LOINC", "TBD-SNOMED".
-- If something depends on clinic policy, include it under "assumptions" or "open_questions".
-- No PHI, no real names or identifiers.
-
-=== Required top-level JSON keys (you may add more useful keys) ===
-- role: must be "nurse"
-- workflows: string[]
-- functional_requirements: string[]
-- user_stories: { as_a, i_want, so_that, acceptance_criteria[] }[]
-- data_fields: { entity, fields: [{ name, type, required }] }[]
-- fhir_mapping:
-    # Either form is accepted:
-    # 1) { module, fhir_resources[] }
-    # 2) { entity, resource }
-- risks: string[]
-- assumptions: string[]                 # optional but encouraged
-- dependencies: string[]                # optional (e.g., MAR device, barcode)
-- rbac: { role: string, permissions: string[] }[]   # optional
-- audit_events: string[]                # optional (what must be audited)
-- api_endpoints: { name, request, response }[]      # optional high-level
-- open_questions: string[]              # optional
-
-=== Suggested nursing content to consider ===
-- MAR specifics: time windows, late/held/refused reasons, co-sign for high-alert meds, barcode med admin (BCMA).
-- Vitals & Observations: BP/HR/Temp/Resp/SpO2, weight, OHSS symptoms (abdominal pain, distension, dyspnea), pain scores.
-- Checklists: pre-ET/OPU readiness (NPO status, consent check, allergies), recovery discharge criteria, injection teaching completion.
-- Escalations & Alerts: critical vitals, missed trigger, allergy mismatch, adverse reaction; paging/notification workflow.
-- Handoffs: Doctor (orders/alerts), Lab (specimen timing/status), Reception (follow-up appts), Architect (audit/security), UI/UX (screen flows).
-- FHIR candidates: MedicationAdministration, MedicationStatement (home meds), Observation (vitals/pain), Procedure (education/ET prep), Task, CarePlan, Consent.
-
-=== Example (minimal — guidance only; do NOT copy literally) ===
-{
-  "role": "nurse",
-  "workflows": [
-    "Pre-OPU checklist and consent verification",
-    "Medication round with BCMA and dual-sign for trigger",
-    "Post-OPU recovery monitoring and discharge criteria",
-    "OHSS symptom triage and escalation to Doctor"
-  ],
-  "functional_requirements": [
-    "Nurse dashboard with due meds, tasks, and alerts",
-    "MAR with held/refused/late reasons and co-sign",
-    "Vitals & observations with early-warning thresholds",
-    "Checklists (pre/post-procedure) with versioning and audit"
-  ],
-  "user_stories": [
-    {
-      "as_a": "Nurse",
-      "i_want": "to record a MedicationAdministration with lot and expiry",
-      "so_that": "traceability and safety are ensured",
-      "acceptance_criteria": [
-        "System requires lotNumber and expirationDate for injectables",
-        "Allergy and contraindication checks run before sign-off",
-        "Held/refused reasons are mandatory with free-text note"
-      ]
-    }
-  ],
-  "data_fields": [
-    {
-      "entity": "MedicationAdministration",
-      "fields": [
-        { "name": "medicationCode", "type": "code", "required": true },
-        { "name": "dose", "type": "string", "required": true },
-        { "name": "route", "type": "code", "required": true },
-        { "name": "site", "type": "code", "required": false },
-        { "name": "lotNumber", "type": "string", "required": true },
-        { "name": "expirationDate", "type": "date", "required": true },
-        { "name": "status", "type": "enum(given|held|refused)", "required": true }
-      ]
-    },
-    {
-      "entity": "ObservationVitals",
-      "fields": [
-        { "name": "bpSystolic", "type": "number", "required": true },
-        { "name": "bpDiastolic", "type": "number", "required": true },
-        { "name": "heartRate", "type": "number", "required": true },
-        { "name": "spo2", "type": "number", "required": false }
-      ]
-    }
-  ],
-  "fhir_mapping": [
-    { "module": "Nursing", "fhir_resources": ["MedicationAdministration", "Observation", "Task", "CarePlan"] },
-    { "entity": "MAR", "resource": "MedicationAdministration" },
-    { "entity": "Vitals", "resource": "Observation" }
-  ],
-  "risks": [
-    "Trigger dose missed or late",
-    "Barcode mismatch leading to wrong med",
-    "Incomplete recovery checklist before discharge"
-  ],
-  "assumptions": [
-    "Clinic uses barcode scanning for med admin",
-    "Formulary and allergy list are maintained centrally"
-  ],
-  "dependencies": [
-    "BCMA scanners",
-    "EHR access to active orders",
-    "Notification service for escalations"
-  ],
-  "rbac": [
-    { "role": "Nurse", "permissions": ["record_med_admin", "record_vitals", "complete_checklists"] },
-    { "role": "ChargeNurse", "permissions": ["cosign_high_alert", "override_mar_with_reason"] }
-  ],
-  "audit_events": [
-    "MedicationAdministration signed/cosigned",
-    "Checklist item completion",
-    "Alert acknowledged/escalated"
-  ],
-  "api_endpoints": [
-    { "name": "POST /mar/administrations", "request": "MedicationAdministrationDTO", "response": "AdministrationId" }
-  ],
-  "open_questions": [
-    "Is barcode scanning mandatory for all injectables?",
-    "Clinic policy for late trigger window (minutes)?"
-  ]
-}
-
-Now, given the BA’s prompt, produce STRICT JSON only, adhering to the above.
-Once the PRD is finalized, save it in a markdown file using the save_markdown tool.
-""",
-            tools=[create_md, read_md, update_md, delete_md, save_markdown],
+            tools=[create_md, read_md, outline_md, read_md_section, read_md_range, search_md, update_md, delete_md,
+                   save_markdown, list_markdown_versions, get_markdown_version],
         ),
-        "doctor": create_agent(
+        "doctor": lazy_agent(
             name="doctor",
-            prompt="""
-You are the IVF Clinic Doctor agent in a multi-agent product team (BA, Nurse, Lab, Receptionist, Architect, UI/UX).
-Your job: translate the user's high-level ask into clinically correct, actionable requirements for an IVF EMR/portal.
-
-Return **STRICT JSON ONLY** (no markdown, no code fences, no commentary), following the keys below.
-Audience: other system agents and engineers (not patients). Do NOT include PHI or real patient data.
-
-=== Scope of responsibility (doctor) ===
-- Clinical domain definition: infertility causes, diagnostic workup, treatment planning.
-- IVF/ICSI cycle protocols: ovarian stimulation, monitoring (USG, hormones), trigger, oocyte pickup, fertilization method, embryo culture, transfer, luteal support, complications (e.g., OHSS).
-- Orders & approvals: labs, imaging, procedures, medications/e-Rx.
-- Result interpretation & follow-up plans.
-- Safety & compliance: contraindications, warnings, audit points.
-
-=== Output rules ===
-- Output MUST be valid JSON with a flat top-level object.
-- Keep items concise, bullet-style strings; avoid medical advice to end users.
-- If something is unknown or depends on clinic policy, add it under "assumptions" or "open_questions".
-- Prefer HL7 FHIR R4 resource names; use coding placeholders like "TBD-SNOMED", "TBD-LOINC" when you don’t know exact codes.
-- No PHI, no real names, no dates of birth, no identifiers.
-
-=== Required top-level JSON keys (keep these; you may add more keys if useful) ===
-- role: must be "doctor"
-- clinical_protocols: string[]   # named protocols or protocol fragments
-- functional_requirements: string[]
-- user_stories: { as_a, i_want, so_that, acceptance_criteria[] }[]
-- data_fields: { entity, fields: [{ name, type, required }] }[]
-- fhir_mapping:
-    # Either form is accepted (use both where helpful):
-    # 1) { module, fhir_resources[] }
-    # 2) { entity, resource }
-- risks: string[]
-- assumptions: string[]                 # optional but encouraged
-- dependencies: string[]                # optional (e.g., formulary, LIS)
-- rbac: { role: string, permissions: string[] }[]   # optional
-- audit_events: string[]                # optional (what must be audited)
-- api_endpoints: { name, request, response }[]      # optional high-level
-
-=== Suggested clinical content to consider (non-exhaustive) ===
-- Diagnostics: history, exam, ultrasound, AMH/FSH/E2/progesterone, semen analysis.
-- Treatment planning: stimulation regimens (antagonist/long), dose ranges (do not give patient-specific doses), trigger criteria, cancellation criteria.
-- Procedures: oocyte retrieval, embryo transfer, freezing/PGT handoff.
-- Orders: labs/imaging/medications; e-prescription workflow.
-- Follow-up: β-hCG checks, early viability scans, adverse event capture.
-- Edge cases: PCOS, diminished reserve, endometriosis, male factor, OHSS risk.
-- Inter-agent handoffs: nurse MAR, lab specimen/Observation/DiagnosticReport, receptionist Appointment/Consent, architect security/FHIR/API.
-
-=== Example (minimal) — this is guidance, not literal to copy ===
-{
-  "role": "doctor",
-  "clinical_protocols": [
-    "Antagonist stimulation cycle",
-    "Luteal support protocol post-ET",
-    "OHSS risk mitigation checklist"
-  ],
-  "functional_requirements": [
-    "Doctor dashboard with cycle stage and alerts",
-    "Order sets: stimulation labs & scans",
-    "Protocol templates with approval workflow",
-    "e-Prescription generation and renewal",
-    "Results review with structured interpretation"
-  ],
-  "user_stories": [
-    {
-      "as_a": "Doctor",
-      "i_want": "to select a stimulation protocol template",
-      "so_that": "I can quickly initialize a patient cycle plan",
-      "acceptance_criteria": [
-        "Template prepopulates order sets and visit schedule",
-        "Any edits are versioned and audited",
-        "Conflicts with contraindications are flagged"
-      ]
-    }
-  ],
-  "data_fields": [
-    {
-      "entity": "TreatmentPlan",
-      "fields": [
-        { "name": "protocolName", "type": "string", "required": true },
-        { "name": "startDate", "type": "date", "required": true },
-        { "name": "ohssRiskLevel", "type": "enum(low|moderate|high)", "required": false }
-      ]
-    }
-  ],
-  "fhir_mapping": [
-    { "module": "Orders", "fhir_resources": ["ServiceRequest", "MedicationRequest"] },
-    { "entity": "StimulationMonitoring", "resource": "Observation" },
-    { "entity": "EmbryoTransfer", "resource": "Procedure" },
-    { "entity": "ResultReview", "resource": "DiagnosticReport" }
-  ],
-  "risks": [
-    "Incorrect protocol selection",
-    "Missing critical lab before trigger",
-    "Inadequate audit of e-Rx changes"
-  ],
-  "assumptions": [
-    "Clinic uses formulary with standardized drug nomenclature",
-    "Ultrasound measurements entered by Nurse are reliable"
-  ],
-  "dependencies": [
-    "e-Prescription gateway",
-    "LIS for lab results",
-    "IAM for RBAC"
-  ],
-  "rbac": [
-    { "role": "Doctor", "permissions": ["create_protocol", "approve_orders", "sign_eRx"] }
-  ],
-  "audit_events": [
-    "Protocol selected/changed",
-    "Order approved/cancelled",
-    "MedicationRequest signed"
-  ],
-  "api_endpoints": [
-    { "name": "POST /treatment-plans", "request": "TreatmentPlanDTO", "response": "TreatmentPlanId" }
-  ]
-}
-
-Now, given the user's question from BA, produce STRICT JSON only, adhering to the above.
-""",
-            tools=[create_md, read_md, update_md, delete_md]
+            tools=[create_md, read_md, outline_md, read_md_section, read_md_range, search_md, update_md, delete_md]
         ),
-        "lab": create_agent(
+        "lab": lazy_agent(
             name="lab",
-            prompt="""
-You are the IVF Clinic Lab agent (covering Andrology and Embryology) in a multi-agent team (BA, Doctor, Nurse, Receptionist, Architect, UI/UX).
-Your job: translate the user's high-level ask into lab workflows and system requirements for an IVF EMR/LIS/portal.
-
-Return **STRICT JSON ONLY** (no markdown, no code fences, no extra prose).
-Audience: internal system agents and engineers (not patients). Do NOT include PHI or real patient data.
-
-=== Scope of responsibility (lab) ===
-- Specimen lifecycle: intake/accessioning, labeling, barcode assignment, double-witness, storage, movement, disposal.
-- Andrology: semen collection, abstinence verification (policy), analysis (volume, concentration, motility, morphology), processing/prep for IVF/ICSI, cryopreservation/thaw.
-- Embryology: oocyte identification and counting post-OPU, insemination (IVF) / injection (ICSI) recording, embryo culture, grading (e.g., Day 3, Day 5), assisted hatching (if used), selection for transfer, cryopreservation (vitrification), warming, and embryo inventory.
-- PGT interface: biopsy event capture, sample handoff to genetics lab, results reconciliation.
-- Environmental monitoring & QA: incubator/room sensors (temp/CO₂/O₂), alarms, calibrations, media/consumables lot & expiry tracking, proficiency testing/EQA logs.
-- Chain of custody & consent checks: specimen/embryo ownership, intended use, consent constraints; timing windows (e.g., OPU→insemination).
-- Resulting & reporting: structured Observations, DiagnosticReports, release to clinicians; embargo rules; versioning and audit.
-- Safety & compliance: double-witness/BCMA, mislabel prevention, adverse event capture, traceability.
-
-=== Output rules ===
-- Output MUST be valid JSON with a flat top-level object.
-- Keep items concise, action-oriented strings; avoid patient-specific advice.
-- Prefer HL7 FHIR R4 resource names; if using R5-only constructs (e.g., BiologicallyDerivedProduct for embryos/gametes), note them; otherwise use Specimen with extensions.
-- If codes are unknown, use placeholders like "TBD-LOINC", "TBD-SNOMED".
-- If something depends on clinic policy, include it under "assumptions" or "open_questions".
-- No PHI, no real names/IDs/dates.
-
-=== Required top-level JSON keys (you may add more if helpful) ===
-- role: must be "lab"
-- workflows: string[]
-- functional_requirements: string[]
-- user_stories: { as_a, i_want, so_that, acceptance_criteria[] }[]
-- data_fields: { entity, fields: [{ name, type, required }] }[]
-- fhir_mapping:
-    # Either form is accepted:
-    # 1) { module, fhir_resources[] }
-    # 2) { entity, resource }
-- risks: string[]
-- assumptions: string[]
-- dependencies: string[]                  # e.g., LIS, incubator gateway, barcode printers/scanners
-- rbac: { role: string, permissions: string[] }[]
-- audit_events: string[]                  # critical events to audit
-- api_endpoints: { name, request, response }[]
-- open_questions: string[]
-
-=== Suggested lab content to consider ===
-- Accessioning: barcode generation, duplicate detection, re-label workflow, witness policy configuration.
-- Andrology specifics: WHO analysis parameters, processing method captured, link to downstream insemination/ICSI task.
-- Embryology specifics: oocyte count/maturity, insemination vs ICSI capture, time-lapse imaging (if used), grading scale configuration (e.g., Gardner), selection rationale (structured), embryo disposition (transfer/cryo/discard) with consent checks.
-- PGT: biopsy event, specimen IDs sent to genetics lab, result import mapping.
-- Environmental/QA: sensor streams (Device/DeviceMetric/Observation), alarm handling/ack, calibration logs, lot/expiry of media and disposables.
-- Inventory: embryo/gamete location, storage tank/rack/cane/position, temperature logs, movement and reconciliation.
-- FHIR candidates: Specimen, Observation, DiagnosticReport, ServiceRequest, Procedure, Task, Device, DeviceMetric; (R5) BiologicallyDerivedProduct for embryos/gametes (or Specimen+extensions in R4).
-
-=== Example (minimal — guidance only; do NOT copy literally) ===
-{
-  "role": "lab",
-  "workflows": [
-    "Specimen intake & accessioning with barcode and double-witness",
-    "Andrology analysis and preparation for IVF/ICSI",
-    "Post-OPU oocyte ID/count and chain-of-custody confirmation",
-    "IVF/ICSI event recording with timing windows",
-    "Embryo culture, grading (D3/D5), and selection",
-    "Cryopreservation (vitrification) and inventory management",
-    "PGT biopsy handoff and results reconciliation",
-    "Result entry and DiagnosticReport release"
-  ],
-  "functional_requirements": [
-    "Specimen/embryo tracking with location hierarchy (tank/rack/cane/slot)",
-    "Barcode & double-witness at all critical steps",
-    "Incubator environmental monitoring with alarms and acknowledgments",
-    "Media/consumables lot & expiry tracking linked to procedures",
-    "Structured result entry mapped to FHIR Observations",
-    "DiagnosticReport generation and versioning",
-    "Embryo inventory with disposition and consent enforcement"
-  ],
-  "user_stories": [
-    {
-      "as_a": "Embryologist",
-      "i_want": "to record an ICSI event linking oocytes and prepared sperm aliquot",
-      "so_that": "traceability is maintained across fertilization and embryo culture",
-      "acceptance_criteria": [
-        "System requires linked Specimen IDs for oocytes and sperm",
-        "Double-witness confirmation is enforced prior to save",
-        "Event timestamp must be within configured OPU→ICSI window"
-      ]
-    }
-  ],
-  "data_fields": [
-    {
-      "entity": "Specimen",
-      "fields": [
-        { "name": "specimenId", "type": "string", "required": true },
-        { "name": "type", "type": "enum(semen|oocyte|embryo|blood|other)", "required": true },
-        { "name": "collectionTime", "type": "datetime", "required": false },
-        { "name": "containerBarcode", "type": "string", "required": true },
-        { "name": "witnessed", "type": "boolean", "required": true }
-      ]
-    },
-    {
-      "entity": "Embryo",
-      "fields": [
-        { "name": "embryoId", "type": "string", "required": true },
-        { "name": "day", "type": "number", "required": true },
-        { "name": "grade", "type": "string", "required": true },
-        { "name": "disposition", "type": "enum(transfer|cryo|discard)", "required": true },
-        { "name": "storageLocation", "type": "string", "required": false }
-      ]
-    },
-    {
-      "entity": "DiagnosticReportLab",
-      "fields": [
-        { "name": "reportId", "type": "string", "required": true },
-        { "name": "category", "type": "code", "required": true },
-        { "name": "resultObservationIds", "type": "string[]", "required": true }
-      ]
-    }
-  ],
-  "fhir_mapping": [
-    { "module": "Lab", "fhir_resources": ["Specimen", "Observation", "DiagnosticReport", "ServiceRequest", "Procedure", "Task", "Device"] },
-    { "entity": "Embryo", "resource": "BiologicallyDerivedProduct (R5) or Specimen+extensions (R4 fallback)" },
-    { "entity": "IncubatorMetric", "resource": "Observation" }
-  ],
-  "risks": [
-    "Mislabeling or witness failure leading to wrong embryo transfer",
-    "Incubator failure without timely alarm escalation",
-    "Untracked media lot causing QA gaps",
-    "PGT result mismatch to embryo ID"
-  ],
-  "assumptions": [
-    "Double-witness or electronic witnessing is mandated for critical steps",
-    "Barcode scanning is available at intake and transfers",
-    "Clinic defines grading scale and timing windows"
-  ],
-  "dependencies": [
-    "LIS/LIMS module",
-    "Incubator IoT gateway for environmental data",
-    "Barcode printers and scanners",
-    "Genetics lab integration for PGT"
-  ],
-  "rbac": [
-    { "role": "Embryologist", "permissions": ["record_ivf_icsi", "grade_embryo", "assign_disposition"] },
-    { "role": "LabSupervisor", "permissions": ["release_reports", "override_witness_with_reason"] }
-  ],
-  "audit_events": [
-    "Specimen accessioned/witnessed",
-    "Insemination/ICSI event recorded",
-    "Embryo graded/updated",
-    "Cryo store/withdraw",
-    "DiagnosticReport released",
-    "Alarm acknowledged/escalated"
-  ],
-  "api_endpoints": [
-    { "name": "POST /lab/specimens", "request": "SpecimenDTO", "response": "SpecimenId" },
-    { "name": "POST /lab/embryos", "request": "EmbryoDTO", "response": "EmbryoId" },
-    { "name": "POST /lab/diagnostic-reports", "request": "DiagnosticReportDTO", "response": "ReportId" }
-  ],
-  "open_questions": [
-    "Preferred embryo grading scale and allowed values?",
-    "Electronic witnessing vendor or manual double-witness?",
-    "Retention policy for cryo inventory and audit records?"
-  ]
-}
-
-Now, given the BA’s prompt, produce STRICT JSON only, adhering to the above.
-""",
-            tools=[create_md, read_md, update_md, delete_md],
+            tools=[create_md, read_md, outline_md, read_md_section, read_md_range, search_md, update_md, delete_md],
         ),
-        "architect": create_agent(
+        "architect": lazy_agent(
             name="architect",
-            prompt="""
-            Persona:
-
-You are a Principal Software Architect at a leading global health-tech company. You are a foremost expert in designing scalable, resilient, and secure distributed systems. Your core competencies include cloud-native architecture, microservices patterns, API design, data modeling, and implementing robust security frameworks within highly regulated environments.
-
-Context:
-
-Our organization develops a sophisticated, enterprise-grade Health Information System (HIS) using a microservices architecture. The system serves a diverse, worldwide customer base, requiring high availability, fault tolerance, and low latency. Our technical stack is cloud-native, heavily utilizing containerization (Docker, Kubernetes) and message-driven communication patterns.
-
-Core Mandates & Guiding Principles (Non-Negotiable):
-
-Security by Design: Security is not an afterthought; it is the foundation. Your architecture must explicitly address authentication (OAuth 2.0 / OIDC), authorization (Role-Based Access Control - RBAC), data encryption (at-rest and in-transit), and comprehensive audit logging. All designs must adhere to HIPAA and GDPR principles.
-
-HL7 FHIR Compliance: All external-facing and interoperability-related APIs must be designed as FHIR-compliant RESTful services. You must ensure the API design correctly implements the FHIR resources and interaction patterns identified by the Business Analyst.
-
-Microservice Best Practices: Adhere to the principles of Single Responsibility, Loose Coupling, and High Cohesion. Services should communicate via well-defined, versioned APIs. Prefer asynchronous communication (e.g., using message queues like RabbitMQ/Kafka) for non-blocking operations and system resilience.
-
-Cloud-Native & Scalable: Your designs must be stateless where possible, easily containerized, and horizontally scalable. Leverage appropriate cloud services for databases, messaging, and caching to ensure performance and reliability.
-
-Resilience & Observability: The architecture must incorporate patterns for fault tolerance, such as health checks, circuit breakers, and retries. Every service must be designed with observability in mind, exposing metrics, logs, and traces.
-
-Your Task:
-
-You will be provided with a Product Requirements Document (PRD) generated by our Business Analyst. This PRD will include user stories, acceptance criteria, impacted user roles, and preliminary analysis on FHIR resources and security considerations.
-
-Based on this PRD, your task is to produce a comprehensive Architectural Design Document. Your response must contain the following sections, formatted exactly as shown below:
-
-1. Executive Summary & Architectural Vision
-
-Briefly summarize the feature described in the PRD.
-
-Provide a high-level overview of your proposed architectural approach, outlining the key design decisions and the rationale behind them.
-
-2. Architectural Diagram (Component View)
-
-Describe the components of the system and their interactions. Use a structured format that could be easily converted into a diagram (e.g., using Mermaid syntax or a clear text-based description).
-
-Clearly depict new microservices, modified existing services, databases, message queues, and interactions with external systems or the front end.
-
-Example Description:
-
-User's Browser -> API Gateway -> [Auth Service] -> [New Feature Service] -> [Patient Record Service]
-
-[New Feature Service] -> Publishes Event -> [Message Queue] -> Consumed by -> [Reporting Service]
-
-3. Microservice Design & Responsibilities
-
-For each new or significantly modified microservice, provide the following details:
-
-Service Name: A clear, domain-driven name (e.g., LabResultIngestionService).
-
-Core Responsibility: A one-sentence description of what this service does.
-
-API Endpoints: Define the key RESTful endpoints, including the HTTP verb, path, and a brief description. (e.g., POST /fhir/Observation, GET /fhir/Observation?patient=[id]).
-
-Data Model: A high-level description of the primary data entities this service will manage.
-
-4. Data Management Strategy
-
-For each microservice, specify the proposed database technology (e.g., PostgreSQL, MongoDB, DynamoDB).
-
-Justify your choice based on the data's structure, access patterns, and consistency requirements (e.g., "PostgreSQL for its transactional integrity" or "MongoDB for its flexible schema").
-
-5. Integration & Communication Patterns
-
-Detail the communication flow between services.
-
-Synchronous Calls: Specify where direct RESTful API calls are appropriate (e.g., for real-time data retrieval).
-
-Asynchronous Events: Specify where event-driven communication via a message queue is required (e.g., for decoupling services, handling long-running tasks, or notifying other parts of the system). Name the key events that will be published (e.g., LabResultReceivedEvent).
-
-6. Security & Compliance Architecture
-
-Authentication & Authorization: How will requests be authenticated and authorized? Describe the flow (e.g., "The API Gateway will validate a JWT issued by the Auth Service. The service will then check the user's role against required permissions.").
-
-Data Protection: How will sensitive data (PHI/PII) be protected? Specify encryption requirements for data at-rest and in-transit.
-
-Audit Trail: What specific actions and data access events must be logged to the central audit service to maintain compliance?
-
-7. Non-Functional Requirements (NFRs) & Trade-offs
-
-Scalability: How will the design scale to handle a global user base?
-
-Performance: What are the expected latency targets for critical API endpoints?
-
-Reliability: How does the design ensure high availability and handle failures?
-
-Architectural Trade-offs: Explicitly state any significant trade-offs you made (e.g., choosing eventual consistency for higher availability, or prioritizing security over raw performance for a specific workflow).
-
-Initiation:
-
-Your first response should always be: "I am ready to architect the solution. Please provide the Product Requirements Document (PRD) from the Business Analyst."
-
-**Persona:**
-
-You are an expert **Senior Business Analyst** at a global software company. Your specialization is in Health Information Systems (HIS). You possess a deep understanding of clinical workflows, healthcare data management, and software development lifecycles.
-
-**Context:**
-
-Our company develops and maintains a cutting-edge, cloud-native Health Information System (HIS). This system is built on a **microservices architecture**, with dozens of independent services handling specific domains (e.g., Patient Management, Scheduling, Billing, Clinical Records, etc.). Our customer base is worldwide, including major hospital networks in North America, Europe, and Asia.
-
-**Core Mandates & Constraints (Non-Negotiable):**
-
-1.  **HL7 FHIR Standard:** All interoperability and data exchange specifications **must** strictly adhere to the latest version of the HL7 FHIR standard. You must identify the specific FHIR resources (e.g., `Patient`, `Observation`, `Encounter`, `MedicationRequest`) relevant to any new feature.
-
-2.  **Security & Compliance:** Every requirement must be analyzed through a security-first lens. You must explicitly consider and list potential impacts related to global compliance standards, primarily **HIPAA** (for the US), **GDPR** (for Europe), and other regional data protection laws. This includes data encryption, access controls (RBAC), audit trails, and data anonymization.
-
-3.  **Microservices Architecture:** Your analysis must identify which existing microservices are likely to be impacted by the new feature and whether any new microservices might be required.
-
-4.  **Scalability & Performance:** The solution must be designed to serve a large, global user base, so requirements should implicitly support scalability and high performance.
-
-**Your Task:**
-
-When I provide you with a high-level feature request or a business problem, you will perform a complete business analysis and generate a structured requirements document. Your response **must** include the following sections, formatted exactly as shown below:
-
----
-
-### 1. Feature Epic
-
-* **Epic Title:** A concise, descriptive title for the overall feature.
-
-* **Epic Description:** A detailed narrative explaining the feature, the problem it solves, its value proposition, and the primary business goals.
-
----
-
-### 2. User Stories
-
-* Create a list of user stories that break down the epic into manageable chunks.
-
-* Follow the standard format: **As a** `[user role]`, **I want** `[to perform an action]`, **so that** `[I can achieve a benefit]`.
-
-* Include stories for different user roles (e.g., Doctor, Nurse, Patient, Administrator, Billing Clerk).
-
----
-
-### 3. Acceptance Criteria
-
-* For each user story, provide detailed acceptance criteria in the **Gherkin format (Given/When/Then)**.
-
-* These criteria must be specific, measurable, and testable.
-
-*Example:*
-
-* **User Story 1:** As a Doctor, I want to view a patient's latest lab results directly from their chart summary, so that I can make faster clinical decisions.
-
-* **Acceptance Criteria:**
-
-    * **Scenario:** Doctor accesses lab results from chart summary.
-
-    * **Given** I am logged in as a Doctor and am viewing a patient's chart.
-
-    * **When** I click on the "Latest Lab Results" widget.
-
-    * **Then** a modal window should appear displaying the 5 most recent lab result panels.
-
-    * **And** each result should show the test name, value, reference range, and collection date.
-
----
-
-### 4. Impacted Microservices
-
-* List the potential microservices that will need to be created or modified to implement this feature.
-
-* Provide a brief justification for each.
-
-* *Example: `PatientRecord Service` (to fetch chart data), `Observation Service` (to query lab results), `API Gateway` (to expose a new endpoint).*
-
----
-
-### 5. Data & Interoperability (HL7 FHIR)
-
-* **Primary FHIR Resources:** Identify the core FHIR resources that will be used to represent the data for this feature.
-
-* **FHIR Interactions:** Specify the RESTful interactions needed (e.g., `GET Patient/[id]`, `POST Observation`, `SEARCH Encounter?patient=[id]`).
-
-* **Data Mapping:** Briefly describe how key data elements from the feature map to fields within the identified FHIR resources.
-
----
-
-### 6. Security & Compliance Considerations
-
-* **Access Control:** Define which user roles should have access to this new feature/data.
-
-* **Data Sensitivity:** Classify the type of data being handled (e.g., PHI, PII) and specify requirements like encryption at rest and in transit.
-
-* **Auditing:** State what actions must be logged for audit purposes (e.g., who viewed the data and when).
+            tools=[search_md, outline_md, read_md_section, read_md_range, save_markdown, list_markdown_versions,
+                   get_markdown_version],
+        ),
+    }
 
-* **Compliance Checklist:** Briefly mention key HIPAA/GDPR rules that apply and how the feature design addresses them.
 
----
+# The worker node names must match the `name=` you used in create_agent(...)
+WORKER_NODE_NAMES = [
+    "business_analyst",
+    "receptionist",
+    "nurse",
+    "doctor",
+    "lab",
+    "architect",
+]
 
-### 7. Assumptions & Clarifying Questions
 
-* List any assumptions you've made while creating this analysis.
+def prompt_stats() -> dict:
+    """
+    Per worker agent: its system prompt (hash, approximate tokens, fragments) next to the
+    prompt/cached tokens it has actually been billed for. A stable prompt shows up as a
+    cached_ratio that climbs after the agent's first call.
+    """
+    prompts = PROMPTS.summary(WORKER_NODE_NAMES)
+    tokens = METRICS.agent_tokens()
+    empty = {"prompt": 0, "completion": 0, "cached": 0, "cached_ratio": 0.0}
+    return {name: {**prompts[name], "usage": tokens.get(name, empty)} for name in WORKER_NODE_NAMES}
 
-* Pose critical questions for the Product Owner or stakeholders to clarify ambiguities and resolve dependencies.
 
----
+def fanout_enabled() -> bool:
+    """ORCHESTRATOR_FANOUT=0 disables the parallel fan-out tool."""
+    return os.getenv("ORCHESTRATOR_FANOUT", "1") != "0"
 
-**Initiation:**
 
-Your first response should always be: "I am ready to analyze your request. Please provide me with the high-level feature or business problem you would like me to work on."
+def default_pre_router() -> PreRouter | None:
+    """ORCHESTRATOR_PREROUTER=0 sends every turn through the LLM supervisor."""
+    if os.getenv("ORCHESTRATOR_PREROUTER", "1") == "0":
+        return None
+    return build_pre_router(WORKER_NODE_NAMES)
 
-""",
-            tools=[save_markdown],
-        ),
-    }
 
-    # The worker node names must match the `name=` you used in create_agent(...)
-    worker_node_names = [
-        "business_analyst",
-        "receptionist",
-        "nurse",
-        "doctor",
-        "lab",
-        "architect",
-    ]
+def build_supervisor(checkpointer=None, pre_router: PreRouter | None = None):
+    """Build the worker agents and their handoff tools, and compile the supervisor graph."""
+    agents = build_agents()
 
     # Create one handoff tool per worker
     handoff_tools = [
-        create_handoff_tool(agent_name=n, description=f"Assign work to {n}.")
-        for n in worker_node_names
+        create_handoff_tool(agent_name=n, description=f"Assign work to {n}.", router=pre_router)
+        for n in WORKER_NODE_NAMES
     ]
 
-    # Build supervisor with these transfer tools
-    supervisor = generate_supervisor(agents, handoff_tools)
+    return build_graph_with_supervisor_agent(
+        agents, handoff_tools, fanout=fanout_enabled(), checkpointer=checkpointer, pre_router=pre_router
+    )
+
+
+def main():
+    # Periodic checkpoint trimming/compaction when RETENTION_INTERVAL_S is set
+    start_background_retention()
+    # Prometheus scrape endpoint when METRICS_PORT is set
+    start_metrics_server()
+    router = default_pre_router()
+    supervisor = build_supervisor(pre_router=router)
 
     # (Optional) quick debug print of tool names
-    tool_list_hint = ", ".join([f"transfer_to_{n}" for n in worker_node_names])
-    print(f"[debug] Supervisor tools: {tool_list_hint}")
+    tool_list_hint = ", ".join(
+        [f"transfer_to_{n}" for n in WORKER_NODE_NAMES] + ([FANOUT_TOOL_NAME] if fanout_enabled() else [])
+    )
+    print(f"[debug] Supervisor tools: {tool_list_hint}", file=report_stream())
 
     # Default to interactive chat mode. Use a readable default thread id.
     default_thread = "ivf-session-001"
     if sys.stdin.isatty():
-        interactive_chat(supervisor, initial_thread_id=default_thread)
+        interactive_chat(supervisor, initial_thread_id=default_thread, router=router)
     else:
         # Non-interactive (piped) mode: read a single line from stdin and respond once
         user_text = sys.stdin.read().strip() or "Hello"
         cfg = {"configurable": {"thread_id": default_thread}}
-        for chunk in supervisor.stream({"messages": [{"role": "user", "content": user_text}]}, config=cfg):
-            pretty_print_messages(chunk, last_message=True)
+        stream_turn(supervisor, user_text, cfg)
+        _print_turn_report(router, default_thread)
 
 
 if __name__ == "__main__":
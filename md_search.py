@@ -0,0 +1,217 @@
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+from md_store import OUTLINE_INDEX
+
+# ----------------------------
+# Full-text search over md_files/ and exports/ (SQLite FTS5)
+# ----------------------------
+# Each document is split into one row per heading (the heading's own text up to the next
+# heading of any level; text before the first heading is its own row), so a hit points at a
+# section that read_md_section can fetch. `md_index_files` remembers (mtime_ns, size) per
+# file: every search first stats the roots and reindexes only changed/new/removed files,
+# and the md tools call `reindex` right after they write or delete.
+
+MAX_FILE_BYTES = 4 * 1024 * 1024
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def slugify(heading: str) -> str:
+    """GitHub-style anchor: lower-case, punctuation dropped, spaces -> '-'."""
+    slug = re.sub(r"[^\w\- ]", "", heading.strip().lower())
+    return slug.replace(" ", "-")
+
+
+def fts_query(text: str) -> str:
+    """Free text -> FTS5 query: each word quoted (no syntax errors), OR-ed, bm25 ranks the rest."""
+    terms = list(dict.fromkeys(t.lower() for t in _TERM_RE.findall(text or "")))
+    return " OR ".join(f'"{t}"' for t in terms)
+
+
+class MarkdownSearchIndex:
+    """
+    FTS5 index over Markdown documents in `roots`, a {prefix: directory} map; a file's
+    indexed name is "<prefix>/<relative path>" ("" prefix = bare relative path), i.e. the
+    path the md tools accept.
+    """
+
+    def __init__(self, roots: dict[str, Path], path: str | os.PathLike = "md_search.db"):
+        self.roots = {prefix: Path(root).resolve() for prefix, root in roots.items()}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS md_index_files ("
+            " name TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS md_sections USING fts5("
+            " heading, body, name UNINDEXED, anchor UNINDEXED, line UNINDEXED,"
+            " tokenize='porter unicode61')"
+        )
+        self.searches = 0
+        self.reindexed = 0
+
+    # -- file discovery --
+    def name_of(self, path: Path) -> Optional[str]:
+        """Indexed name for an absolute path, or None if it is outside every root."""
+        path = Path(path).resolve()
+        for prefix, root in self.roots.items():
+            if root in path.parents:
+                rel = path.relative_to(root).as_posix()
+                return f"{prefix}/{rel}" if prefix else rel
+        return None
+
+    @staticmethod
+    def _indexable(entry: os.DirEntry) -> bool:
+        # temp files from md_store.atomic_write are dot-files; exports may have no suffix
+        name = entry.name
+        return not name.startswith(".") and (name.endswith(".md") or "." not in name)
+
+    def _walk(self) -> dict[str, tuple[Path, int, int]]:
+        found = {}
+        for prefix, root in self.roots.items():
+            stack = [root]
+            while stack:
+                try:
+                    entries = list(os.scandir(stack.pop()))
+                except OSError:
+                    continue
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    elif entry.is_file(follow_symlinks=False) and self._indexable(entry):
+                        st = entry.stat()
+                        if st.st_size <= MAX_FILE_BYTES:
+                            path = Path(entry.path)
+                            rel = path.relative_to(root).as_posix()
+                            found[f"{prefix}/{rel}" if prefix else rel] = (path, st.st_mtime_ns, st.st_size)
+        return found
+
+    # -- indexing --
+    def refresh(self) -> int:
+        """Reindex files whose (mtime_ns, size) changed, drop deleted ones. Returns files touched."""
+        found = self._walk()
+        with self._lock:
+            known = {
+                name: (mtime_ns, size)
+                for name, mtime_ns, size in self._conn.execute("SELECT name, mtime_ns, size FROM md_index_files")
+            }
+            touched = 0
+            for name in known.keys() - found.keys():
+                self._delete(name)
+                touched += 1
+            for name, (path, mtime_ns, size) in found.items():
+                if known.get(name) != (mtime_ns, size):
+                    self._index(name, path)
+                    touched += 1
+        return touched
+
+    def reindex(self, path: Path) -> None:
+        """
+        Index `path` now, or drop it if it no longer exists (called by the md tools after
+        a write or delete). A failure here must not fail the write, so SQLite errors are
+        dropped; the next search's refresh catches up.
+        """
+        name = self.name_of(path)
+        if name is None:
+            return
+        try:
+            with self._lock:
+                if Path(path).exists():
+                    self._index(name, Path(path))
+                else:
+                    self._delete(name)
+        except sqlite3.Error:
+            pass
+
+    def _delete(self, name: str) -> None:
+        self._conn.execute("DELETE FROM md_sections WHERE name = ?", (name,))
+        self._conn.execute("DELETE FROM md_index_files WHERE name = ?", (name,))
+
+    def _index(self, name: str, path: Path) -> None:
+        try:
+            st = path.stat()
+            headings = OUTLINE_INDEX.get(path).headings
+            data = path.read_bytes()
+        except OSError:
+            self._delete(name)
+            return
+        rows = []
+        first = headings[0].start if headings else len(data)
+        if data[:first].strip():
+            rows.append(("", data[:first], name, "", 1))
+        for i, h in enumerate(headings):
+            end = headings[i + 1].start if i + 1 < len(headings) else len(data)
+            rows.append((h.title, data[h.body_start:end], name, slugify(h.title), h.line))
+        rows = [(heading, body.decode("utf-8", "replace"), n, anchor, line) for heading, body, n, anchor, line in rows]
+        self._conn.execute("BEGIN")
+        try:
+            self._delete(name)
+            self._conn.executemany(
+                "INSERT INTO md_sections (heading, body, name, anchor, line) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT INTO md_index_files (name, mtime_ns, size) VALUES (?, ?, ?)",
+                (name, st.st_mtime_ns, st.st_size),
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self.reindexed += 1
+
+    # -- querying --
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        """
+        Ranked section hits for `query` (bm25, heading matches weighted 5x the body).
+        Each hit: {"path", "anchor", "line", "heading", "snippet", "score"}.
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        self.refresh()
+        with self._lock:
+            self.searches += 1
+            rows = self._conn.execute(
+                "SELECT name, anchor, line, heading,"
+                " snippet(md_sections, 1, '[', ']', '…', 24), bm25(md_sections, 5.0, 1.0) AS score"
+                " FROM md_sections WHERE md_sections MATCH ? ORDER BY score LIMIT ?",
+                (match, max(1, int(limit))),
+            ).fetchall()
+        return [
+            {"path": name, "anchor": anchor, "line": line, "heading": heading,
+             "snippet": " ".join(snippet.split()), "score": round(-score, 3)}
+            for name, anchor, line, heading, snippet, score in rows
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            files, sections = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM md_index_files), (SELECT COUNT(*) FROM md_sections)"
+            ).fetchone()
+        return {"files": files, "sections": sections, "searches": self.searches, "reindexed": self.reindexed}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_DEFAULT_INDEX: Optional[MarkdownSearchIndex] = None
+_DEFAULT_INDEX_LOCK = threading.Lock()
+
+
+def default_search_index(roots: dict[str, Path]) -> MarkdownSearchIndex:
+    """Process-wide index over `roots` (created on first use); MD_SEARCH_DB sets its file."""
+    global _DEFAULT_INDEX
+    with _DEFAULT_INDEX_LOCK:
+        if _DEFAULT_INDEX is None:
+            _DEFAULT_INDEX = MarkdownSearchIndex(roots, path=os.getenv("MD_SEARCH_DB", "md_search.db"))
+        return _DEFAULT_INDEX
@@ -0,0 +1,287 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+# ----------------------------
+# Markdown file primitives (used by the md tools in main.py)
+# ----------------------------
+# - atomic_write: write to a temp file in the same directory, fsync, os.replace; readers see
+#   either the old or the new document, never a torn one
+# - append_text: O(appended bytes) append; only the last byte of the file is read to decide
+#   whether a newline separator is needed
+# - patch_section: replace the body of one heading; bytes before/after the section are
+#   copied verbatim (no decode/re-encode) and the result is swapped in atomically
+# - OUTLINE_INDEX: per-file heading -> byte offset index, rebuilt only when the file's
+#   (mtime_ns, size, inode) changes; backs section lookups and the outline/ranged-read tools
+
+HEADING_RE = re.compile(rb"^ {0,3}(#{1,6})(?:[ \t]+(.*?))?[ \t#]*$")
+FENCE_RE = re.compile(rb"^ {0,3}(`{3,}|~{3,})")
+
+
+def atomic_write(path: Path, data: bytes | str, exclusive: bool = False) -> int:
+    """
+    Replace `path` with `data` via temp file + rename. With `exclusive`, fail with
+    FileExistsError instead of replacing an existing file. Returns bytes written.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates 0600; keep the existing file's mode, or a normal 0644 for new files
+        if path.exists():
+            shutil.copymode(path, tmp)
+        else:
+            os.chmod(tmp, 0o644)
+        if exclusive:
+            # link() fails if the target exists, so two creators cannot both win
+            os.link(tmp, path)
+            os.unlink(tmp)
+        else:
+            os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    finally:
+        OUTLINE_INDEX.invalidate(path)
+    return len(data)
+
+
+def append_text(path: Path, text: str) -> int:
+    """Append `text`, preceded by a newline unless the file is empty or already ends with one."""
+    data = (text or "").encode("utf-8")
+    with open(path, "a+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size:
+            f.seek(size - 1)
+            if f.read(1) not in (b"\n", b"\r"):
+                data = b"\n" + data
+        # "a" mode: the write lands at EOF regardless of the read position
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    OUTLINE_INDEX.invalidate(path)
+    return len(data)
+
+
+def _normalize_heading(heading: str) -> str:
+    return " ".join(heading.strip().lstrip("#").split()).casefold()
+
+
+@dataclass(frozen=True)
+class Heading:
+    level: int
+    title: str
+    line: int        # 1-based line number of the heading
+    start: int       # byte offset of the heading line
+    body_start: int  # byte offset just after the heading line
+    end: int         # byte offset of the next heading of the same or higher level, or EOF
+
+
+def scan_headings(path: Path) -> tuple[list[Heading], int]:
+    """One streaming pass over `path`: ATX headings outside code fences, and the line count."""
+    raw: list[list] = []
+    fence = None
+    offset = 0
+    lineno = 0
+    with open(path, "rb") as f:
+        for line in f:
+            lineno += 1
+            start, offset = offset, offset + len(line)
+            stripped = line.rstrip(b"\r\n")
+            m = FENCE_RE.match(stripped)
+            if m:
+                marker = m.group(1)
+                if fence is None:
+                    fence = marker
+                elif marker[:1] == fence[:1] and len(marker) >= len(fence):
+                    fence = None
+                continue
+            if fence is not None:
+                continue
+            m = HEADING_RE.match(stripped)
+            if m:
+                title = (m.group(2) or b"").decode("utf-8", "replace").strip()
+                raw.append([len(m.group(1)), title, lineno, start, offset])
+    headings = []
+    for i, (level, title, line, start, body_start) in enumerate(raw):
+        end = next((r[3] for r in raw[i + 1:] if r[0] <= level), offset)
+        headings.append(Heading(level, title, line, start, body_start, end))
+    return headings, lineno
+
+
+@dataclass(frozen=True)
+class Outline:
+    path: str
+    mtime_ns: int
+    size: int
+    inode: int
+    lines: int
+    headings: tuple[Heading, ...]
+
+    def find(self, heading: str) -> Optional[Heading]:
+        """First heading whose text matches `heading` (leading #'s optional, case-insensitive)."""
+        wanted = _normalize_heading(heading)
+        level = len(heading.strip()) - len(heading.strip().lstrip("#"))
+        for h in self.headings:
+            if _normalize_heading(h.title) == wanted and (not level or h.level == level):
+                return h
+        return None
+
+    def line_offset(self, line: int) -> tuple[int, int]:
+        """Nearest indexed (line, byte offset) at or before `line`, to seek instead of scanning."""
+        best = (1, 0)
+        for h in self.headings:
+            if h.line > line:
+                break
+            best = (h.line, h.start)
+        return best
+
+    def render(self) -> str:
+        if not self.headings:
+            return f"(no headings; {self.lines} lines, {self.size} bytes)"
+        rows = [f"L{h.line} {'#' * h.level} {h.title} [{h.end - h.start} bytes]" for h in self.headings]
+        return "\n".join(rows + [f"({self.lines} lines, {self.size} bytes)"])
+
+
+class OutlineIndex:
+    """
+    LRU of Outline objects keyed by resolved path, invalidated by (mtime_ns, size, inode).
+    The inode catches same-size atomic replaces within one mtime tick; the writers in this
+    module also drop their entry explicitly.
+    """
+
+    def __init__(self, max_files: int = 256):
+        self.max_files = max_files
+        self._entries: OrderedDict[str, Outline] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: Path) -> Outline:
+        key = str(Path(path).resolve())
+        st = os.stat(key)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and (cached.mtime_ns, cached.size, cached.inode) == (st.st_mtime_ns, st.st_size, st.st_ino):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        headings, lines = scan_headings(Path(key))
+        outline = Outline(key, st.st_mtime_ns, st.st_size, st.st_ino, lines, tuple(headings))
+        with self._lock:
+            self._entries[key] = outline
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_files:
+                self._entries.popitem(last=False)
+        return outline
+
+    def invalidate(self, path: Path) -> None:
+        with self._lock:
+            self._entries.pop(str(Path(path).resolve()), None)
+
+
+OUTLINE_INDEX = OutlineIndex()
+
+
+def find_section(path: Path, heading: str) -> Optional[tuple[int, int, int]]:
+    """
+    Locate `heading` (text with or without leading #'s, case-insensitive) in `path`.
+    Returns (heading_start, body_start, body_end) byte offsets, where the body runs to the
+    next heading of the same or a higher level, or EOF. Headings inside fenced code blocks
+    are ignored. None if the heading is not found.
+    """
+    h = OUTLINE_INDEX.get(path).find(heading)
+    return (h.start, h.body_start, h.end) if h else None
+
+
+def read_bytes(path: Path, start: int, end: int) -> str:
+    """Decode bytes [start, end) of `path`; a UTF-8 sequence cut by either edge is dropped."""
+    with open(path, "rb") as f:
+        f.seek(max(0, start))
+        data = f.read(max(0, end - start))
+    return data.decode("utf-8", "ignore")
+
+
+def read_section(path: Path, heading: str) -> str:
+    """The heading line plus its body (nested sub-headings included). KeyError if missing."""
+    h = OUTLINE_INDEX.get(path).find(heading)
+    if h is None:
+        raise KeyError(f"Heading not found: {heading}")
+    return read_bytes(path, h.start, h.end)
+
+
+def read_lines(path: Path, first: int, last: int) -> str:
+    """Lines `first`..`last` (1-based, inclusive); seeks to the nearest heading first."""
+    line, offset = OUTLINE_INDEX.get(path).line_offset(max(1, first))
+    out = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            if line > last:
+                break
+            if line >= first:
+                out.append(raw)
+            line += 1
+    return b"".join(out).decode("utf-8", "replace")
+
+
+def patch_section(path: Path, heading: str, body: str) -> int:
+    """
+    Replace the body under `heading` with `body`, keeping the heading line itself.
+    Raises KeyError if the heading does not exist. Returns the new file size.
+    """
+    path = Path(path)
+    span = find_section(path, heading)
+    if span is None:
+        raise KeyError(f"Heading not found: {heading}")
+    _, body_start, body_end = span
+    data = (body or "").encode("utf-8")
+    size = path.stat().st_size
+    if body_end < size and data and not data.endswith(b"\n"):
+        data += b"\n"
+    with open(path, "rb") as f:
+        f.seek(body_start - 1)
+        if data and f.read(1) not in (b"\n", b"\r"):
+            data = b"\n" + data  # heading was the last line, without a newline
+
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            _copy_range(src, dst, 0, body_start)
+            dst.write(data)
+            _copy_range(src, dst, body_end, size - body_end)
+            dst.flush()
+            os.fsync(dst.fileno())
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    finally:
+        OUTLINE_INDEX.invalidate(path)
+    return body_start + len(data) + (size - body_end)
+
+
+def _copy_range(src, dst, start: int, length: int, chunk: int = 1 << 20) -> None:
+    src.seek(start)
+    while length > 0:
+        block = src.read(min(chunk, length))
+        if not block:
+            break
+        dst.write(block)
+        length -= len(block)
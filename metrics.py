@@ -0,0 +1,514 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, AsyncIterator, Iterator, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+
+# ----------------------------
+# Per-node latency / token instrumentation
+# ----------------------------
+# A callback handler attached to the compiled graph (and to every agent from
+# create_agent) times each graph node, LLM call and tool call, collects token usage and
+# notes each turn's time to first token (when streamed); TimedCheckpointer times
+# checkpoint reads and writes. Everything is aggregated twice:
+# - as Prometheus histograms/counters labelled by agent and node (GET /metrics on the
+#   server, or METRICS_PORT for the CLI)
+# - per thread_id for the turn in flight, printed as one "[metrics] ..." line per turn
+#
+# thread_id is deliberately not a Prometheus label (unbounded cardinality).
+
+# Seconds; covers fast tool calls up to slow multi-hop LLM turns
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(names: tuple, values: tuple, le: Optional[str] = None) -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_str(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {count}")
+            inf = _label_str(self.labels, key, "+Inf")
+            lines.append(f"{self.name}_bucket{inf} {series[-2]}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {series[-2]}")
+        return lines
+
+
+@dataclass
+class TurnStats:
+    """What one turn of one thread spent, per agent (top-level graph node)."""
+    started: float = field(default_factory=time.perf_counter)
+    wall_s: float = 0.0
+    nodes: dict = field(default_factory=dict)        # agent -> seconds
+    llm_s: dict = field(default_factory=dict)        # agent -> seconds
+    tokens: dict = field(default_factory=dict)       # agent -> [prompt, completion, cached prompt]
+    tool_calls: int = 0
+    tool_s: float = 0.0
+    checkpoint_ops: int = 0
+    checkpoint_s: float = 0.0
+    ttft_s: Optional[float] = None  # first streamed token (or first whole LLM reply) of the turn
+    error: Optional[str] = None
+
+    def summary(self) -> str:
+        parts = [f"[metrics] turn {self.wall_s:.2f}s"]
+        if self.ttft_s is not None:
+            parts.append(f"ttft {self.ttft_s:.2f}s")
+        for agent, seconds in self.nodes.items():
+            part = f"{agent} {seconds:.2f}s"
+            if agent in self.llm_s:
+                prompt, completion, cached = self.tokens.get(agent, (0, 0, 0))
+                part += f" (llm {self.llm_s[agent]:.2f}s, {prompt}/{completion} tok"
+                part += f", {cached / prompt:.0%} cached)" if cached and prompt else ")"
+            parts.append(part)
+        parts.append(f"tools {self.tool_calls} in {self.tool_s:.2f}s")
+        parts.append(f"checkpoint {self.checkpoint_ops} ops in {self.checkpoint_s:.3f}s")
+        if self.error:
+            parts.append(f"error {self.error}")
+        return " | ".join(parts)
+
+
+class Metrics:
+    """Process-wide metric registry plus the per-thread turn accounting."""
+
+    def __init__(self, max_last_turns: int = 1024):
+        self._lock = threading.Lock()
+        self.max_last_turns = max_last_turns
+        self.turn_seconds = Histogram("orchestrator_turn_seconds", "Wall time of one graph turn.")
+        self.node_seconds = Histogram("orchestrator_node_seconds", "Wall time per graph node.", ("agent", "node"))
+        self.llm_seconds = Histogram("orchestrator_llm_seconds", "Wall time per LLM call.", ("agent", "model"))
+        self.tokens = Counter("orchestrator_llm_tokens_total", "LLM tokens used.", ("agent", "kind"))
+        self.ttft_seconds = Histogram("orchestrator_ttft_seconds", "Turn start to its first LLM token.")
+        self.tool_seconds = Histogram("orchestrator_tool_seconds", "Wall time per tool call.", ("agent", "tool"))
+        self.checkpoint_seconds = Histogram(
+            "orchestrator_checkpoint_seconds", "Checkpoint read/write latency.", ("op",),
+            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+        )
+        self.errors = Counter("orchestrator_errors_total", "Failed nodes, LLM and tool calls.", ("agent", "kind"))
+        self._active: dict[str, TurnStats] = {}
+        # last finished turn per thread, LRU-capped so a long-running server doesn't grow unbounded
+        self._last: OrderedDict[str, TurnStats] = OrderedDict()
+        self.handler = MetricsCallbackHandler(self)
+
+    # -- turn accounting (thread_id keyed) --
+    def start_turn(self, thread_id: str) -> None:
+        with self._lock:
+            self._active[thread_id] = TurnStats()
+
+    def end_turn(self, thread_id: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            turn = self._active.pop(thread_id, None)
+            if turn is None:
+                return
+            turn.wall_s = time.perf_counter() - turn.started
+            turn.error = error
+            self._last[thread_id] = turn
+            self._last.move_to_end(thread_id)
+            while len(self._last) > self.max_last_turns:
+                self._last.popitem(last=False)
+            self.turn_seconds.observe(turn.wall_s)
+
+    def last_turn(self, thread_id: str) -> Optional[TurnStats]:
+        with self._lock:
+            return self._last.get(thread_id)
+
+    def turn_summary(self, thread_id: str) -> str:
+        turn = self.last_turn(thread_id)
+        return turn.summary() if turn else ""
+
+    def record_node(self, thread_id: Optional[str], agent: str, node: str, seconds: float) -> None:
+        with self._lock:
+            self.node_seconds.observe(seconds, agent=agent, node=node)
+            turn = self._active.get(thread_id)
+            if turn is not None and agent == node:
+                turn.nodes[agent] = turn.nodes.get(agent, 0.0) + seconds
+
+    def record_llm(self, thread_id: Optional[str], agent: str, model: str, seconds: float,
+                   prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> None:
+        with self._lock:
+            self.llm_seconds.observe(seconds, agent=agent, model=model)
+            self.tokens.inc(prompt_tokens, agent=agent, kind="prompt")
+            self.tokens.inc(completion_tokens, agent=agent, kind="completion")
+            self.tokens.inc(cached_tokens, agent=agent, kind="cached")
+            turn = self._active.get(thread_id)
+            if turn is not None:
+                turn.llm_s[agent] = turn.llm_s.get(agent, 0.0) + seconds
+                counts = turn.tokens.setdefault(agent, [0, 0, 0])
+                counts[0] += prompt_tokens
+                counts[1] += completion_tokens
+                counts[2] += cached_tokens
+
+    def agent_tokens(self) -> dict:
+        """Cumulative tokens per agent; cached = prompt tokens served from the provider's prompt cache."""
+        with self._lock:
+            totals: dict[str, dict] = {}
+            for (agent, kind), value in self.tokens._values.items():
+                totals.setdefault(agent, {"prompt": 0, "completion": 0, "cached": 0})[kind] = int(value)
+        for counts in totals.values():
+            counts["cached_ratio"] = round(counts["cached"] / counts["prompt"], 3) if counts["prompt"] else 0.0
+        return totals
+
+    def record_first_token(self, thread_id: Optional[str]) -> None:
+        with self._lock:
+            turn = self._active.get(thread_id)
+            if turn is not None and turn.ttft_s is None:
+                turn.ttft_s = time.perf_counter() - turn.started
+                self.ttft_seconds.observe(turn.ttft_s)
+
+    def record_tool(self, thread_id: Optional[str], agent: str, tool: str, seconds: float) -> None:
+        with self._lock:
+            self.tool_seconds.observe(seconds, agent=agent, tool=tool)
+            turn = self._active.get(thread_id)
+            if turn is not None:
+                turn.tool_calls += 1
+                turn.tool_s += seconds
+
+    def record_checkpoint(self, thread_id: Optional[str], op: str, seconds: float) -> None:
+        with self._lock:
+            self.checkpoint_seconds.observe(seconds, op=op)
+            turn = self._active.get(thread_id)
+            if turn is not None:
+                turn.checkpoint_ops += 1
+                turn.checkpoint_s += seconds
+
+    def record_error(self, agent: str, kind: str) -> None:
+        with self._lock:
+            self.errors.inc(agent=agent, kind=kind)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            lines = []
+            for metric in (self.turn_seconds, self.ttft_seconds, self.node_seconds, self.llm_seconds, self.tokens,
+                           self.tool_seconds, self.checkpoint_seconds, self.errors):
+                lines.extend(metric.render())
+            return "\n".join(lines) + "\n"
+
+
+def _agent_of(metadata: dict, fallback: str) -> str:
+    """The top-level graph node a run belongs to ("nurse" for anything inside the nurse agent)."""
+    ns = metadata.get("langgraph_checkpoint_ns") or ""
+    if ns:
+        return ns.split("|", 1)[0].split(":", 1)[0]
+    return metadata.get("agent") or fallback
+
+
+def _usage(response) -> tuple[int, int, int]:
+    """(prompt, completion, cached prompt) tokens; cached is what the provider's prompt cache served."""
+    prompt = completion = cached = 0
+    for generations in response.generations:
+        for gen in generations:
+            usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+            if usage:
+                prompt += usage.get("input_tokens", 0)
+                completion += usage.get("output_tokens", 0)
+                cached += (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    if not (prompt or completion):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+    return prompt, completion, cached
+
+
+def _served_model(response) -> Optional[str]:
+    """Model that actually answered, when the reply names it (TieredChatModel after a fallback)."""
+    model = (response.llm_output or {}).get("ls_model_name")
+    for generations in response.generations:
+        for gen in generations:
+            metadata = getattr(getattr(gen, "message", None), "response_metadata", None) or {}
+            model = model or metadata.get("ls_model_name")
+    return model
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Turns LangChain run callbacks into Metrics observations. A run with no parent is a
+    turn; a chain run named like its `langgraph_node` is a graph node (runs of the same
+    name nested inside it, e.g. the compiled subgraph a lazy node wraps, are not counted
+    again).
+    """
+
+    run_inline = True  # cheap bookkeeping; don't bounce async runs through an executor
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self._runs: dict[UUID, tuple] = {}  # run_id -> (kind, start, thread_id, agent, label)
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, kind: str, metadata: Optional[dict], agent: str, label: str) -> None:
+        thread_id = (metadata or {}).get("thread_id")
+        with self._lock:
+            self._runs[run_id] = (kind, time.perf_counter(), thread_id, agent, label)
+
+    def _pop(self, run_id: UUID) -> Optional[tuple]:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        kind, started, thread_id, agent, label = run
+        return kind, time.perf_counter() - started, thread_id, agent, label
+
+    # -- chains: turns and graph nodes --
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        metadata = metadata or {}
+        name = kwargs.get("name") or (serialized or {}).get("name") or ""
+        if parent_run_id is None:
+            if metadata.get("thread_id"):
+                self.metrics.start_turn(metadata["thread_id"])
+            self._start(run_id, "turn", metadata, name, name)
+            return
+        node = metadata.get("langgraph_node")
+        if node is None or name != node:
+            return
+        agent = _agent_of(metadata, name)
+        with self._lock:
+            parent = self._runs.get(parent_run_id)
+        if parent and parent[0] in ("node", "nested") and parent[3:] == (agent, node):
+            # a wrapper of the node (lazy agent, compiled subgraph) re-entering it
+            self._start(run_id, "nested", metadata, agent, node)
+            return
+        self._start(run_id, "node", metadata, agent, node)
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_chain(run_id, None)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_chain(run_id, type(error).__name__)
+
+    def _finish_chain(self, run_id: UUID, error: Optional[str]) -> None:
+        run = self._pop(run_id)
+        if run is None:
+            return
+        kind, seconds, thread_id, agent, label = run
+        if kind == "nested":
+            return
+        if kind == "turn":
+            if thread_id:
+                self.metrics.end_turn(thread_id, error)
+            return
+        # GraphInterrupt / ParentCommand are control flow (handoffs), not failures
+        if error and error not in ("GraphInterrupt", "ParentCommand"):
+            self.metrics.record_error(agent, "node")
+        self.metrics.record_node(thread_id, agent, label, seconds)
+
+    # -- LLM calls --
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[dict] = None,
+                            **kwargs: Any) -> None:
+        metadata = metadata or {}
+        model = metadata.get("ls_model_name") or (serialized or {}).get("name") or "unknown"
+        self._start(run_id, "llm", metadata, _agent_of(metadata, "llm"), model)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, metadata: Optional[dict] = None,
+                     **kwargs: Any) -> None:
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, metadata=metadata, **kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, chunk=None, **kwargs: Any) -> None:
+        if not token and not getattr(getattr(chunk, "message", None), "tool_call_chunks", None):
+            return
+        run = self._runs.get(run_id)
+        if run is not None:
+            self.metrics.record_first_token(run[2])
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._pop(run_id)
+        if run is None:
+            return
+        _, seconds, thread_id, agent, model = run
+        model = _served_model(response) or model
+        self.metrics.record_first_token(thread_id)  # a reply that wasn't streamed (e.g. a cache hit)
+        prompt, completion, cached = _usage(response)
+        self.metrics.record_llm(thread_id, agent, model, seconds, prompt, completion, cached)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._pop(run_id)
+        if run is not None:
+            self.metrics.record_error(run[3], "llm")
+
+    # -- tools --
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, metadata: Optional[dict] = None,
+                      **kwargs: Any) -> None:
+        metadata = metadata or {}
+        tool = kwargs.get("name") or (serialized or {}).get("name") or "tool"
+        self._start(run_id, "tool", metadata, _agent_of(metadata, "tool"), tool)
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._pop(run_id)
+        if run is not None:
+            _, seconds, thread_id, agent, tool = run
+            self.metrics.record_tool(thread_id, agent, tool, seconds)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._pop(run_id)
+        if run is None:
+            return
+        _, seconds, thread_id, agent, tool = run
+        # Handoff tools end by raising ParentCommand; that is a normal, timed tool call
+        if type(error).__name__ != "ParentCommand":
+            self.metrics.record_error(agent, "tool")
+        self.metrics.record_tool(thread_id, agent, tool, seconds)
+
+
+METRICS = Metrics(max_last_turns=int(os.getenv("METRICS_LAST_TURNS", "1024")))
+
+
+def _thread_of(config: Optional[RunnableConfig]) -> Optional[str]:
+    return ((config or {}).get("configurable") or {}).get("thread_id")
+
+
+class TimedCheckpointer(BaseCheckpointSaver):
+    """Delegating checkpointer that reports every read/write latency to Metrics."""
+
+    def __init__(self, inner: BaseCheckpointSaver, metrics: Metrics = METRICS):
+        super().__init__(serde=inner.serde)
+        self.inner = inner
+        self.metrics = metrics
+
+    def _timed(self, op: str, config: Optional[RunnableConfig], fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.metrics.record_checkpoint(_thread_of(config), op, time.perf_counter() - started)
+
+    async def _atimed(self, op: str, config: Optional[RunnableConfig], coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.metrics.record_checkpoint(_thread_of(config), op, time.perf_counter() - started)
+
+    # -- sync API --
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self._timed("get", config, self.inner.get_tuple, config)
+
+    def list(self, config: Optional[RunnableConfig], **kwargs: Any) -> Iterator[CheckpointTuple]:
+        return self.inner.list(config, **kwargs)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        return self._timed("put", config, self.inner.put, config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config: RunnableConfig, writes, task_id: str, task_path: str = "") -> None:
+        return self._timed("put_writes", config, self.inner.put_writes, config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        return self.inner.delete_thread(thread_id)
+
+    def get_delta_channel_history(self, *args: Any, **kwargs: Any):
+        return self.inner.get_delta_channel_history(*args, **kwargs)
+
+    def get_next_version(self, current, channel):
+        return self.inner.get_next_version(current, channel)
+
+    # -- async API --
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await self._atimed("get", config, self.inner.aget_tuple(config))
+
+    async def alist(self, config: Optional[RunnableConfig], **kwargs: Any) -> AsyncIterator[CheckpointTuple]:
+        async for item in self.inner.alist(config, **kwargs):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await self._atimed("put", config, self.inner.aput(config, checkpoint, metadata, new_versions))
+
+    async def aput_writes(self, config: RunnableConfig, writes, task_id: str, task_path: str = "") -> None:
+        return await self._atimed("put_writes", config, self.inner.aput_writes(config, writes, task_id, task_path))
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await self.inner.adelete_thread(thread_id)
+
+    async def aget_delta_channel_history(self, *args: Any, **kwargs: Any):
+        return await self.inner.aget_delta_channel_history(*args, **kwargs)
+
+
+def instrument_checkpointer(saver: Optional[BaseCheckpointSaver]) -> Optional[BaseCheckpointSaver]:
+    if saver is None or isinstance(saver, TimedCheckpointer):
+        return saver
+    return TimedCheckpointer(saver)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve GET /metrics on a daemon thread for the CLI (default: METRICS_PORT; unset or 0
+    disables). The FastAPI server exposes the same data on its own /metrics route.
+    """
+    port = port if port is not None else int(os.getenv("METRICS_PORT", "0"))
+    if not port:
+        return None
+    server = ThreadingHTTPServer((os.getenv("METRICS_HOST", "127.0.0.1"), port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
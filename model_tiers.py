@@ -0,0 +1,310 @@
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatResult
+from langchain_core.runnables import RunnableBinding
+
+from resilience import as_chunk, resilience_enabled, with_resilience
+
+# ----------------------------
+# Per-agent model tiers with latency/error-aware fallback
+# ----------------------------
+# A tier is a named model configuration: "<provider:model>[,max_tokens=N][,temperature=T][,timeout=S]".
+# Each agent gets an ordered chain of tiers ("fast>standard"), optionally with parameter
+# overrides that apply to every tier in its chain ("fast>standard,max_tokens=512").
+#   MODEL_TIER_<TIER>    redefines a tier, e.g. MODEL_TIER_STRONG=openai:gpt-4o,timeout=120
+#   AGENT_MODEL_<AGENT>  redefines an agent's chain, e.g. AGENT_MODEL_NURSE=strong>standard
+#
+# TieredChatModel calls the first healthy tier of the chain. A tier that raises is
+# recorded as an error and the next tier answers the same call. Each tier keeps a rolling
+# window of its recent calls (shared by every agent using it); when the window's p95
+# latency or error rate crosses MODEL_FALLBACK_P95_S / MODEL_FALLBACK_ERROR_RATE the tier
+# is skipped for MODEL_FALLBACK_COOLDOWN_S, then gets a fresh window.
+
+PARAMS = {"max_tokens": int, "temperature": float, "timeout": float}
+
+
+@dataclass(frozen=True)
+class TierSpec:
+    name: str
+    model: str
+    params: dict = field(default_factory=dict)
+
+    def with_params(self, overrides: dict) -> "TierSpec":
+        return TierSpec(self.name, self.model, {**self.params, **overrides})
+
+
+def _parse_params(items: list[str], spec: str) -> dict:
+    params = {}
+    for item in items:
+        key, sep, value = item.partition("=")
+        key = key.strip()
+        if not sep or key not in PARAMS:
+            raise ValueError(f"Unknown model parameter {item!r} in {spec!r} (expected {', '.join(PARAMS)})")
+        params[key] = PARAMS[key](value.strip())
+    return params
+
+
+def parse_tier(name: str, spec: str) -> TierSpec:
+    """"openai:gpt-4o-mini,max_tokens=2048,timeout=60" -> TierSpec."""
+    model, *items = [part.strip() for part in spec.split(",") if part.strip()]
+    return TierSpec(name, model, _parse_params(items, spec))
+
+
+def parse_chain(spec: str) -> tuple[list[str], dict]:
+    """"fast>standard,max_tokens=512" -> (["fast", "standard"], {"max_tokens": 512})."""
+    chain, *items = [part.strip() for part in spec.split(",") if part.strip()]
+    tiers = [t.strip().lower() for t in chain.split(">") if t.strip()]
+    if not tiers:
+        raise ValueError(f"Empty model chain: {spec!r}")
+    return tiers, _parse_params(items, spec)
+
+
+def tier_spec(name: str, defaults: dict[str, str]) -> TierSpec:
+    spec = os.getenv(f"MODEL_TIER_{name.upper()}", defaults.get(name))
+    if not spec:
+        raise KeyError(f"Unknown model tier {name!r} (set MODEL_TIER_{name.upper()})")
+    return parse_tier(name, spec)
+
+
+def chain_for(agent: str, tiers: dict[str, str], agents: dict[str, str], default: str = "standard") -> list[TierSpec]:
+    """The agent's tier chain, AGENT_MODEL_<AGENT> overriding `agents[agent]`."""
+    names, overrides = parse_chain(os.getenv(f"AGENT_MODEL_{agent.upper()}", agents.get(agent, default)))
+    return [tier_spec(name, tiers).with_params(overrides) for name in names]
+
+
+# ----------------------------
+# Tier health
+# ----------------------------
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+class TierHealth:
+    """Rolling latency/error window per tier, plus per-agent call and fallback counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.window = int(_env_float("MODEL_FALLBACK_WINDOW", 20))
+        self.min_calls = int(_env_float("MODEL_FALLBACK_MIN_CALLS", 5))
+        self.p95_s = _env_float("MODEL_FALLBACK_P95_S", 45.0)
+        self.error_rate = _env_float("MODEL_FALLBACK_ERROR_RATE", 0.5)
+        self.cooldown_s = _env_float("MODEL_FALLBACK_COOLDOWN_S", 60.0)
+        self._calls: dict[str, deque] = {}          # tier -> (seconds, ok)
+        self._degraded_until: dict[str, float] = {}
+        self.trips: dict[str, int] = {}
+        self.by_agent: dict[str, dict] = {}
+
+    @staticmethod
+    def _p95(samples: list[float]) -> float:
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0
+
+    def healthy(self, tier: str) -> bool:
+        with self._lock:
+            return time.monotonic() >= self._degraded_until.get(tier, 0.0)
+
+    def record(self, tier: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            calls = self._calls.setdefault(tier, deque(maxlen=self.window))
+            calls.append((seconds, ok))
+            if len(calls) < self.min_calls:
+                return
+            errors = sum(1 for _, good in calls if not good) / len(calls)
+            p95 = self._p95([s for s, good in calls if good])
+            if errors >= self.error_rate or p95 >= self.p95_s:
+                self._degraded_until[tier] = time.monotonic() + self.cooldown_s
+                self.trips[tier] = self.trips.get(tier, 0) + 1
+                calls.clear()
+
+    def record_call(self, agent: str, tier: str, fallback: bool) -> None:
+        with self._lock:
+            s = self.by_agent.setdefault(agent, {"calls": {}, "fallbacks": 0})
+            s["calls"][tier] = s["calls"].get(tier, 0) + 1
+            s["fallbacks"] += int(fallback)
+
+    def summary(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            tiers = {}
+            for tier in self._calls.keys() | self._degraded_until.keys():
+                calls = list(self._calls.get(tier, ()))
+                tiers[tier] = {
+                    "window": len(calls),
+                    "p95_s": round(self._p95([s for s, ok in calls if ok]), 3),
+                    "error_rate": round(sum(1 for _, ok in calls if not ok) / len(calls), 3) if calls else 0.0,
+                    "degraded_for_s": round(max(0.0, self._degraded_until.get(tier, 0.0) - now), 1),
+                    "trips": self.trips.get(tier, 0),
+                }
+            agents = {agent: {"calls": dict(s["calls"]), "fallbacks": s["fallbacks"]} for agent, s in self.by_agent.items()}
+        return {"tiers": tiers, "agents": agents}
+
+
+TIER_HEALTH = TierHealth()
+
+
+# ----------------------------
+# Fallback chat model
+# ----------------------------
+class TieredChatModel(BaseChatModel):
+    """
+    Chat model that answers each call from the first healthy tier of an agent's chain and
+    falls through to the next tier when one raises. Tier models are called directly
+    (`_generate` / `_stream`), so a call is still one LLM run for callbacks and the cache.
+    """
+
+    agent: str = ""
+    tier_names: list[str]
+    tiers: list[BaseChatModel]
+    tier_kwargs: list[dict] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "tiered"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"tiers": [{"tier": n, **m._identifying_params} for n, m in zip(self.tier_names, self.tiers)]}
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        # Only the tier the call will try first is known when the run starts; the tier that
+        # actually answered is recorded on the reply (see _served)
+        return self.tiers[self._order()[0]]._get_ls_params(stop=stop, **kwargs)
+
+    def bind_tools(self, tools, **kwargs: Any):
+        # Each tier formats the tools for its own provider; the bound kwargs are kept per tier
+        models, bound_kwargs = [], []
+        for model in self.tiers:
+            bound = model.bind_tools(tools, **kwargs)
+            if isinstance(bound, RunnableBinding):
+                models.append(bound.bound)
+                bound_kwargs.append(bound.kwargs)
+            else:
+                models.append(bound)
+                bound_kwargs.append({})
+        return self.model_copy(update={"tiers": models, "tier_kwargs": bound_kwargs})
+
+    def _order(self) -> list[int]:
+        """Healthy tiers first, in chain order; degraded ones only as a last resort."""
+        healthy = [i for i, name in enumerate(self.tier_names) if TIER_HEALTH.healthy(name)]
+        return healthy + [i for i in range(len(self.tiers)) if i not in healthy]
+
+    def _kwargs(self, i: int, kwargs: dict) -> dict:
+        return {**(self.tier_kwargs[i] if i < len(self.tier_kwargs) else {}), **kwargs}
+
+    def _served(self, i: int, generation):
+        """Stamp the tier that answered (and its model name) on a reply or its first chunk."""
+        served = {"model_tier": self.tier_names[i],
+                  "ls_model_name": self.tiers[i]._get_ls_params().get("ls_model_name")}
+        generation.message.response_metadata = {**generation.message.response_metadata, **served}
+        return generation
+
+    def _done(self, i: int, started: float, ok: bool, attempt: int) -> None:
+        TIER_HEALTH.record(self.tier_names[i], time.perf_counter() - started, ok)
+        if ok:
+            TIER_HEALTH.record_call(self.agent, self.tier_names[i], fallback=attempt > 0 or i > 0)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        error: Optional[BaseException] = None
+        for attempt, i in enumerate(self._order()):
+            started = time.perf_counter()
+            try:
+                result = self.tiers[i]._generate(messages, stop=stop, run_manager=run_manager, **self._kwargs(i, kwargs))
+            except Exception as e:
+                self._done(i, started, False, attempt)
+                error = e
+                continue
+            self._done(i, started, True, attempt)
+            for generation in result.generations:
+                self._served(i, generation)
+            return result
+        raise error
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        error: Optional[BaseException] = None
+        for attempt, i in enumerate(self._order()):
+            started = time.perf_counter()
+            try:
+                result = await self.tiers[i]._agenerate(messages, stop=stop, run_manager=run_manager,
+                                                        **self._kwargs(i, kwargs))
+            except Exception as e:
+                self._done(i, started, False, attempt)
+                error = e
+                continue
+            self._done(i, started, True, attempt)
+            for generation in result.generations:
+                self._served(i, generation)
+            return result
+        raise error
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        error: Optional[BaseException] = None
+        for attempt, i in enumerate(self._order()):
+            model, started, yielded = self.tiers[i], time.perf_counter(), False
+            try:
+                if type(model)._stream is BaseChatModel._stream:
+                    result = model._generate(messages, stop=stop, run_manager=run_manager, **self._kwargs(i, kwargs))
+                    chunks = [as_chunk(result.generations[0].message)]
+                else:
+                    chunks = model._stream(messages, stop=stop, run_manager=run_manager, **self._kwargs(i, kwargs))
+                for chunk in chunks:
+                    yield self._served(i, chunk) if not yielded else chunk
+                    yielded = True
+            except Exception as e:
+                self._done(i, started, False, attempt)
+                if yielded:
+                    raise  # part of this reply already reached listeners
+                error = e
+                continue
+            self._done(i, started, True, attempt)
+            return
+        raise error
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        error: Optional[BaseException] = None
+        for attempt, i in enumerate(self._order()):
+            model, started, yielded = self.tiers[i], time.perf_counter(), False
+            try:
+                if type(model)._astream is BaseChatModel._astream and type(model)._stream is BaseChatModel._stream:
+                    result = await model._agenerate(messages, stop=stop, run_manager=run_manager,
+                                                    **self._kwargs(i, kwargs))
+                    yielded = True
+                    yield self._served(i, as_chunk(result.generations[0].message))
+                else:
+                    async for chunk in model._astream(messages, stop=stop, run_manager=run_manager,
+                                                      **self._kwargs(i, kwargs)):
+                        yield self._served(i, chunk) if not yielded else chunk
+                        yielded = True
+            except Exception as e:
+                self._done(i, started, False, attempt)
+                if yielded:
+                    raise
+                error = e
+                continue
+            self._done(i, started, True, attempt)
+            return
+        raise error
+
+
+def build_tier_model(spec: TierSpec) -> BaseChatModel:
+    """The tier's model behind deadlines/retries/hedging (resilience.py), which replace the SDK's retries."""
+    # Deferred: pulls in langchain + the provider SDK, only needed once an agent is built
+    from langchain.chat_models import init_chat_model
+
+    if not resilience_enabled():
+        return init_chat_model(spec.model, **spec.params)
+    return with_resilience(init_chat_model(spec.model, **spec.params, max_retries=0), spec.name,
+                           deadline_s=spec.params.get("timeout"))
+
+
+def tiered_chat_model(agent: str, chain: list[TierSpec], cache=False) -> BaseChatModel:
+    """The chain's models behind one TieredChatModel (a single tier is returned as is)."""
+    models = [build_tier_model(spec) for spec in chain]
+    if len(models) == 1:
+        return models[0].model_copy(update={"cache": cache})
+    return TieredChatModel(agent=agent, tier_names=[spec.name for spec in chain], tiers=models, cache=cache)
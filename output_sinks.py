@@ -0,0 +1,255 @@
+import json
+import os
+import sys
+import time
+from typing import Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage, convert_to_messages
+
+# ----------------------------
+# Output sinks for streamed turns
+# ----------------------------
+# A sink renders one turn of the supervisor graph. It declares the `stream_mode` and
+# `subgraphs` it wants from graph.stream(...), gets every chunk through feed() and is
+# closed when the turn ends (also on errors). Sinks only convert the messages they
+# actually emit: a worker's node update carries its whole message history, and
+# converting (let alone pretty-rendering) all of it just to show the last message
+# dominated the CPU and stdout of piped and batch runs.
+#   tokens  LLM tokens as they are generated, labelled by agent (default)
+#   pretty  the last message of every node update, pretty_repr'd (the original output)
+#   jsonl   one compact JSON line per node update, with timings
+#   null    nothing (the turn still runs and is still measured by metrics)
+# OUTPUT_SINK picks the CLI's sink.
+
+
+def message_content(msg):
+    """Get content from a message or dict safely."""
+    if hasattr(msg, "content"):
+        return msg.content
+    if isinstance(msg, dict):
+        return msg.get("content")
+    return str(msg)
+
+
+def _last_message(node_update):
+    """The newest message of a node update (converted on its own), or None."""
+    if not isinstance(node_update, dict) or not node_update.get("messages"):
+        return None
+    return convert_to_messages(node_update["messages"][-1:])[0]
+
+
+class PrettySink:
+    """The last message of each node update as an HTML pretty_repr, like pretty_print_messages did."""
+
+    stream_mode = "updates"
+    subgraphs = False
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+
+    def feed(self, chunk) -> None:
+        indent = False
+        if isinstance(chunk, tuple):
+            ns, chunk = chunk
+            # skip parent graph updates in the printouts
+            if len(ns) == 0:
+                return
+            print(f"Update from subgraph {ns[-1].split(':')[0]}:\n", file=self.out)
+            indent = True
+        for node_name, node_update in chunk.items():
+            print(("\t" if indent else "") + f"Update from node {node_name}:", "\n", file=self.out)
+            message = _last_message(node_update)
+            if message is not None:
+                pretty = message.pretty_repr(html=True)
+                print("\n".join("\t" + line for line in pretty.split("\n")) if indent else pretty, file=self.out)
+            print("\n", file=self.out)
+
+    def close(self) -> None:
+        self.out.flush()
+
+
+class JsonlSink:
+    """
+    One JSON line per top-level node update: node, elapsed/delta ms since the turn started /
+    the previous update, size of its message list and its newest message. A final "end"
+    line carries the turn's wall time.
+    """
+
+    stream_mode = "updates"
+    subgraphs = False
+
+    def __init__(self, out=None, thread_id: Optional[str] = None, content_chars: int = 0):
+        self.out = out or sys.stdout
+        self.thread_id = thread_id
+        self.content_chars = content_chars  # 0 = whole content
+        self.started = self.last = time.perf_counter()
+        self.updates = 0
+
+    def _write(self, event: dict) -> None:
+        self.out.write(json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+
+    def feed(self, chunk) -> None:
+        now = time.perf_counter()
+        for node_name, node_update in chunk.items():
+            self.updates += 1
+            event = {
+                "event": "update",
+                "thread_id": self.thread_id,
+                "node": node_name,
+                "elapsed_ms": round((now - self.started) * 1000, 1),
+                "delta_ms": round((now - self.last) * 1000, 1),
+            }
+            message = _last_message(node_update)
+            if message is not None:
+                content = message_content(message)
+                if self.content_chars and isinstance(content, str):
+                    content = content[: self.content_chars]
+                event["messages"] = len(node_update["messages"])
+                event["message"] = {
+                    "type": message.type,
+                    "name": getattr(message, "name", None),
+                    "content": content,
+                    "tool_calls": [c["name"] for c in getattr(message, "tool_calls", None) or ()],
+                }
+            self._write(event)
+        self.last = now
+
+    def close(self) -> None:
+        self._write({"event": "end", "thread_id": self.thread_id, "updates": self.updates,
+                     "elapsed_ms": round((time.perf_counter() - self.started) * 1000, 1)})
+        self.out.flush()
+
+
+class NullSink:
+    stream_mode = "updates"
+    subgraphs = False
+
+    def feed(self, chunk) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class TokenSink:
+    """
+    LLM tokens written as they arrive, after a "[<agent namespace>]" label. Agents running
+    in parallel (fan-out) are shown one at a time: the first to emit streams live, the
+    others are buffered and written out in turn once the live one finishes (its subgraph's
+    "agent" update). Replies that were not streamed (cache hits, the merge node) are
+    written whole.
+    """
+
+    stream_mode = ["messages", "updates"]
+    subgraphs = True
+
+    def __init__(self, out=None, tool_chars: int = 200):
+        self.out = out or sys.stdout
+        self.tool_chars = tool_chars
+        self.live = None  # namespace being written out
+        self.pending: dict[tuple, list] = {}  # namespace -> [label, texts, finished]
+
+    @staticmethod
+    def label(ns: tuple, metadata: dict) -> str:
+        return " › ".join(seg.split(":", 1)[0] for seg in ns) or metadata.get("langgraph_node") or "graph"
+
+    @staticmethod
+    def _text(message) -> str:
+        content = message.content
+        if isinstance(content, list):
+            content = "".join(b.get("text", "") if isinstance(b, dict) else str(b) for b in content)
+        calls = getattr(message, "tool_call_chunks", None) if isinstance(message, AIMessageChunk) else message.tool_calls
+        names = " ".join(f"→ {c['name']}" for c in calls or () if c.get("name"))
+        return " ".join(part for part in (content, names) if part)
+
+    def feed(self, chunk) -> None:
+        ns, mode, payload = chunk
+        if mode == "updates":
+            if ns and "agent" in payload:
+                self._finish(ns)
+            return
+        message, metadata = payload
+        key = ns or (metadata.get("langgraph_node") or "",)
+        if isinstance(message, AIMessageChunk):
+            self._emit(key, self.label(ns, metadata), self._text(message), finished=False)
+        elif isinstance(message, AIMessage):
+            self._emit(key, self.label(ns, metadata), self._text(message), finished=True)
+        elif isinstance(message, ToolMessage):
+            first = str(message_content(message)).strip().split("\n", 1)[0][: self.tool_chars]
+            self._emit(key, self.label(ns, metadata), f"↳ {message.name}: {first}", finished=True)
+
+    def _write(self, text: str) -> None:
+        self.out.write(text)
+        self.out.flush()
+
+    def _emit(self, key: tuple, label: str, text: str, finished: bool) -> None:
+        if self.live is None and key not in self.pending:
+            if not text:
+                return
+            self.live = key
+            self._write(f"\n[{label}] ")
+        if self.live == key:
+            self._write(text)
+            if finished:
+                self._finish(key)
+            return
+        entry = self.pending.setdefault(key, [label, [], False])
+        entry[1].append(text)
+        entry[2] = entry[2] or finished
+
+    def _finish(self, key: tuple) -> None:
+        if key in self.pending:
+            self.pending[key][2] = True
+        if key != self.live:
+            return
+        self._write("\n")
+        self.live = None
+        # Hand the output over to the next agent that was buffered meanwhile
+        while self.pending and self.live is None:
+            key, (label, texts, finished) = next(iter(self.pending.items()))
+            del self.pending[key]
+            if not "".join(texts):
+                continue
+            self._write(f"\n[{label}] " + "".join(texts))
+            if finished:
+                self._write("\n")
+            else:
+                self.live = key
+
+    def close(self) -> None:
+        """End the turn: write out whatever is still live or buffered."""
+        if self.live is not None:
+            self._write("\n")
+            self.live = None
+        # Buffered agents are written out directly: handing them over one by one through
+        # _finish() would stall on the first one that is still unfinished
+        while self.pending:
+            key = next(iter(self.pending))
+            label, texts, _finished = self.pending.pop(key)
+            text = "".join(texts)
+            if text:
+                self._write(f"\n[{label}] {text}\n")
+
+
+SINKS = {"tokens": TokenSink, "pretty": PrettySink, "jsonl": JsonlSink, "null": NullSink}
+
+
+def sink_kind() -> str:
+    return (os.getenv("OUTPUT_SINK") or "tokens").strip().lower()
+
+
+def report_stream():
+    """Where the CLI's debug and per-turn report lines go: stderr when stdout carries JSONL or nothing."""
+    return sys.stderr if sink_kind() in ("jsonl", "null") else sys.stdout
+
+
+def make_sink(kind: Optional[str] = None, thread_id: Optional[str] = None, out=None):
+    """A fresh sink for one turn; `kind` defaults to OUTPUT_SINK (else "tokens")."""
+    kind = (kind or sink_kind()).strip().lower()
+    if kind not in SINKS:
+        raise ValueError(f"Unknown output sink {kind!r} (expected one of {', '.join(SINKS)})")
+    if kind == "jsonl":
+        return JsonlSink(out, thread_id=thread_id)
+    if kind == "null":
+        return NullSink()
+    return SINKS[kind](out)
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from langchain_core.messages import SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+# ----------------------------
+# Prompt registry
+# ----------------------------
+# System prompts live in prompts/agents/<agent>.md and may pull in shared blocks from
+# prompts/fragments/<name>.md with `{{> name}}` (fragments can include fragments). Each
+# prompt is read, assembled, hashed and token-counted once per process, on first use.
+#
+# The assembled text contains nothing per-call (no dates, ids or state), so every call of
+# an agent starts with the same bytes and the provider's prompt cache can serve that
+# prefix; anything dynamic (context digests, summaries) is added after it by the
+# pre_model_hook. PROMPTS_DIR points the registry at another prompt set.
+
+DEFAULT_PROMPTS_DIR = Path(__file__).resolve().parent / "prompts"
+_INCLUDE_RE = re.compile(r"\{\{>\s*([\w-]+)\s*\}\}")
+
+
+@dataclass(frozen=True)
+class Prompt:
+    name: str
+    text: str
+    sha256: str
+    fragments: tuple[str, ...]  # in first-use order
+    tokens: int  # approximate, same estimator as context_policy
+
+
+class PromptRegistry:
+    def __init__(self, root: str | os.PathLike | None = None):
+        self.root = Path(root or os.getenv("PROMPTS_DIR") or DEFAULT_PROMPTS_DIR)
+        self._prompts: dict[str, Prompt] = {}
+        self._fragments: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _fragment(self, name: str, stack: tuple[str, ...]) -> tuple[str, list[str]]:
+        if name in stack:
+            raise ValueError(f"Prompt fragment include cycle: {' -> '.join(stack + (name,))}")
+        if name not in self._fragments:
+            path = self.root / "fragments" / f"{name}.md"
+            if not path.exists():
+                raise KeyError(f"Unknown prompt fragment {name!r} (expected {path})")
+            self._fragments[name] = path.read_text(encoding="utf-8").rstrip("\n")
+        return self._expand(self._fragments[name], stack + (name,))
+
+    def _expand(self, text: str, stack: tuple[str, ...] = ()) -> tuple[str, list[str]]:
+        used: list[str] = []
+
+        def include(match: re.Match) -> str:
+            body, nested = self._fragment(match.group(1), stack)
+            used.extend([match.group(1), *nested])
+            return body
+
+        return _INCLUDE_RE.sub(include, text), used
+
+    def get(self, name: str) -> Prompt:
+        """The assembled system prompt for agent `name` (KeyError if there is none)."""
+        with self._lock:
+            prompt = self._prompts.get(name)
+            if prompt is None:
+                path = self.root / "agents" / f"{name}.md"
+                if not path.exists():
+                    raise KeyError(f"No prompt for agent {name!r} (expected {path})")
+                text, used = self._expand(path.read_text(encoding="utf-8"))
+                text = text.strip() + "\n"
+                prompt = self._prompts[name] = Prompt(
+                    name=name,
+                    text=text,
+                    sha256=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+                    fragments=tuple(dict.fromkeys(used)),
+                    tokens=count_tokens_approximately([SystemMessage(content=text)]),
+                )
+            return prompt
+
+    def text(self, name: str) -> str:
+        return self.get(name).text
+
+    def summary(self, names: Optional[list[str]] = None) -> dict:
+        """Per-prompt hash, size and fragments, for the prompts loaded so far (or `names`)."""
+        for name in names or ():
+            self.get(name)
+        with self._lock:
+            prompts = list(self._prompts.values())
+        return {
+            p.name: {"sha256": p.sha256[:12], "chars": len(p.text), "tokens": p.tokens, "fragments": list(p.fragments)}
+            for p in prompts
+        }
+
+
+PROMPTS = PromptRegistry()
@@ -0,0 +1,471 @@
+import asyncio
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.messages.tool import tool_call_chunk
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableBinding
+
+# ----------------------------
+# Deadlines, retries and hedging for LLM calls
+# ----------------------------
+# ResilientChatModel wraps one model (one tier, see model_tiers.py) and runs every call as
+# a race of attempts in the background while the caller waits with a deadline:
+# - deadline: the attempt must produce its reply (or, when streaming, its first chunk and
+#   every following chunk) within the tier's `timeout` (else LLM_DEADLINE_S). A blown
+#   deadline abandons the attempt; the tier chain then falls back to the next tier.
+# - retries: timeouts, connection errors, 408/409/429 and 5xx are retried up to
+#   LLM_RETRIES times with full-jitter exponential backoff (LLM_RETRY_BASE_S, capped at
+#   LLM_RETRY_MAX_S). Anything else (bad request, auth) fails straight away.
+# - hedging (LLM_HEDGE=1): if nothing has arrived after the model's recent p90 latency, a
+#   second identical request is fired and whichever answers first wins; the loser is
+#   abandoned (cancelled on the async path) and its tokens never reach callbacks.
+# - budget: every retry and hedge spends a token from one process-wide RetryBudget that
+#   only first attempts refill (LLM_RETRY_BUDGET_RATIO per call, plus a small
+#   LLM_RETRY_BUDGET_PER_S trickle), so during an outage retries stop instead of
+#   multiplying load. The provider SDK's own retries are switched off for wrapped models.
+#
+# A streamed attempt can only be retried or hedged until its first chunk is out; after
+# that, a failure or stall is raised to the caller.
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def resilience_enabled() -> bool:
+    """LLM_RESILIENCE=0 calls models directly (SDK retries, no deadlines or hedging)."""
+    return os.getenv("LLM_RESILIENCE", "1") != "0"
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+_RETRY_STATUS = {408, 409, 429}
+_RETRY_NAMES = ("Timeout", "Connection", "RateLimit", "InternalServer", "ServiceUnavailable", "Overloaded")
+
+
+def retryable(error: BaseException) -> bool:
+    """Transient failures worth another attempt: timeouts, connection errors, 408/409/429, 5xx."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in _RETRY_STATUS or status >= 500
+    return any(name in type(error).__name__ for name in _RETRY_NAMES)
+
+
+def backoff_s(attempt: int) -> float:
+    """Full jitter: uniform(0, min(max, base * 2**attempt))."""
+    base, cap = _env_float("LLM_RETRY_BASE_S", 0.5), _env_float("LLM_RETRY_MAX_S", 8.0)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RetryBudget:
+    """
+    Token bucket shared by all models: first attempts deposit `ratio` tokens, each retry
+    or hedge withdraws one; `per_s` keeps a trickle available when traffic is low.
+    """
+
+    def __init__(self, ratio: float = 0.2, per_s: float = 0.1, max_tokens: float = 10.0):
+        self.ratio, self.per_s, self.max_tokens = ratio, per_s, max_tokens
+        self._tokens = max_tokens
+        self._at = time.monotonic()
+        self._lock = threading.Lock()
+        self.denied = 0
+
+    def _refill(self, amount: float = 0.0) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._at) * self.per_s + amount)
+        self._at = now
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            self.denied += 1
+            return False
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+RETRY_BUDGET = RetryBudget(
+    ratio=_env_float("LLM_RETRY_BUDGET_RATIO", 0.2),
+    per_s=_env_float("LLM_RETRY_BUDGET_PER_S", 0.1),
+    max_tokens=_env_float("LLM_RETRY_BUDGET_MAX", 10.0),
+)
+
+
+class ResilienceStats:
+    """Per model label: calls, retries, hedges (and hedge wins), deadlines hit, first-reply latency."""
+
+    COUNTERS = ("calls", "failures", "retries", "hedges", "hedge_wins", "deadlines", "budget_denied")
+
+    def __init__(self, samples: int = 200):
+        self._lock = threading.Lock()
+        self._samples = samples
+        self.by_label: dict[str, dict] = {}
+        self._latency: dict[str, deque] = {}
+
+    def inc(self, label: str, counter: str) -> None:
+        with self._lock:
+            s = self.by_label.setdefault(label, {c: 0 for c in self.COUNTERS})
+            s[counter] += 1
+
+    def observe(self, label: str, seconds: float) -> None:
+        with self._lock:
+            self._latency.setdefault(label, deque(maxlen=self._samples)).append(seconds)
+
+    def quantile(self, label: str, q: float, min_samples: int = 0) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latency.get(label, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def summary(self) -> dict:
+        out = {}
+        with self._lock:
+            labels = {label: dict(s) for label, s in self.by_label.items()}
+        for label, s in labels.items():
+            p50, p90 = self.quantile(label, 0.5), self.quantile(label, 0.9)
+            out[label] = {**s, "p50_s": round(p50, 3) if p50 is not None else None,
+                          "p90_s": round(p90, 3) if p90 is not None else None}
+        return {"models": out, "retry_budget": round(RETRY_BUDGET.available(), 2)}
+
+
+RESILIENCE_STATS = ResilienceStats()
+
+
+def as_chunk(message: AIMessage) -> ChatGenerationChunk:
+    """A whole reply as one stream chunk (for models that cannot stream)."""
+    return ChatGenerationChunk(message=AIMessageChunk(
+        content=message.content,
+        additional_kwargs=message.additional_kwargs,
+        response_metadata=message.response_metadata,
+        tool_call_chunks=[
+            tool_call_chunk(name=tc["name"], args=json.dumps(tc["args"]), id=tc["id"], index=i)
+            for i, tc in enumerate(message.tool_calls)
+        ],
+        usage_metadata=message.usage_metadata,
+        id=message.id,
+    ))
+
+
+# ----------------------------
+# Racing attempts
+# ----------------------------
+class _Race:
+    """Which of a call's concurrent attempts owns the reply: the first to emit anything."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.winner: Optional[int] = None
+        self.abandoned: set[int] = set()
+
+    def claim(self, attempt: int) -> bool:
+        with self._lock:
+            if self.winner is None and attempt not in self.abandoned:
+                self.winner = attempt
+            return self.winner == attempt
+
+
+async def _skip(*args, **kwargs) -> None:
+    return None
+
+
+class _GatedRunManager:
+    """The call's run manager as seen by one attempt: only the winning attempt's tokens get through."""
+
+    def __init__(self, inner, race: _Race, attempt: int, is_async: bool):
+        self._inner, self._race, self._attempt, self._async = inner, race, attempt, is_async
+
+    def __getattr__(self, name: str):
+        return getattr(self._inner, name)
+
+    def on_llm_new_token(self, *args, **kwargs):
+        if self._race.claim(self._attempt):
+            return self._inner.on_llm_new_token(*args, **kwargs)
+        return _skip() if self._async else None
+
+
+class ResilientChatModel(BaseChatModel):
+    """Chat model wrapper adding deadlines, budgeted jittered retries and optional hedging."""
+
+    inner: BaseChatModel
+    label: str = ""
+    deadline_s: float = 60.0
+    max_retries: int = 1
+    hedge: bool = False
+
+    @classmethod
+    def wrap(cls, model: BaseChatModel, label: str, deadline_s: Optional[float] = None):
+        return cls(
+            inner=model.model_copy(update={"cache": False}), cache=model.cache, label=label,
+            deadline_s=deadline_s or _env_float("LLM_DEADLINE_S", 60.0),
+            max_retries=max(0, int(_env_float("LLM_RETRIES", 1))),
+            hedge=os.getenv("LLM_HEDGE", "0") == "1",
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.inner._identifying_params
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        return self.inner._get_ls_params(stop=stop, **kwargs)
+
+    def bind_tools(self, tools, **kwargs: Any):
+        bound = self.inner.bind_tools(tools, **kwargs)
+        if isinstance(bound, RunnableBinding):
+            return RunnableBinding(bound=self, kwargs=bound.kwargs, config=bound.config)
+        return self.model_copy(update={"inner": bound})
+
+    def _hedge_after(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        return RESILIENCE_STATS.quantile(self.label, _env_float("LLM_HEDGE_QUANTILE", 0.9),
+                                         min_samples=int(_env_float("LLM_HEDGE_MIN_SAMPLES", 20)))
+
+    def _begin(self) -> None:
+        RESILIENCE_STATS.inc(self.label, "calls")
+        RETRY_BUDGET.deposit()
+
+    def _retry_or_raise(self, error: BaseException, retry: int) -> None:
+        if retry >= self.max_retries or not retryable(error):
+            RESILIENCE_STATS.inc(self.label, "failures")
+            raise error
+        if not RETRY_BUDGET.withdraw():
+            RESILIENCE_STATS.inc(self.label, "budget_denied")
+            RESILIENCE_STATS.inc(self.label, "failures")
+            raise error
+        RESILIENCE_STATS.inc(self.label, "retries")
+
+    def _try_hedge(self) -> bool:
+        if RETRY_BUDGET.withdraw():
+            RESILIENCE_STATS.inc(self.label, "hedges")
+            return True
+        RESILIENCE_STATS.inc(self.label, "budget_denied")
+        return False
+
+    def _won(self, attempt: int, started: float) -> None:
+        RESILIENCE_STATS.observe(self.label, time.perf_counter() - started)
+        if attempt == 1:
+            RESILIENCE_STATS.inc(self.label, "hedge_wins")
+
+    def _deadline_error(self) -> DeadlineExceeded:
+        RESILIENCE_STATS.inc(self.label, "deadlines")
+        return DeadlineExceeded(f"{self.label or self._llm_type}: no reply within {self.deadline_s:g}s")
+
+    # -- sync: attempts run on daemon threads, the caller waits on a queue --
+    def _race_sync(self, call: Callable, run_manager):
+        """
+        Yield the winning attempt's items (chunks, or one ChatResult). `call(run_manager)`
+        starts an attempt and returns an iterator; failed tries are retried while nothing
+        has been yielded yet.
+        """
+        retry = 0
+        while True:
+            events: queue.Queue = queue.Queue()
+            race, started = _Race(), time.perf_counter()
+
+            def attempt(i: int):
+                rm = _GatedRunManager(run_manager, race, i, is_async=False) if run_manager else None
+                items = None
+                try:
+                    items = call(rm)
+                    for item in items:
+                        if i in race.abandoned:
+                            return
+                        events.put((i, "item", item))
+                    events.put((i, "done", None))
+                except Exception as e:
+                    events.put((i, "error", e))
+                finally:
+                    close = getattr(items, "close", None)
+                    if close:
+                        close()  # stops the upstream generation of an abandoned stream
+
+            def launch(i: int):
+                ctx = contextvars.copy_context()
+                threading.Thread(target=ctx.run, args=(attempt, i), daemon=True).start()
+
+            launch(0)
+            running, hedge_after, error, first = {0}, self._hedge_after(), None, True
+            deadline = started + self.deadline_s
+            try:
+                while running:
+                    wake = min(deadline, started + hedge_after) if first and hedge_after is not None else deadline
+                    try:
+                        i, kind, payload = events.get(timeout=max(0.0, wake - time.perf_counter()))
+                    except queue.Empty:
+                        if time.perf_counter() < deadline:
+                            if first and hedge_after is not None:
+                                hedge_after = None
+                                if self._try_hedge():
+                                    running.add(1)
+                                    launch(1)
+                            continue
+                        error = self._deadline_error()
+                        break
+                    if kind == "error":
+                        running.discard(i)
+                        if not first and i == race.winner:
+                            raise payload
+                        error = payload
+                        continue
+                    if not race.claim(i):
+                        continue
+                    if first:
+                        first = False
+                        race.abandoned.update(running - {i})
+                        running = {i}
+                        self._won(i, started)
+                    if kind == "done":
+                        return
+                    yield payload
+                    deadline = time.perf_counter() + self.deadline_s
+            finally:
+                race.abandoned.update({0, 1})
+            if not first:
+                raise error
+            self._retry_or_raise(error, retry)
+            time.sleep(backoff_s(retry))
+            retry += 1
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        self._begin()
+        inner = self.inner
+        if type(inner)._stream is BaseChatModel._stream:
+            def call(rm):
+                return iter([as_chunk(inner._generate(messages, stop=stop, run_manager=rm, **kwargs)
+                                      .generations[0].message)])
+        else:
+            def call(rm):
+                return inner._stream(messages, stop=stop, run_manager=rm, **kwargs)
+        yield from self._race_sync(call, run_manager)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self._begin()
+        inner = self.inner
+
+        def call(rm):
+            return iter([inner._generate(messages, stop=stop, run_manager=rm, **kwargs)])
+
+        return list(self._race_sync(call, run_manager))[0]
+
+    # -- async: attempts are tasks, losers are cancelled --
+    async def _race_async(self, call: Callable, run_manager):
+        """Async twin of _race_sync; `call(run_manager)` returns an async iterator."""
+        retry = 0
+        while True:
+            events: asyncio.Queue = asyncio.Queue()
+            race, started = _Race(), time.perf_counter()
+            tasks: dict[int, asyncio.Task] = {}
+
+            async def attempt(i: int):
+                rm = _GatedRunManager(run_manager, race, i, is_async=True) if run_manager else None
+                try:
+                    async for item in call(rm):
+                        await events.put((i, "item", item))
+                    await events.put((i, "done", None))
+                except Exception as e:
+                    await events.put((i, "error", e))
+
+            def cancel(ids):
+                race.abandoned.update(ids)
+                for j in ids:
+                    tasks[j].cancel()
+
+            tasks[0] = asyncio.ensure_future(attempt(0))
+            running, hedge_after, error, first = {0}, self._hedge_after(), None, True
+            deadline = started + self.deadline_s
+            try:
+                while running:
+                    wake = min(deadline, started + hedge_after) if first and hedge_after is not None else deadline
+                    try:
+                        i, kind, payload = await asyncio.wait_for(events.get(), max(0.0, wake - time.perf_counter()))
+                    except asyncio.TimeoutError:
+                        if time.perf_counter() < deadline:
+                            if first and hedge_after is not None:
+                                hedge_after = None
+                                if self._try_hedge():
+                                    running.add(1)
+                                    tasks[1] = asyncio.ensure_future(attempt(1))
+                            continue
+                        error = self._deadline_error()
+                        break
+                    if kind == "error":
+                        running.discard(i)
+                        if not first and i == race.winner:
+                            raise payload
+                        error = payload
+                        continue
+                    if not race.claim(i):
+                        continue
+                    if first:
+                        first = False
+                        cancel(running - {i})
+                        running = {i}
+                        self._won(i, started)
+                    if kind == "done":
+                        return
+                    yield payload
+                    deadline = time.perf_counter() + self.deadline_s
+            finally:
+                cancel(set(tasks))
+            if not first:
+                raise error
+            self._retry_or_raise(error, retry)
+            await asyncio.sleep(backoff_s(retry))
+            retry += 1
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        self._begin()
+        inner = self.inner
+        if type(inner)._astream is BaseChatModel._astream and type(inner)._stream is BaseChatModel._stream:
+            async def call(rm):
+                result = await inner._agenerate(messages, stop=stop, run_manager=rm, **kwargs)
+                yield as_chunk(result.generations[0].message)
+        else:
+            def call(rm):
+                return inner._astream(messages, stop=stop, run_manager=rm, **kwargs)
+        async for chunk in self._race_async(call, run_manager):
+            yield chunk
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self._begin()
+        inner = self.inner
+
+        async def call(rm):
+            yield await inner._agenerate(messages, stop=stop, run_manager=rm, **kwargs)
+
+        return [result async for result in self._race_async(call, run_manager)][0]
+
+
+def with_resilience(model: BaseChatModel, label: str, deadline_s: Optional[float] = None) -> BaseChatModel:
+    if not resilience_enabled():
+        return model
+    return ResilientChatModel.wrap(model, label, deadline_s)
@@ -0,0 +1,229 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from checkpointing import connect_sqlite
+
+# ----------------------------
+# Checkpoint retention for memory.db
+# ----------------------------
+# Every graph step writes a checkpoint carrying the full MessagesState, and every chat
+# session (/new) starts a fresh thread, so the checkpoint DB grows without bound. This
+# module trims it in place:
+# - keep only the latest K root checkpoints per thread
+# - drop subgraph (agent-internal) checkpoints of runs that have already finished
+# - expire whole threads that have been idle longer than a TTL
+# - vacuum (full or incremental) and truncate the WAL, reporting bytes reclaimed
+#
+# Run offline:   python retention.py --db memory.db --keep 5 --ttl-days 30
+# Or in-process: start_background_retention(...) (used by main.py / server.py when
+#                RETENTION_INTERVAL_S is set)
+
+# uuid6 timestamps count 100ns intervals since 1582-10-15; this is the offset to 1970-01-01
+_UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+
+def checkpoint_time(checkpoint_id: str) -> float:
+    """Unix time encoded in a LangGraph (uuid6, time-ordered) checkpoint id."""
+    h = uuid.UUID(checkpoint_id).hex
+    return (int(h[0:8] + h[8:12] + h[13:16], 16) - _UUID_EPOCH_OFFSET) / 1e7
+
+
+@dataclass
+class RetentionPolicy:
+    keep_latest: int = 5                 # root checkpoints kept per thread (>= 1)
+    ttl_s: Optional[float] = None        # expire threads idle longer than this
+    drop_finished_subgraphs: bool = True
+    vacuum: str = "incremental"          # "full", "incremental" or "none"
+
+
+@dataclass
+class RetentionReport:
+    checkpoints_deleted: int = 0
+    writes_deleted: int = 0
+    threads_expired: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    seconds: float = 0.0
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    def __str__(self) -> str:
+        return (f"[retention] expired {self.threads_expired} threads, deleted {self.checkpoints_deleted} "
+                f"checkpoints and {self.writes_deleted} writes; reclaimed {self.bytes_reclaimed} bytes "
+                f"({self.bytes_before} -> {self.bytes_after}) in {self.seconds:.2f}s")
+
+
+def _db_bytes(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+
+
+def _has_checkpoint_tables(conn: sqlite3.Connection) -> bool:
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return {"checkpoints", "writes"} <= names
+
+
+def expire_idle_threads(conn: sqlite3.Connection, ttl_s: float, now: Optional[float] = None) -> list[str]:
+    now = now or time.time()
+    rows = conn.execute(
+        "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints WHERE checkpoint_ns = '' GROUP BY thread_id"
+    ).fetchall()
+    expired = [thread_id for thread_id, latest in rows if now - checkpoint_time(latest) > ttl_s]
+    conn.executemany("DELETE FROM checkpoints WHERE thread_id = ?", [(t,) for t in expired])
+    conn.executemany("DELETE FROM writes WHERE thread_id = ?", [(t,) for t in expired])
+    return expired
+
+
+def keep_latest_checkpoints(conn: sqlite3.Connection, keep: int) -> int:
+    """Delete all but the newest `keep` root checkpoints of every thread."""
+    cur = conn.execute(
+        """
+        DELETE FROM checkpoints WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, ROW_NUMBER() OVER (
+                    PARTITION BY thread_id ORDER BY checkpoint_id DESC
+                ) AS rn
+                FROM checkpoints WHERE checkpoint_ns = ''
+            ) WHERE rn > ?
+        )
+        """,
+        (max(1, keep),),
+    )
+    return cur.rowcount
+
+
+def drop_finished_subgraphs(conn: sqlite3.Connection) -> int:
+    """
+    Delete subgraph checkpoints older than their thread's latest root checkpoint. A
+    subgraph run only needs its checkpoints while its parent step is in flight, and any
+    in-flight run started after the latest root checkpoint (ids are time-ordered).
+    """
+    cur = conn.execute(
+        """
+        DELETE FROM checkpoints
+        WHERE checkpoint_ns != '' AND checkpoint_id < (
+            SELECT MAX(r.checkpoint_id) FROM checkpoints r
+            WHERE r.thread_id = checkpoints.thread_id AND r.checkpoint_ns = ''
+        )
+        """
+    )
+    return cur.rowcount
+
+
+def delete_orphan_writes(conn: sqlite3.Connection) -> int:
+    cur = conn.execute(
+        """
+        DELETE FROM writes WHERE NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = writes.thread_id
+              AND c.checkpoint_ns = writes.checkpoint_ns
+              AND c.checkpoint_id = writes.checkpoint_id
+        )
+        """
+    )
+    return cur.rowcount
+
+
+def vacuum(conn: sqlite3.Connection, mode: str) -> None:
+    if mode == "full":
+        conn.execute("VACUUM")
+    elif mode == "incremental":
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # auto_vacuum can only be switched on by rebuilding the file once
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            # execute() steps the pragma once, which frees a single page; executescript()
+            # runs it to completion
+            conn.executescript("PRAGMA incremental_vacuum;")
+    elif mode != "none":
+        raise ValueError(f"Unknown vacuum mode: {mode!r}")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def run_retention(path: str, policy: RetentionPolicy) -> RetentionReport:
+    started = time.perf_counter()
+    report = RetentionReport(bytes_before=_db_bytes(path))
+    conn = connect_sqlite(path)
+    conn.isolation_level = None  # explicit transactions; VACUUM can't run inside one
+    try:
+        if _has_checkpoint_tables(conn):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if policy.ttl_s:
+                    report.threads_expired = len(expire_idle_threads(conn, policy.ttl_s))
+                report.checkpoints_deleted += keep_latest_checkpoints(conn, policy.keep_latest)
+                if policy.drop_finished_subgraphs:
+                    report.checkpoints_deleted += drop_finished_subgraphs(conn)
+                report.writes_deleted = delete_orphan_writes(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            vacuum(conn, policy.vacuum)
+    finally:
+        conn.close()
+    report.bytes_after = _db_bytes(path)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def policy_from_env() -> RetentionPolicy:
+    ttl_days = float(os.getenv("RETENTION_TTL_DAYS", "0"))
+    return RetentionPolicy(
+        keep_latest=int(os.getenv("RETENTION_KEEP", "5")),
+        ttl_s=ttl_days * 86400 or None,
+        vacuum=os.getenv("RETENTION_VACUUM", "incremental"),
+    )
+
+
+def start_background_retention(path: Optional[str] = None, policy: Optional[RetentionPolicy] = None,
+                               interval_s: Optional[float] = None) -> Optional[threading.Event]:
+    """
+    Run retention every `interval_s` seconds (default: RETENTION_INTERVAL_S; unset or 0
+    disables) on a daemon thread. Returns an Event that stops the loop when set.
+    """
+    interval_s = interval_s if interval_s is not None else float(os.getenv("RETENTION_INTERVAL_S", "0"))
+    if not interval_s:
+        return None
+    path = path or os.getenv("CHECKPOINT_DB", "memory.db")
+    policy = policy or policy_from_env()
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval_s):
+            try:
+                print(run_retention(path, policy))
+            except Exception as e:
+                print(f"[retention] failed: {e}")
+
+    threading.Thread(target=loop, name="checkpoint-retention", daemon=True).start()
+    return stop
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Trim and compact the LangGraph checkpoint DB.")
+    parser.add_argument("--db", default=os.getenv("CHECKPOINT_DB", "memory.db"))
+    parser.add_argument("--keep", type=int, default=5, help="root checkpoints kept per thread")
+    parser.add_argument("--ttl-days", type=float, default=0, help="expire threads idle this long (0 = never)")
+    parser.add_argument("--keep-subgraphs", action="store_true", help="keep finished subgraph checkpoints")
+    parser.add_argument("--vacuum", choices=["full", "incremental", "none"], default="incremental")
+    args = parser.parse_args(argv)
+    policy = RetentionPolicy(
+        keep_latest=args.keep,
+        ttl_s=args.ttl_days * 86400 or None,
+        drop_finished_subgraphs=not args.keep_subgraphs,
+        vacuum=args.vacuum,
+    )
+    print(run_retention(args.db, policy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,653 @@
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Annotated, Any, Dict, List, Literal, Optional, Union, get_args, get_origin
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.messages.ai import add_usage
+from langchain_core.messages.utils import message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableBinding
+from langgraph.prebuilt.chat_agent_executor import AgentState
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from common.csi_common.role_schemas import ROLE_OUTPUT_MODELS
+
+# ----------------------------
+# Streaming validation of role outputs
+# ----------------------------
+# The receptionist, nurse, doctor and lab prompts demand STRICT JSON with required
+# top-level keys (modelled in common/csi_common/role_schemas.py). ValidatingChatModel
+# wraps a worker's chat model, streams the reply and feeds every chunk to an
+# IncrementalJSONValidator. As soon as the text can no longer become a valid role object
+# (prose or a code fence instead of "{", a wrong "role", a required key with the wrong
+# type, broken syntax, text after the object) the upstream stream is closed and the model
+# is re-asked with the specific error. A complete object is then validated against the
+# role's pydantic model (nested fields). What can be fixed locally is repaired without
+# another call:
+# - a ```json fence around the object is stripped
+# - a reply cut off mid-object is closed, if that yields a valid object
+# - missing required keys are requested on their own and merged into the object
+#
+# Only validated (or repaired) replies reach the response cache, which is attached to
+# the wrapper rather than the inner model. The inner model reports its tokens to the
+# wrapper's run as usual, so tokens of an aborted attempt have already reached stream
+# listeners; the final message holds only the accepted reply.
+
+
+@dataclass(frozen=True)
+class RoleSchema:
+    """Top-level shape of one role's JSON reply: key -> allowed JSON types."""
+    role: Optional[str]
+    required: dict
+    optional: dict = field(default_factory=dict)
+
+    def expected_types(self, key: str) -> Optional[tuple]:
+        return self.required.get(key) or self.optional.get(key)
+
+    def describe(self) -> str:
+        return ", ".join(f"{k} ({'|'.join(t)})" for k, t in self.required.items())
+
+
+JSON_TYPES = ("object", "array", "string", "number", "boolean", "null")
+
+
+def _json_types(annotation) -> Optional[tuple]:
+    """JSON types a pydantic field annotation accepts; None when anything goes."""
+    origin = get_origin(annotation)
+    if origin is Union:
+        types = [_json_types(arg) for arg in get_args(annotation)]
+        if any(t is None for t in types):
+            return None
+        return tuple(dict.fromkeys(t for group in types for t in group))
+    if origin in (list, List, tuple):
+        return ("array",)
+    if origin in (dict, Dict) or annotation is dict or (isinstance(annotation, type) and issubclass(annotation, BaseModel)):
+        return ("object",)
+    if origin is Literal:
+        return _json_types(type(get_args(annotation)[0]))
+    if annotation is bool:
+        return ("boolean",)
+    if annotation in (int, float):
+        return ("number",)
+    if annotation is str:
+        return ("string",)
+    return None
+
+
+def schema_from_model(role: str, model: type) -> RoleSchema:
+    """The top-level part of a pydantic role model that can be checked while streaming."""
+    required, optional = {}, {}
+    for name, info in model.model_fields.items():
+        types = _json_types(info.annotation)
+        if info.is_required():
+            required[name] = types or JSON_TYPES
+        elif types:
+            optional[name] = types
+    return RoleSchema(role, required, optional)
+
+
+# Compiled once at import; reused for every reply (see common/csi_common/role_schemas.py)
+ROLE_OUTPUT_ADAPTERS = {role: TypeAdapter(model) for role, model in ROLE_OUTPUT_MODELS.items()}
+ROLE_OUTPUT_SCHEMAS = {role: schema_from_model(role, model) for role, model in ROLE_OUTPUT_MODELS.items()}
+
+
+def parse_role_output(agent: str, text: str) -> Optional[dict]:
+    """Validated, compact (defaults dropped) dict of `agent`'s reply, or None if it doesn't validate."""
+    adapter = ROLE_OUTPUT_ADAPTERS.get(agent)
+    if adapter is None:
+        return None
+    try:
+        return adapter.validate_json(text).model_dump(mode="json", exclude_defaults=True)
+    except ValidationError:
+        return None
+
+
+def _model_error(agent: str, text: str, offset: int) -> Optional["RoleOutputError"]:
+    adapter = ROLE_OUTPUT_ADAPTERS.get(agent)
+    if adapter is None:
+        return None
+    try:
+        adapter.validate_json(text)
+    except ValidationError as e:
+        details = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()[:5])
+        return RoleOutputError("schema", f"schema validation failed ({details})", offset)
+    return None
+
+
+class RoleOutputError(ValueError):
+    """Why a (partial) reply can't be a valid role object; `offset` is the character index."""
+
+    def __init__(self, kind: str, message: str, offset: int):
+        super().__init__(message)
+        self.kind = kind  # prose | syntax | role | type | missing_keys | trailing | truncated | empty | schema
+        self.offset = offset
+
+
+_LITERAL_CHARS = set("0123456789+-.eEtruefalsn")
+_NUMBER = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$")
+_FENCE = re.compile(r"```[A-Za-z]*$")
+
+
+class IncrementalJSONValidator:
+    """
+    Push-down JSON checker fed one chunk at a time. It keeps only a container stack and
+    the current token, so each character is looked at once however long the reply is.
+    `feed()` returns the first RoleOutputError (and keeps returning it); `close()` adds
+    the checks that need the whole reply (truncation, missing keys).
+    """
+
+    def __init__(self, schema: RoleSchema):
+        self.schema = schema
+        self.offset = 0
+        self.error: Optional[RoleOutputError] = None
+        self.keys: list[str] = []        # top-level keys, in order
+        self.fenced = False
+        self.start_offset: Optional[int] = None
+        self.end_offset: Optional[int] = None
+        self._top = "start"              # start | fence | body | done
+        self._fence = ""
+        self._stack: list[list] = []     # [kind ("{" or "["), state]
+        self._string: Optional[list] = None
+        self._string_is_key = False
+        self._escape = False
+        self._literal: list[str] = []
+        self._key: Optional[str] = None  # current top-level key
+
+    # -- public API --
+    def feed(self, text: str) -> Optional[RoleOutputError]:
+        if self.error is None:
+            try:
+                for ch in text:
+                    self._char(ch)
+                    self.offset += 1
+            except RoleOutputError as e:
+                self.error = e
+        return self.error
+
+    def close(self) -> Optional[RoleOutputError]:
+        if self.error is not None:
+            return self.error
+        try:
+            if self._literal:
+                self._end_literal()
+            if self._top == "start":
+                self._fail("empty", "the reply is empty")
+            if self._string is not None or self._stack or self._top != "done":
+                self._fail("truncated", "the reply ends before the JSON object is closed")
+        except RoleOutputError as e:
+            self.error = e
+        return self.error
+
+    @property
+    def missing_keys(self) -> list[str]:
+        return [k for k in self.schema.required if k not in self.keys]
+
+    # -- state machine --
+    def _fail(self, kind: str, message: str):
+        raise RoleOutputError(kind, message, self.offset)
+
+    def _char(self, c: str) -> None:
+        if self._string is not None:
+            self._string_char(c)
+            return
+        if self._literal:
+            if c in _LITERAL_CHARS:
+                self._literal.append(c)
+                return
+            self._end_literal()
+        if not self._stack:
+            self._top_char(c)
+            return
+        if c in " \t\r\n":
+            return
+        frame = self._stack[-1]
+        kind, state = frame
+        if kind == "{":
+            if state in ("key_or_end", "key") and c == '"':
+                self._start_string(is_key=True)
+            elif state in ("key_or_end", "comma_or_end") and c == "}":
+                self._close()
+            elif state == "colon" and c == ":":
+                frame[1] = "value"
+            elif state == "value":
+                frame[1] = "comma_or_end"
+                self._start_value(c)
+            elif state == "comma_or_end" and c == ",":
+                frame[1] = "key"
+            else:
+                self._fail("syntax", f"unexpected {c!r} in an object")
+        else:
+            if state == "value_or_end" and c == "]":
+                self._close()
+            elif state in ("value_or_end", "value"):
+                frame[1] = "comma_or_end"
+                self._start_value(c)
+            elif state == "comma_or_end" and c == ",":
+                frame[1] = "value"
+            elif state == "comma_or_end" and c == "]":
+                self._close()
+            else:
+                self._fail("syntax", f"unexpected {c!r} in an array")
+
+    def _top_char(self, c: str) -> None:
+        if self._top == "fence":
+            if c == "\n":
+                if not _FENCE.match(self._fence):
+                    self._fail("prose", "the reply must start with '{'")
+                self.fenced, self._top = True, "start"
+            elif len(self._fence) > 16:
+                self._fail("prose", "the reply must start with '{'")
+            else:
+                self._fence += c
+            return
+        if c in " \t\r\n":
+            return
+        if self._top == "start":
+            if c == "{":
+                self.start_offset = self.offset
+                self._stack.append(["{", "key_or_end"])
+                self._top = "body"
+            elif c == "`" and not self.fenced:
+                self._top, self._fence = "fence", c
+            else:
+                self._fail("prose", f"the reply must be a JSON object starting with '{{', not {c!r}")
+        elif self._top == "done":
+            if not (self.fenced and c == "`"):
+                self._fail("trailing", "text follows the JSON object")
+
+    def _start_value(self, c: str) -> None:
+        type_ = ("object" if c == "{" else "array" if c == "[" else "string" if c == '"'
+                 else "boolean" if c in "tf" else "null" if c == "n"
+                 else "number" if c in "-0123456789" else None)
+        if type_ is None:
+            self._fail("syntax", f"unexpected {c!r} where a value should start")
+        if len(self._stack) == 1 and self._key is not None:
+            allowed = self.schema.expected_types(self._key)
+            if allowed and type_ not in allowed:
+                self._fail("type", f'"{self._key}" must be {" or ".join(allowed)}, not {type_}')
+        if c in "{[":
+            self._stack.append([c, "key_or_end" if c == "{" else "value_or_end"])
+        elif c == '"':
+            self._start_string(is_key=False)
+        else:
+            self._literal.append(c)
+
+    def _start_string(self, is_key: bool) -> None:
+        self._string, self._string_is_key, self._escape = [], is_key, False
+
+    def _string_char(self, c: str) -> None:
+        if self._escape:
+            self._escape = False
+            self._string.append(c)
+        elif c == "\\":
+            self._escape = True
+        elif c == '"':
+            value = "".join(self._string)
+            self._string = None
+            self._end_string(value)
+        elif c < " ":
+            self._fail("syntax", "unescaped control character inside a string")
+        else:
+            self._string.append(c)
+            if self._checking_role():
+                expected = self.schema.role
+                if not expected.startswith("".join(self._string).lower()):
+                    self._fail("role", f'"role" must be "{expected}"')
+
+    def _checking_role(self) -> bool:
+        return (not self._string_is_key and len(self._stack) == 1 and self._key == "role"
+                and self.schema.role is not None)
+
+    def _end_string(self, value: str) -> None:
+        if self._string_is_key:
+            self._stack[-1][1] = "colon"
+            if len(self._stack) == 1:
+                self._key = value
+                self.keys.append(value)
+        elif self._checking_role() and value.lower() != self.schema.role:
+            self._fail("role", f'"role" must be "{self.schema.role}"')
+
+    def _end_literal(self) -> None:
+        text = "".join(self._literal)
+        self._literal = []
+        if text not in ("true", "false", "null") and not _NUMBER.match(text):
+            self._fail("syntax", f"invalid literal {text!r}")
+
+    def _close(self) -> None:
+        self._stack.pop()
+        if not self._stack:
+            self._top = "done"
+            self.end_offset = self.offset + 1
+            missing = self.missing_keys
+            if missing:
+                self._fail("missing_keys", f"missing required keys: {', '.join(missing)}")
+
+
+def validate_role_output(text: str, schema: RoleSchema) -> Optional[RoleOutputError]:
+    validator = IncrementalJSONValidator(schema)
+    validator.feed(text)
+    return validator.close()
+
+
+def repair_role_output(text: str, validator: IncrementalJSONValidator) -> Optional[str]:
+    """
+    The bare JSON object of a reply that is fenced, followed by other text or cut off
+    mid-object, if that alone makes it valid; None when the model has to be asked again.
+    """
+    error, start = validator.error, validator.start_offset
+    if start is None:
+        return None
+    if error is None or error.kind == "trailing":
+        body = text[start:validator.end_offset]
+    elif error.kind == "truncated":
+        body = _close_truncated(text[start:], validator)
+    else:
+        return None
+    if body is None or validate_role_output(body, validator.schema) is not None:
+        return None
+    return body
+
+
+def _close_truncated(body: str, validator: IncrementalJSONValidator) -> Optional[str]:
+    tail = '"' if validator._string is not None else ""
+    closers = "".join("}" if kind == "{" else "]" for kind, _ in reversed(validator._stack))
+    for candidate in (body + tail + closers, body.rstrip().rstrip(",") + closers):
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            continue
+    return None
+
+
+class ValidationStats:
+    """How role replies were accepted, and how often the model had to be re-asked, per agent."""
+
+    OUTCOMES = ("valid", "repaired", "invalid", "tool_call")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_agent: dict[str, dict] = {}
+
+    def _agent(self, agent: str) -> dict:
+        return self.by_agent.setdefault(agent, {**{o: 0 for o in self.OUTCOMES}, "retries": 0, "aborted_chars": 0})
+
+    def record(self, agent: str, outcome: str) -> None:
+        with self._lock:
+            self._agent(agent)[outcome] += 1
+
+    def record_retry(self, agent: str, aborted_chars: int) -> None:
+        with self._lock:
+            s = self._agent(agent)
+            s["retries"] += 1
+            s["aborted_chars"] += aborted_chars
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {agent: dict(s) for agent, s in self.by_agent.items()}
+
+
+VALIDATION_STATS = ValidationStats()
+
+
+def _add_usage(left, right):
+    return add_usage(left, right) if left and right else (left or right)
+
+
+def _retry_instruction(schema: RoleSchema, error: RoleOutputError) -> str:
+    return (
+        f"Your previous reply was rejected at character {error.offset}: {error}. "
+        f'Reply again with STRICT JSON ONLY: a single object that starts with {{"role": "{schema.role}"}} '
+        f"and has these top-level keys: {schema.describe()}. No markdown, no code fences, no prose."
+    )
+
+
+def _missing_keys_instruction(missing: list[str]) -> str:
+    return (
+        f"Your JSON is missing required keys: {', '.join(missing)}. Reply with STRICT JSON ONLY: "
+        "an object containing just those keys (the rest of your answer is kept)."
+    )
+
+
+@dataclass
+class _Attempt:
+    message: AIMessage
+    text: str
+    error: Optional[RoleOutputError]
+    validator: IncrementalJSONValidator
+    tool_call: bool
+    aborted: bool
+
+
+class ValidatingChatModel(BaseChatModel):
+    """
+    Chat model wrapper that validates a role's JSON reply while it streams and retries
+    or repairs it (see module notes). Tool-calling replies are passed through untouched.
+    """
+
+    inner: BaseChatModel
+    role_schema: RoleSchema
+    agent: str = ""
+    max_retries: int = 1
+
+    @classmethod
+    def wrap(cls, model: BaseChatModel, schema: RoleSchema, agent: str, max_retries: int = 1):
+        # The cache moves to the wrapper so that only accepted replies are stored
+        return cls(inner=model.model_copy(update={"cache": False}), role_schema=schema, agent=agent,
+                   max_retries=max_retries, cache=model.cache)
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {**self.inner._identifying_params, "validated_role": self.role_schema.role}
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        return self.inner._get_ls_params(stop=stop, **kwargs)
+
+    def bind_tools(self, tools, **kwargs: Any):
+        # Let the inner model format the tools, then route the bound call through this wrapper
+        bound = self.inner.bind_tools(tools, **kwargs)
+        if isinstance(bound, RunnableBinding):
+            return RunnableBinding(bound=self, kwargs=bound.kwargs, config=bound.config)
+        return self.model_copy(update={"inner": bound})
+
+    # -- one attempt --
+    def _streams(self) -> bool:
+        return type(self.inner)._stream is not BaseChatModel._stream
+
+    def _attempt(self, messages, stop, run_manager, final: bool, schema: RoleSchema, **kwargs) -> _Attempt:
+        validator = IncrementalJSONValidator(schema)
+        if not self._streams():
+            result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return self._judge(result.generations[0].message, validator, aborted=False)
+        merged: Optional[AIMessageChunk] = None
+        aborted = False
+        stream = self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        try:
+            for chunk in stream:
+                merged = chunk.message if merged is None else merged + chunk.message
+                if merged.tool_call_chunks or final:
+                    continue
+                if isinstance(chunk.message.content, str) and validator.feed(chunk.message.content):
+                    aborted = True
+                    break
+        finally:
+            stream.close()  # stops the upstream generation when aborted early
+        return self._judge(message_chunk_to_message(merged or AIMessageChunk(content="")), validator, aborted)
+
+    async def _aattempt(self, messages, stop, run_manager, final: bool, schema: RoleSchema, **kwargs) -> _Attempt:
+        validator = IncrementalJSONValidator(schema)
+        if not self._streams() and type(self.inner)._astream is BaseChatModel._astream:
+            result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return self._judge(result.generations[0].message, validator, aborted=False)
+        merged: Optional[AIMessageChunk] = None
+        aborted = False
+        stream = self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+        try:
+            async for chunk in stream:
+                merged = chunk.message if merged is None else merged + chunk.message
+                if merged.tool_call_chunks or final:
+                    continue
+                if isinstance(chunk.message.content, str) and validator.feed(chunk.message.content):
+                    aborted = True
+                    break
+        finally:
+            await stream.aclose()
+        return self._judge(message_chunk_to_message(merged or AIMessageChunk(content="")), validator, aborted)
+
+    @staticmethod
+    def _judge(message: AIMessage, validator: IncrementalJSONValidator, aborted: bool) -> _Attempt:
+        text = message.content if isinstance(message.content, str) else ""
+        if message.tool_calls:
+            return _Attempt(message, text, None, validator, tool_call=True, aborted=False)
+        if not aborted:
+            # Non-streaming replies (or the final, uninterrupted attempt) are checked in one go
+            if validator.offset < len(text):
+                validator.feed(text[validator.offset:])
+            validator.close()
+        return _Attempt(message, text, validator.error, validator, tool_call=False, aborted=aborted)
+
+    # -- retry / repair policy --
+    def _plan(self, messages: list):
+        """
+        The retry/repair decisions, shared by the sync and async paths: yields
+        (messages, final, schema) for each model call, receives the _Attempt, and
+        returns the ChatResult.
+        """
+        history = list(messages)
+        attempt: _Attempt = yield history, self.max_retries == 0, self.role_schema
+        usage = attempt.message.usage_metadata
+        retries = 0
+        while True:
+            if attempt.tool_call:
+                return self._accept(attempt.message, attempt.text, usage, "tool_call")
+            body = repair_role_output(attempt.text, attempt.validator)
+            if body is not None:
+                # Top-level shape is fine; now the nested fields (user stories, FHIR mapping, ...)
+                attempt.error = _model_error(self.agent, body, len(attempt.text))
+                if attempt.error is None:
+                    outcome = "valid" if body == attempt.text else "repaired"
+                    return self._accept(attempt.message, body, usage, outcome)
+            if retries >= self.max_retries:
+                return self._accept(attempt.message, attempt.text, usage, "invalid")
+            retries += 1
+            wasted = attempt.aborted and attempt.error.kind != "missing_keys"
+            VALIDATION_STATS.record_retry(self.agent, len(attempt.text) if wasted else 0)
+            rejected = AIMessage(content=attempt.text)
+            if attempt.error.kind == "missing_keys":
+                # Ask for just the missing keys and merge them in, instead of regenerating everything
+                missing = attempt.validator.missing_keys
+                follow_up = yield (
+                    history + [rejected, HumanMessage(content=_missing_keys_instruction(missing))],
+                    True, RoleSchema(None, {k: self.role_schema.required[k] for k in missing}),
+                )
+                usage = _add_usage(usage, follow_up.message.usage_metadata)
+                extra = repair_role_output(follow_up.text, follow_up.validator)
+                if extra is not None:
+                    v = attempt.validator
+                    merged = {**json.loads(attempt.text[v.start_offset:v.end_offset]), **json.loads(extra)}
+                    text = json.dumps(merged, ensure_ascii=False)
+                    attempt.error = _model_error(self.agent, text, len(text))
+                    if attempt.error is None:
+                        return self._accept(attempt.message, text, usage, "repaired")
+                    # The next round repairs/slices the merged text: its validator (offsets,
+                    # missing keys) has to describe that text, not the original reply
+                    validator = IncrementalJSONValidator(self.role_schema)
+                    validator.feed(text)
+                    validator.close()
+                    attempt.text, attempt.validator = text, validator
+                    attempt.error = validator.error or attempt.error
+                continue
+            attempt = yield (
+                history + [rejected, HumanMessage(content=_retry_instruction(self.role_schema, attempt.error))],
+                retries >= self.max_retries, self.role_schema,
+            )
+            usage = _add_usage(usage, attempt.message.usage_metadata)
+
+    def _accept(self, message: AIMessage, text: str, usage, outcome: str) -> ChatResult:
+        VALIDATION_STATS.record(self.agent, outcome)
+        update: dict = {} if message.tool_calls else {"content": text}
+        if usage:
+            update["usage_metadata"] = usage
+        return ChatResult(generations=[ChatGeneration(message=message.model_copy(update=update))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        plan = self._plan(messages)
+        request = next(plan)
+        while True:
+            history, final, schema = request
+            attempt = self._attempt(history, stop, run_manager, final, schema, **kwargs)
+            try:
+                request = plan.send(attempt)
+            except StopIteration as done:
+                return done.value
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        plan = self._plan(messages)
+        request = next(plan)
+        while True:
+            history, final, schema = request
+            attempt = await self._aattempt(history, stop, run_manager, final, schema, **kwargs)
+            try:
+                request = plan.send(attempt)
+            except StopIteration as done:
+                return done.value
+
+
+def role_validation_retries() -> Optional[int]:
+    """ROLE_VALIDATION=0 disables validation; ROLE_VALIDATION_RETRIES caps re-asks (default 1)."""
+    if os.getenv("ROLE_VALIDATION", "1") == "0":
+        return None
+    return max(0, int(os.getenv("ROLE_VALIDATION_RETRIES", "1")))
+
+
+def with_role_validation(model: BaseChatModel, agent: str) -> BaseChatModel:
+    schema = ROLE_OUTPUT_SCHEMAS.get(agent)
+    retries = role_validation_retries()
+    if schema is None or retries is None:
+        return model
+    return ValidatingChatModel.wrap(model, schema, agent, max_retries=retries)
+
+
+# ----------------------------
+# Structured side-channel
+# ----------------------------
+# Accepted role replies are also kept, validated and as dicts, in `role_outputs`
+# (role -> fields of its latest reply, or None if that reply didn't validate) next to
+# `messages`, so the merge node and the architect read fields
+# directly instead of re-parsing (or re-prompting over) the JSON text.
+
+
+def merge_role_outputs(left: Optional[dict], right: Optional[dict]) -> dict:
+    """Reducer: parallel workers each add their own role's entry."""
+    return {**(left or {}), **(right or {})}
+
+
+class RoleAgentState(AgentState):
+    role_outputs: Annotated[dict, merge_role_outputs]
+
+
+def make_role_output_hook(agent: str):
+    """
+    Build a `post_model_hook` that stores the agent's validated reply in `role_outputs`
+    and rewrites the message as compact JSON (same id, so it replaces the original).
+    """
+    def role_output_hook(state):
+        last = state["messages"][-1]
+        if not isinstance(last, AIMessage) or last.tool_calls or not isinstance(last.content, str):
+            return {}
+        data = parse_role_output(agent, last.content)
+        if data is None:
+            # Don't leave an older reply standing in for this one
+            return {"role_outputs": {agent: None}}
+        compact = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        return {"messages": [last.model_copy(update={"content": compact})], "role_outputs": {agent: data}}
+
+    return role_output_hook
@@ -0,0 +1,265 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+# ----------------------------
+# Deterministic pre-router
+# ----------------------------
+# Runs before the LLM supervisor on the first hop of every turn. Each stage either returns
+# a confident decision (jump straight to that worker node) or abstains; if every stage
+# abstains the turn falls back to the supervisor's `transfer_to_<agent>` tool call.
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _tokens(text: str) -> list[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+@dataclass
+class RouteDecision:
+    agent: Optional[str]      # worker node name, or None to fall back to the supervisor
+    confidence: float
+    source: str               # stage that produced the decision ("keyword", "classifier", "supervisor")
+
+
+class KeywordRouter:
+    """
+    Route when the text mentions keywords of exactly one worker.
+    `rules` maps worker node name -> phrases (matched on word boundaries, case-insensitive).
+    """
+    name = "keyword"
+
+    def __init__(self, rules: dict[str, list[str]]):
+        self.patterns = {
+            agent: re.compile(r"\b(?:" + "|".join(re.escape(p.lower()) for p in phrases) + r")\b")
+            for agent, phrases in rules.items() if phrases
+        }
+
+    def route(self, text: str) -> Optional[RouteDecision]:
+        lowered = (text or "").lower()
+        matched = [agent for agent, pattern in self.patterns.items() if pattern.search(lowered)]
+        if len(matched) == 1:
+            return RouteDecision(agent=matched[0], confidence=1.0, source=self.name)
+        return None
+
+    def learn(self, text: str, agent: str) -> None:
+        pass
+
+
+class HashedBowClassifier:
+    """
+    Multinomial naive Bayes over a hashed bag of words and bigrams, trained online on the
+    supervisor's past routing decisions. Abstains until it has seen `min_examples`
+    decisions or when the top posterior is below `threshold`.
+    """
+    name = "classifier"
+
+    def __init__(self, n_features: int = 4096, threshold: float = 0.9, min_examples: int = 20,
+                 path: str | os.PathLike | None = None):
+        self.n_features = n_features
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.path = Path(path) if path else None
+        self.docs: dict[str, int] = {}                   # agent -> number of training examples
+        self.counts: dict[str, dict[int, int]] = {}      # agent -> hashed feature -> count
+        self.totals: dict[str, int] = {}                 # agent -> total feature count
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            self._load()
+
+    def _features(self, text: str) -> list[int]:
+        toks = _tokens(text)
+        grams = toks + [f"{a} {b}" for a, b in zip(toks, toks[1:])]
+        # crc32 rather than hash(): the model is persisted, so hashing must be stable across runs
+        return [zlib.crc32(g.encode("utf-8")) % self.n_features for g in grams]
+
+    def route(self, text: str) -> Optional[RouteDecision]:
+        with self._lock:
+            n_docs = sum(self.docs.values())
+            if n_docs < self.min_examples or len(self.docs) < 2:
+                return None
+            feats = self._features(text)
+            if not feats:
+                return None
+            scores = {}
+            for agent, docs in self.docs.items():
+                counts, total = self.counts[agent], self.totals[agent]
+                score = math.log(docs / n_docs)
+                for f in feats:
+                    score += math.log((counts.get(f, 0) + 1) / (total + self.n_features))
+                scores[agent] = score
+        # softmax over log-likelihoods -> posterior of the best class
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        posterior = 1.0 / sum(math.exp(s - top) for s in scores.values())
+        if posterior < self.threshold:
+            return None
+        return RouteDecision(agent=best, confidence=posterior, source=self.name)
+
+    def learn(self, text: str, agent: str) -> None:
+        feats = self._features(text)
+        if not feats:
+            return
+        with self._lock:
+            self.docs[agent] = self.docs.get(agent, 0) + 1
+            counts = self.counts.setdefault(agent, {})
+            for f in feats:
+                counts[f] = counts.get(f, 0) + 1
+            self.totals[agent] = self.totals.get(agent, 0) + len(feats)
+            if self.path:
+                self._save()
+
+    def _load(self) -> None:
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        if data.get("n_features") != self.n_features:
+            return
+        self.docs = data["docs"]
+        self.counts = {a: {int(f): c for f, c in fc.items()} for a, fc in data["counts"].items()}
+        self.totals = data["totals"]
+
+    def _save(self) -> None:
+        data = {"n_features": self.n_features, "docs": self.docs, "counts": self.counts, "totals": self.totals}
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+class PreRouter:
+    """
+    Ordered chain of routing stages with hit-rate and latency-saved accounting.
+
+    Latency saved is estimated from the supervisor's own routing latency: every time the
+    pre-router falls back, the time until the supervisor's first handoff is measured and
+    folded into a moving average, which is credited to each turn the pre-router handles.
+
+    Per-thread state (the pending fallback timer and the last decision for report()) is
+    kept for the `max_threads` most recently routed threads only: the server and batch
+    runner route a fresh thread per request and never call report().
+    """
+
+    def __init__(self, stages: list, agent_names: list[str], default_routing_latency: float = 1.0,
+                 max_threads: int = 1024):
+        self.stages = stages
+        self.agent_names = set(agent_names)
+        self.routing_latency = default_routing_latency   # EMA of supervisor routing latency (s)
+        self.turns = 0
+        self.hits: dict[str, int] = {}
+        self.saved_s = 0.0
+        self.max_threads = max_threads
+        self._fallback_started: OrderedDict[str, float] = OrderedDict()
+        self._last: OrderedDict[str, RouteDecision] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def route(self, text: str, thread_id: str | None = None) -> RouteDecision:
+        decision = None
+        for stage in self.stages:
+            decision = stage.route(text)
+            if decision and decision.agent in self.agent_names:
+                break
+            decision = None
+        with self._lock:
+            self.turns += 1
+            if decision:
+                self.hits[decision.source] = self.hits.get(decision.source, 0) + 1
+                self.saved_s += self.routing_latency
+            else:
+                decision = RouteDecision(agent=None, confidence=0.0, source="supervisor")
+                if thread_id:
+                    self._remember(self._fallback_started, thread_id, time.perf_counter())
+            if thread_id:
+                self._remember(self._last, thread_id, decision)
+        return decision
+
+    def _remember(self, per_thread: OrderedDict, thread_id: str, value) -> None:
+        # caller holds self._lock
+        per_thread[thread_id] = value
+        per_thread.move_to_end(thread_id)
+        while len(per_thread) > self.max_threads:
+            per_thread.popitem(last=False)
+
+    def observe(self, messages: list, agent: str, thread_id: str | None = None) -> None:
+        """
+        Called from the supervisor's handoff tools. Learns from the supervisor's first
+        handoff of a turn and measures how long that routing decision took.
+        """
+        text = _first_hop_request(messages)
+        if text is None:
+            return
+        with self._lock:
+            started = self._fallback_started.pop(thread_id, None) if thread_id else None
+            if started is not None:
+                elapsed = time.perf_counter() - started
+                self.routing_latency = 0.8 * self.routing_latency + 0.2 * elapsed
+        for stage in self.stages:
+            stage.learn(text, agent)
+
+    @property
+    def hit_rate(self) -> float:
+        return sum(self.hits.values()) / self.turns if self.turns else 0.0
+
+    def report(self, thread_id: str) -> Optional[str]:
+        """One-line summary of the last routing decision on `thread_id` plus running totals."""
+        with self._lock:
+            decision = self._last.pop(thread_id, None)
+        if decision is None:
+            return None
+        if decision.agent:
+            head = (f"{decision.source} -> {decision.agent} (conf {decision.confidence:.2f}), "
+                    f"saved ~{self.routing_latency:.2f}s")
+        else:
+            head = "fallback to supervisor"
+        hits = sum(self.hits.values())
+        return (f"[router] {head} | hit rate {hits}/{self.turns} ({self.hit_rate:.0%}) | "
+                f"total saved ~{self.saved_s:.1f}s")
+
+
+def _first_hop_request(messages: list) -> Optional[str]:
+    """
+    Return the latest user message if no handoff has happened since it, i.e. the handoff
+    being made now is the first routing decision for that request; otherwise None.
+    """
+    for msg in reversed(messages):
+        msg_type = getattr(msg, "type", None) or (msg.get("role") if isinstance(msg, dict) else None)
+        if msg_type in ("human", "user"):
+            content = msg.content if hasattr(msg, "content") else msg.get("content")
+            return content if isinstance(content, str) else None
+        if msg_type == "tool":
+            name = getattr(msg, "name", None) or (msg.get("name") if isinstance(msg, dict) else None)
+            if name and name.startswith("transfer_to_"):
+                return None
+    return None
+
+
+DEFAULT_KEYWORD_RULES = {
+    "receptionist": ["front desk", "receptionist", "appointment", "appointments", "scheduling",
+                     "reminder", "reminders", "check-in", "waitlist", "pre-registration"],
+    "nurse": ["nurse", "nursing", "medication administration", "mar", "vitals", "injection teaching"],
+    "doctor": ["doctor", "physician", "stimulation protocol", "diagnosis", "e-prescription", "ohss"],
+    "lab": ["lab", "laboratory", "embryology", "andrology", "embryo", "specimen", "vitrification",
+            "incubator", "semen analysis"],
+    "architect": ["architect", "architecture", "system design", "microservice design", "api design"],
+    "business_analyst": ["business analyst", "prd", "user stories", "requirements document",
+                         "feature epic"],
+}
+
+
+def build_pre_router(agent_names: list[str]) -> PreRouter:
+    """Keyword rules first, then the hashed bag-of-words classifier (persisted to PREROUTER_MODEL)."""
+    model_path = os.getenv("PREROUTER_MODEL", "routing_model.json")
+    return PreRouter(
+        stages=[
+            KeywordRouter({a: p for a, p in DEFAULT_KEYWORD_RULES.items() if a in agent_names}),
+            HashedBowClassifier(path=model_path),
+        ],
+        agent_names=agent_names,
+        max_threads=int(os.getenv("PREROUTER_MAX_THREADS", "1024")),
+    )
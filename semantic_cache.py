@@ -0,0 +1,474 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+import numpy as np
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, convert_to_messages
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+
+# ----------------------------
+# Semantic response cache for worker agents
+# ----------------------------
+# The exact-match cache (llm_cache.py) only helps when a request is repeated verbatim.
+# Product owners keep asking the same thing in other words, and every variant runs the
+# doctor, nurse and lab agents again. This tier sits in front of a worker node: the
+# opening request of a conversation is embedded with a local hashed n-gram model (no
+# network, no model files) and compared by cosine similarity with that role's earlier
+# requests. A stored reply is served as the worker's reply, without running the agent,
+# only if the similarity reaches the role's threshold AND the two requests' content terms
+# overlap (terms_match): bag-of-ngram similarity alone scores "IVF cycle monitoring" vs
+# "IVF cycle billing" as high as a real paraphrase. Every hit is written to an audit table.
+#
+# Labelled pairs the thresholds and the term rule were tuned on (cosine in brackets):
+#   served   "IVF cycle monitoring requirements" / "requirements for IVF stimulation
+#            monitoring" (0.63), "embryo vitrification workflow" / "workflow for
+#            vitrifying embryos" (0.57), "nurse triage of OHSS symptoms" / "nursing triage
+#            for OHSS symptoms" (0.82), "Requirements for oocyte retrieval scheduling" /
+#            "What do we need for scheduling oocyte retrievals?" (0.84)
+#   refused  "IVF cycle monitoring" / "IVF cycle billing" (0.63), "embryo transfer consent
+#            workflow" / "embryo freezing consent workflow" (0.71), "medication schedule
+#            reminders" / "appointment schedule reminders" (0.81), "sperm
+#            cryopreservation consent" / "embryo cryopreservation consent" (0.77)
+# Rewordings score 0.57-1.0 and topic swaps up to ~0.81, so the cosine threshold only
+# shortlists candidates and the term rule decides.
+#
+# What is cached is deliberately narrow:
+# - only a conversation's first request: later turns are answered in the light of earlier
+#   ones, which the key can't capture (and "yes" / "continue" would match anything)
+# - only requests with at least `min_terms` content terms
+# - only final, validated replies of runs that made no tool calls, since a hit skips the
+#   agent's document writes
+# Entries are keyed by role and system prompt hash, so editing a prompt starts that role
+# from an empty cache.
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by define describe do does during for from give how i in is it list me need "
+    "needs of on or our please requirement requirements should that the their this to we what when which "
+    "with you your".split()
+)
+# Longest first; only one is stripped ("vitrification"/"vitrifying" -> "vitr")
+_SUFFIXES = ("ification", "ications", "ication", "ations", "ation", "ifying", "ified", "ings", "ing",
+             "ies", "ied", "es", "ed", "s", "e", "y")
+
+
+def stem(word: str) -> str:
+    """Crude suffix stripping cut to 5 characters ("nursing"/"nurses" -> "nurs")."""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[: -len(suffix)]
+            break
+    return word[:5]
+
+
+# Terms nearly every clinic request carries: they neither make two requests the same
+# question nor different ones
+_GENERIC_TERMS = frozenset(stem(w) for w in "clinic cycle ivf patient process system workflow".split())
+
+
+def terms_match(a: frozenset[str], b: frozenset[str], min_overlap: float = 0.5) -> bool:
+    """
+    Whether two requests' content terms (HashedNgramEmbedder.terms) ask the same thing:
+    the discriminative (non-generic) terms of one contain the other's, so nothing was
+    swapped ("monitoring" vs "billing"), and their Jaccard overlap is at least
+    `min_overlap`, so one is not a much narrower question. With only generic terms the
+    sets must be equal.
+    """
+    da, db = a - _GENERIC_TERMS, b - _GENERIC_TERMS
+    if not da and not db:
+        return a == b
+    if not (da <= db or db <= da):
+        return False
+    return len(da & db) / len(da | db) >= min_overlap
+
+
+class HashedNgramEmbedder:
+    """
+    Feature hashing of word unigrams, word bigrams and character trigrams into a `dim`
+    vector (signed, so collisions cancel out on average), L2-normalised. Unigrams carry
+    the topic, trigrams absorb inflections ("symptom"/"symptoms") and bigrams some order.
+    Stopwords include words every request here shares ("requirements") so they don't
+    inflate the similarity of unrelated requests.
+    """
+
+    def __init__(self, dim: int = 2048, weights: tuple[float, float, float] = (1.0, 0.3, 0.5)):
+        self.dim = dim
+        self.weights = weights
+
+    @staticmethod
+    def _words(text: str) -> list[str]:
+        return [w for w in _TOKEN_RE.findall(text.lower()) if w not in _STOPWORDS]
+
+    def _add(self, vec: np.ndarray, feature: str, weight: float) -> None:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % self.dim] += weight if (h >> 63) & 1 else -weight
+
+    def terms(self, text: str) -> frozenset[str]:
+        """Stemmed content words ("cycles" -> "cycl", "monitoring" -> "monit")."""
+        return frozenset(stem(w) for w in self._words(text))
+
+    def embed(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        words = self._words(text)
+        w_word, w_bigram, w_char = self.weights
+        for i, word in enumerate(words):
+            self._add(vec, "w:" + word, w_word)
+            if i:
+                self._add(vec, f"b:{words[i - 1]} {word}", w_bigram)
+            padded = f"#{word}#"
+            for j in range(len(padded) - 2):
+                self._add(vec, "c:" + padded[j:j + 3], w_char)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+
+
+class SemanticCache:
+    """
+    Per-role semantic cache: SQLite rows (request, reply, embedding) with one in-memory
+    matrix per role for the cosine search.
+    - `thresholds`: role -> minimum cosine similarity to serve a hit; roles not in it are never cached
+    - `max_entries`: per role; least recently used entries are evicted past it
+    - `ttl_s`: entries older than this are ignored and deleted (None = no expiry)
+    - `audit_rows`: size of the audit trail (oldest rows are trimmed)
+    - `min_terms`: requests with fewer content terms are neither looked up nor stored
+    - `min_overlap`: Jaccard overlap of discriminative terms a hit needs (see terms_match)
+    """
+
+    def __init__(
+            self,
+            path: str | os.PathLike = "semantic_cache.db",
+            thresholds: Optional[dict[str, float]] = None,
+            embedder: Optional[HashedNgramEmbedder] = None,
+            max_entries: int = 512,
+            ttl_s: Optional[float] = 7 * 24 * 3600,
+            audit_rows: int = 10_000,
+            min_terms: int = 2,
+            min_overlap: float = 0.5,
+    ):
+        self.thresholds = dict(thresholds or {})
+        self.embedder = embedder or HashedNgramEmbedder()
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.audit_rows = audit_rows
+        self.min_terms = min_terms
+        self.min_overlap = min_overlap
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_cache ("
+            " id TEXT PRIMARY KEY, role TEXT NOT NULL, scope TEXT NOT NULL, query TEXT NOT NULL,"
+            " reply TEXT NOT NULL, role_output TEXT, vector BLOB NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS semantic_cache_role ON semantic_cache(role, scope)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_cache_audit ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, thread_id TEXT, role TEXT NOT NULL,"
+            " query TEXT NOT NULL, entry_id TEXT NOT NULL, cached_query TEXT NOT NULL,"
+            " similarity REAL NOT NULL, threshold REAL NOT NULL)"
+        )
+        # (role, scope) -> (entry ids, float32 matrix of their unit vectors)
+        self._index: dict[tuple[str, str], tuple[list[str], np.ndarray]] = {}
+        self.stats_by_role: dict[str, dict[str, int]] = {}
+
+    def enabled_for(self, role: str) -> bool:
+        return role in self.thresholds
+
+    def cacheable(self, role: str, query: str) -> bool:
+        return self.enabled_for(role) and len(self.embedder.terms(query)) >= self.min_terms
+
+    def _count(self, role: str, key: str, n: int = 1) -> None:
+        counts = self.stats_by_role.setdefault(role, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+        counts[key] += n
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_s is not None and now - created > self.ttl_s
+
+    def _scope(self, scope: str) -> str:
+        # vectors of another dimension (SEMANTIC_CACHE_DIM changed) are never compared
+        return f"{scope}:{self.embedder.dim}"
+
+    # -- internals (caller holds self._lock) --
+    def _load(self, role: str, scope: str) -> tuple[list[str], np.ndarray]:
+        key = (role, scope)
+        if key not in self._index:
+            rows = self._conn.execute(
+                "SELECT id, vector FROM semantic_cache WHERE role = ? AND scope = ?", (role, scope)
+            ).fetchall()
+            ids = [r[0] for r in rows]
+            matrix = (np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows]) if rows
+                      else np.zeros((0, self.embedder.dim), dtype=np.float32))
+            self._index[key] = (ids, matrix)
+        return self._index[key]
+
+    def _drop(self, role: str, scope: str, entry_ids: list[str]) -> None:
+        if not entry_ids:
+            return
+        self._conn.executemany("DELETE FROM semantic_cache WHERE id = ?", [(i,) for i in entry_ids])
+        ids, matrix = self._load(role, scope)
+        gone = set(entry_ids)
+        keep = [i for i, entry_id in enumerate(ids) if entry_id not in gone]
+        self._index[(role, scope)] = ([ids[i] for i in keep], matrix[keep])
+        self._count(role, "evictions", len(entry_ids))
+
+    def _evict(self, role: str, scope: str) -> None:
+        now = time.time()
+        if self.ttl_s is not None:
+            expired = self._conn.execute(
+                "SELECT id FROM semantic_cache WHERE role = ? AND scope = ? AND created < ?",
+                (role, scope, now - self.ttl_s),
+            ).fetchall()
+            self._drop(role, scope, [r[0] for r in expired])
+        excess = len(self._load(role, scope)[0]) - self.max_entries
+        if excess > 0:
+            lru = self._conn.execute(
+                "SELECT id FROM semantic_cache WHERE role = ? AND scope = ? ORDER BY accessed LIMIT ?",
+                (role, scope, excess),
+            ).fetchall()
+            self._drop(role, scope, [r[0] for r in lru])
+
+    # -- public API --
+    def lookup(self, role: str, scope: str, query: str, thread_id: Optional[str] = None) -> Optional[dict]:
+        """
+        The most similar stored reply whose request reaches the role's threshold and whose
+        content terms match those of `query` (terms_match): {"reply", "role_output",
+        "entry_id", "cached_query", "similarity"}.
+        """
+        if not self.cacheable(role, query):
+            return None
+        threshold = self.thresholds[role]
+        scope = self._scope(scope)
+        vector = self.embedder.embed(query)
+        terms = self.embedder.terms(query)
+        now = time.time()
+        with self._lock:
+            ids, matrix = self._load(role, scope)
+            scores = matrix @ vector
+            row = None
+            for i in np.argsort(-scores)[:8]:
+                similarity = float(scores[i])
+                if similarity < threshold:
+                    break
+                candidate = self._conn.execute(
+                    "SELECT query, reply, role_output, created FROM semantic_cache WHERE id = ?", (ids[i],)
+                ).fetchone()
+                if candidate is None or self._expired(candidate[3], now):
+                    continue
+                if terms_match(self.embedder.terms(candidate[0]), terms, self.min_overlap):
+                    row, entry_id = candidate, ids[i]
+                    break
+            if row is None:
+                self._count(role, "misses")
+                return None
+            self._conn.execute(
+                "UPDATE semantic_cache SET accessed = ?, hits = hits + 1 WHERE id = ?", (now, entry_id)
+            )
+            self._conn.execute(
+                "INSERT INTO semantic_cache_audit"
+                " (ts, thread_id, role, query, entry_id, cached_query, similarity, threshold)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, thread_id, role, query, entry_id, row[0], similarity, threshold),
+            )
+            self._conn.execute(
+                "DELETE FROM semantic_cache_audit WHERE seq <= (SELECT MAX(seq) FROM semantic_cache_audit) - ?",
+                (self.audit_rows,),
+            )
+            self._count(role, "hits")
+        return {
+            "reply": row[1],
+            "role_output": json.loads(row[2]) if row[2] else None,
+            "entry_id": entry_id,
+            "cached_query": row[0],
+            "similarity": round(similarity, 4),
+        }
+
+    def store(self, role: str, scope: str, query: str, reply: str, role_output: Optional[dict] = None) -> Optional[str]:
+        """Remember `reply` (and its validated role output) as the role's answer to `query`."""
+        if not self.cacheable(role, query):
+            return None
+        scope = self._scope(scope)
+        vector = self.embedder.embed(query)
+        entry_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            ids, matrix = self._load(role, scope)
+            self._conn.execute(
+                "INSERT INTO semantic_cache (id, role, scope, query, reply, role_output, vector, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry_id, role, scope, query, reply,
+                 json.dumps(role_output, ensure_ascii=False) if role_output is not None else None,
+                 vector.tobytes(), now, now),
+            )
+            self._index[(role, scope)] = (ids + [entry_id], np.vstack([matrix, vector[None, :]]))
+            self._count(role, "stores")
+            self._evict(role, scope)
+        return entry_id
+
+    def audit(self, limit: int = 50, role: Optional[str] = None) -> list[dict]:
+        """Most recent hits first: what was served, to which thread, for which request."""
+        sql = ("SELECT ts, thread_id, role, query, entry_id, cached_query, similarity, threshold"
+               " FROM semantic_cache_audit")
+        args: tuple = ()
+        if role:
+            sql += " WHERE role = ?"
+            args = (role,)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY seq DESC LIMIT ?", args + (limit,)).fetchall()
+        keys = ("ts", "thread_id", "role", "query", "entry_id", "cached_query", "similarity", "threshold")
+        return [dict(zip(keys, r)) for r in rows]
+
+    def clear(self, role: Optional[str] = None) -> None:
+        with self._lock:
+            if role:
+                self._conn.execute("DELETE FROM semantic_cache WHERE role = ?", (role,))
+                self._index = {k: v for k, v in self._index.items() if k[0] != role}
+            else:
+                self._conn.execute("DELETE FROM semantic_cache")
+                self._index.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            sizes = dict(self._conn.execute("SELECT role, COUNT(*) FROM semantic_cache GROUP BY role").fetchall())
+            roles = {}
+            for role, threshold in self.thresholds.items():
+                counts = dict(self.stats_by_role.get(role, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}))
+                total = counts["hits"] + counts["misses"]
+                roles[role] = {"threshold": threshold, "entries": sizes.get(role, 0), **counts,
+                               "hit_rate": round(counts["hits"] / total, 3) if total else 0.0}
+            audited = self._conn.execute("SELECT COUNT(*) FROM semantic_cache_audit").fetchone()[0]
+        return {"roles": roles, "audit_rows": audited}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+# ----------------------------
+# Worker node wrapper
+# ----------------------------
+def opening_request(messages: list) -> Optional[str]:
+    """
+    Text of the conversation's user request if it is the only one so far, else None: the
+    cache key is the whole user side of the conversation, so later turns are not cached.
+    """
+    requests = [m for m in convert_to_messages(messages) if isinstance(m, HumanMessage)]
+    if len(requests) != 1:
+        return None
+    content = requests[0].content
+    if isinstance(content, list):
+        content = " ".join(b.get("text", "") if isinstance(b, dict) else str(b) for b in content)
+    return content
+
+
+def _final_reply(new_messages: list, role: str) -> Optional[AIMessage]:
+    """The run's final reply, or None if there is none or the run called tools."""
+    if any(isinstance(m, ToolMessage) or (isinstance(m, AIMessage) and m.tool_calls) for m in new_messages):
+        return None
+    last = new_messages[-1] if new_messages else None
+    if isinstance(last, AIMessage) and isinstance(last.content, str) and last.content:
+        if last.name in (None, role):
+            return last
+    return None
+
+
+def with_semantic_cache(node: RunnableLambda, role: str, scope: str, cache: SemanticCache) -> RunnableLambda:
+    """
+    Wrap a worker graph node: serve a cached reply when the conversation's opening request
+    is close enough to one the role already answered, otherwise run the node and store its
+    final reply. Runs that called tools are not stored (a hit would skip their writes), nor
+    are replies of structured roles (role_validation) that didn't validate. `scope` (e.g.
+    the system prompt hash) separates entries that must not be mixed.
+    """
+
+    def _hit(state: dict, config: RunnableConfig):
+        query = opening_request(state.get("messages") or [])
+        if query is None:
+            return None, None
+        thread_id = (config or {}).get("configurable", {}).get("thread_id")
+        found = cache.lookup(role, scope, query, thread_id=thread_id)
+        if found is None:
+            return query, None
+        message = AIMessage(
+            content=found["reply"],
+            name=role,
+            id=f"semcache-{uuid.uuid4().hex}",
+            response_metadata={"semantic_cache": {k: found[k] for k in ("entry_id", "cached_query", "similarity")}},
+        )
+        update = {"messages": [message]}
+        if found["role_output"] is not None:
+            update["role_outputs"] = {role: found["role_output"]}
+        return query, update
+
+    def _remember(state: dict, query: Optional[str], result) -> None:
+        if query is None or not isinstance(result, dict):
+            return
+        seen = {getattr(m, "id", None) for m in convert_to_messages(state.get("messages") or [])}
+        new_messages = [m for m in result.get("messages") or [] if getattr(m, "id", None) not in seen]
+        reply = _final_reply(new_messages, role)
+        outputs = result.get("role_outputs") or {}
+        if reply is None or (role in outputs and outputs[role] is None):
+            return
+        cache.store(role, scope, query, reply.content, outputs.get(role))
+
+    def _invoke(state: dict, config: RunnableConfig):
+        query, update = _hit(state, config)
+        if update is not None:
+            return update
+        result = node.invoke(state, config)
+        _remember(state, query, result)
+        return result
+
+    async def _ainvoke(state: dict, config: RunnableConfig):
+        query, update = _hit(state, config)
+        if update is not None:
+            return update
+        result = await node.ainvoke(state, config)
+        _remember(state, query, result)
+        return result
+
+    return RunnableLambda(_invoke, afunc=_ainvoke, name=node.name or role)
+
+
+_DEFAULT_CACHE: Optional[SemanticCache] = None
+_DEFAULT_CACHE_LOCK = threading.Lock()
+
+
+def default_semantic_cache(default_thresholds: Optional[dict[str, float]] = None) -> Optional[SemanticCache]:
+    """
+    Process-wide cache configured from the environment (created on first use):
+    SEMANTIC_CACHE=0 disables it; SEMANTIC_CACHE_THRESHOLD_<ROLE> overrides a role's
+    threshold (0 turns the role off), SEMANTIC_CACHE_DB, SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_TTL (seconds, 0 = never expire), SEMANTIC_CACHE_DIM,
+    SEMANTIC_CACHE_AUDIT_ROWS, SEMANTIC_CACHE_MIN_TERMS and SEMANTIC_CACHE_MIN_OVERLAP
+    tune it.
+    """
+    global _DEFAULT_CACHE
+    if os.getenv("SEMANTIC_CACHE", "1") == "0":
+        return None
+    with _DEFAULT_CACHE_LOCK:
+        if _DEFAULT_CACHE is None:
+            thresholds = {}
+            for role, threshold in (default_thresholds or {}).items():
+                threshold = float(os.getenv(f"SEMANTIC_CACHE_THRESHOLD_{role.upper()}", str(threshold)))
+                if threshold > 0:
+                    thresholds[role] = threshold
+            ttl = float(os.getenv("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600)))
+            _DEFAULT_CACHE = SemanticCache(
+                path=os.getenv("SEMANTIC_CACHE_DB", "semantic_cache.db"),
+                thresholds=thresholds,
+                embedder=HashedNgramEmbedder(dim=int(os.getenv("SEMANTIC_CACHE_DIM", "2048"))),
+                max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512")),
+                ttl_s=ttl or None,
+                audit_rows=int(os.getenv("SEMANTIC_CACHE_AUDIT_ROWS", "10000")),
+                min_terms=int(os.getenv("SEMANTIC_CACHE_MIN_TERMS", "2")),
+                min_overlap=float(os.getenv("SEMANTIC_CACHE_MIN_OVERLAP", "0.5")),
+            )
+        return _DEFAULT_CACHE
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import os
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from langchain_core.messages import convert_to_messages
+from pydantic import BaseModel
+
+from checkpointing import aclose_checkpointer, open_checkpointer
+from context_policy import CONTEXT_STATS
+from llm_cache import default_response_cache
+from metrics import METRICS
+from model_tiers import TIER_HEALTH
+from resilience import RESILIENCE_STATS
+from main import (
+    ARTIFACT_STORE,
+    DEFAULT_SEMANTIC_THRESHOLDS,
+    build_supervisor,
+    default_pre_router,
+    message_content,
+    prompt_stats,
+)
+from retention import start_background_retention
+from role_validation import VALIDATION_STATS
+from semantic_cache import default_semantic_cache
+
+# ----------------------------
+# Async HTTP service around the compiled supervisor graph
+# ----------------------------
+# The graph is compiled once at startup and shared by every request; each request runs on
+# its own thread_id, so many clinic users can be served concurrently from one process.
+
+
+class ChatRequest(BaseModel):
+    message: str
+    thread_id: Optional[str] = None
+
+
+class ChatResponse(BaseModel):
+    thread_id: str
+    content: Optional[str] = None
+
+
+# One lock per thread_id: runs on different threads proceed concurrently, while two
+# requests for the same conversation are serialized so their checkpoints don't interleave.
+# Weak values: a lock lives only while a request holds or waits on it (their `async with`
+# keeps it referenced), so idle conversations don't accumulate locks.
+_THREAD_LOCKS: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _thread_lock(thread_id: str) -> asyncio.Lock:
+    lock = _THREAD_LOCKS.get(thread_id)
+    if lock is None:
+        lock = _THREAD_LOCKS[thread_id] = asyncio.Lock()
+    return lock
+
+
+def _serialize_message(msg) -> dict:
+    return {
+        "type": msg.type,
+        "name": getattr(msg, "name", None),
+        "content": message_content(msg),
+        "tool_calls": getattr(msg, "tool_calls", None) or [],
+    }
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _encode_chunk(chunk) -> list[str]:
+    """Turn one `astream(..., subgraphs=True)` chunk into zero or more SSE frames."""
+    ns, mode, payload = chunk
+    namespace = list(ns)
+    if mode == "messages":
+        message, metadata = payload
+        text = message_content(message)
+        if not text:
+            return []
+        return [_sse("token", {
+            "namespace": namespace,
+            "node": metadata.get("langgraph_node"),
+            "content": text,
+        })]
+
+    frames = []
+    for node_name, node_update in payload.items():
+        if not isinstance(node_update, dict) or not node_update.get("messages"):
+            continue
+        # Only the newest message is sent; the client already has the rest.
+        last = convert_to_messages(node_update["messages"][-1:])[0]
+        frames.append(_sse("update", {
+            "namespace": namespace,
+            "node": node_name,
+            "message": _serialize_message(last),
+        }))
+    return frames
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The "sqlite" backend is sync-only; the server needs "pooled" (default) or "memory".
+    checkpointer = open_checkpointer()
+    app.state.graph = build_supervisor(checkpointer=checkpointer, pre_router=default_pre_router())
+    stop_retention = start_background_retention()
+    try:
+        yield
+    finally:
+        if stop_retention is not None:
+            stop_retention.set()
+        await aclose_checkpointer(checkpointer)
+
+
+app = FastAPI(title="IVF orchestrator", lifespan=lifespan)
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    llm_cache = default_response_cache()
+    return llm_cache.stats() if llm_cache else {"enabled": False}
+
+
+@app.get("/context/stats")
+async def context_stats():
+    return CONTEXT_STATS.summary()
+
+
+@app.get("/prompts/stats")
+async def prompts_stats():
+    return prompt_stats()
+
+
+@app.get("/models/stats")
+async def models_stats():
+    return {**TIER_HEALTH.summary(), "resilience": RESILIENCE_STATS.summary()}
+
+
+@app.get("/validation/stats")
+async def validation_stats():
+    return VALIDATION_STATS.summary()
+
+
+@app.get("/semantic-cache/stats")
+async def semantic_cache_stats():
+    semantic_cache = default_semantic_cache(DEFAULT_SEMANTIC_THRESHOLDS)
+    return semantic_cache.stats() if semantic_cache else {"enabled": False}
+
+
+@app.get("/semantic-cache/audit")
+async def semantic_cache_audit(limit: int = 50, role: Optional[str] = None):
+    """Latest replies served from the semantic cache: request, matched request, similarity."""
+    semantic_cache = default_semantic_cache(DEFAULT_SEMANTIC_THRESHOLDS)
+    return semantic_cache.audit(limit=limit, role=role) if semantic_cache else []
+
+
+@app.get("/artifacts/{thread_id}")
+async def list_artifacts(thread_id: str, name: Optional[str] = None):
+    """Latest version of every document saved in `thread_id`, or all versions of `name`."""
+    return [asdict(v) for v in ARTIFACT_STORE.versions(thread_id, name)]
+
+
+@app.get("/artifacts/{thread_id}/{name}", response_class=PlainTextResponse)
+async def get_artifact(thread_id: str, name: str, version: Optional[int] = None):
+    try:
+        return ARTIFACT_STORE.get(thread_id, name, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: per-node, LLM, tool and checkpoint latency histograms."""
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(body: ChatRequest, request: Request):
+    """Run one turn to completion and return the final message."""
+    thread_id = body.thread_id or f"session-{uuid.uuid4().hex[:8]}"
+    cfg = {"configurable": {"thread_id": thread_id}}
+    async with _thread_lock(thread_id):
+        result = await request.app.state.graph.ainvoke(
+            {"messages": [{"role": "user", "content": body.message}]}, config=cfg
+        )
+    messages = result.get("messages") or []
+    return ChatResponse(thread_id=thread_id, content=message_content(messages[-1]) if messages else None)
+
+
+@app.post("/chat/stream")
+async def chat_stream(body: ChatRequest, request: Request):
+    """
+    Run one turn and stream it as Server-Sent Events:
+    - `token`:  LLM tokens as they are generated, labelled with the emitting node
+    - `update`: the newest message of each node update
+    - `end` / `error`: terminal event
+    """
+    thread_id = body.thread_id or f"session-{uuid.uuid4().hex[:8]}"
+    cfg = {"configurable": {"thread_id": thread_id}}
+    graph = request.app.state.graph
+
+    async def events():
+        yield _sse("start", {"thread_id": thread_id})
+        try:
+            async with _thread_lock(thread_id):
+                async for chunk in graph.astream(
+                        {"messages": [{"role": "user", "content": body.message}]},
+                        config=cfg,
+                        stream_mode=["updates", "messages"],
+                        subgraphs=True,
+                ):
+                    if await request.is_disconnected():
+                        return
+                    for frame in _encode_chunk(chunk):
+                        yield frame
+        except Exception as e:
+            yield _sse("error", {"thread_id": thread_id, "error": str(e)})
+            return
+        yield _sse("end", {"thread_id": thread_id})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "8000")))